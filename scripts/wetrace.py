@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Wetrace 命令行启动器
+参数与 wetrace_api.py 完全相同。有守护进程（wetrace_api.py serve）在运行时把命令
+转发给它执行，省去解释器加载模块、构建解析器和建立连接的开销；否则直接在本进程执行。
+为了启动快，本文件只导入几个轻量的标准库模块。
+
+设置环境变量 WETRACE_NO_DAEMON=1 可以不经过守护进程。
+"""
+
+import os
+import socket
+import stat
+import struct
+import sys
+
+# 守护进程的默认地址（可通过环境变量 WETRACE_DAEMON_SOCKET 指定）
+DEFAULT_DAEMON_PATH = os.path.expanduser('~/.wetrace/daemon.sock')
+
+# 协议标识
+PROTOCOL_MAGIC = b'WTD1'
+
+# 响应帧的通道：退出码、标准输出、标准错误
+CHANNEL_EXIT = 0
+CHANNEL_STDOUT = 1
+CHANNEL_STDERR = 2
+
+# 控制请求（代替命令行参数发送）
+CONTROL_STOP = '--daemon-stop'
+CONTROL_STATUS = '--daemon-status'
+
+# 单个字段的长度上限（字节）
+MAX_FIELD_SIZE = 256 * 1024 * 1024
+
+# 不转发给守护进程的命令
+LOCAL_COMMANDS = ('serve', 'repl')
+
+
+def daemon_path() -> str:
+    """守护进程的地址文件路径"""
+    return os.environ.get('WETRACE_DAEMON_SOCKET') or DEFAULT_DAEMON_PATH
+
+
+def recv_exact(sock: socket.socket, size: int) -> bytes:
+    """读取指定字节数，连接提前关闭时抛出 ConnectionError"""
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError('守护进程连接已关闭')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def pack_request(token: str, argv, cwd: str = '', env=None, stdin=None) -> bytes:
+    """
+    编码请求
+
+    格式：PROTOCOL_MAGIC、字段数（4 字节大端），之后每个字段为长度（4 字节大端）加内容。
+    字段依次为令牌、工作目录、环境变量（"K=V" 以 \\0 分隔）、是否带标准输入、
+    标准输入内容和命令行参数。
+    """
+    env_block = '\0'.join(f"{key}={value}" for key, value in (env or {}).items())
+    fields = [token.encode('utf-8'), cwd.encode('utf-8'), env_block.encode('utf-8'),
+              b'1' if stdin is not None else b'', stdin or b'']
+    fields += [arg.encode('utf-8', 'surrogateescape') for arg in argv]
+    return PROTOCOL_MAGIC + struct.pack('>I', len(fields)) + b''.join(
+        struct.pack('>I', len(field)) + field for field in fields)
+
+
+def read_request(sock: socket.socket) -> dict:
+    """读取并解码请求，格式见 pack_request"""
+    if recv_exact(sock, 4) != PROTOCOL_MAGIC:
+        raise ValueError('无效的请求')
+    count, = struct.unpack('>I', recv_exact(sock, 4))
+    if count < 5:
+        raise ValueError('无效的请求')
+    fields = []
+    for _ in range(count):
+        size, = struct.unpack('>I', recv_exact(sock, 4))
+        if size > MAX_FIELD_SIZE:
+            raise ValueError('请求过大')
+        fields.append(recv_exact(sock, size))
+    token, cwd, env_block, has_stdin, stdin = fields[:5]
+    env = dict(item.split('=', 1) for item in env_block.decode('utf-8').split('\0') if '=' in item)
+    return {
+        'token': token.decode('utf-8'),
+        'cwd': cwd.decode('utf-8'),
+        'env': env,
+        'stdin': stdin if has_stdin else None,
+        'argv': [field.decode('utf-8', 'surrogateescape') for field in fields[5:]],
+    }
+
+
+def pack_frame(channel: int, payload: bytes) -> bytes:
+    """编码响应帧：通道（1 字节）、长度（4 字节大端）和内容"""
+    return struct.pack('>BI', channel, len(payload)) + payload
+
+
+def connect(path: str, timeout: float = 2.0):
+    """
+    连接守护进程
+
+    path 是 Unix socket 时直接连接；是普通文件时从中读取 "tcp 主机 端口 令牌" 并连接 TCP 端口。
+
+    Returns:
+        (socket, 令牌)，守护进程未运行时返回 None
+    """
+    try:
+        mode = os.stat(path).st_mode
+        if stat.S_ISSOCK(mode):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            try:
+                sock.connect(path)
+            except OSError:
+                sock.close()
+                raise
+            token = ''
+        else:
+            with open(path, encoding='utf-8') as f:
+                kind, host, port, token = f.read().split()
+            if kind != 'tcp':
+                return None
+            sock = socket.create_connection((host, int(port)), timeout=timeout)
+    except (OSError, ValueError):
+        return None
+    sock.settimeout(None)
+    return sock, token
+
+
+def send_request(path: str, argv, cwd: str = '', env=None, stdin=None,
+                 stdout=None, stderr=None):
+    """
+    向守护进程发送请求，并把输出写入 stdout/stderr（二进制流）
+
+    Returns:
+        退出码，守护进程未运行时返回 None
+    """
+    connection = connect(path)
+    if connection is None:
+        return None
+    sock, token = connection
+    with sock:
+        sock.sendall(pack_request(token, argv, cwd, env, stdin))
+        while True:
+            channel, size = struct.unpack('>BI', recv_exact(sock, 5))
+            payload = recv_exact(sock, size)
+            if channel == CHANNEL_EXIT:
+                return int(payload or b'0')
+            stream = stdout if channel == CHANNEL_STDOUT else stderr
+            if stream is not None:
+                stream.write(payload)
+                stream.flush()
+
+
+def forward(argv):
+    """
+    把命令转发给守护进程执行
+
+    Returns:
+        退出码，守护进程未运行时返回 None
+    """
+    stdin = None
+    if '-' in argv and not sys.stdin.isatty():
+        # 命令从标准输入读取会话 ID 等内容
+        stdin = sys.stdin.buffer.read()
+    env = {key: value for key, value in os.environ.items() if key.startswith('WETRACE_')}
+    try:
+        return send_request(daemon_path(), argv, os.getcwd(), env, stdin,
+                            sys.stdout.buffer, sys.stderr.buffer)
+    except BrokenPipeError:
+        # 下游（如 head）提前关闭了管道
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return 1
+    except (ConnectionError, struct.error) as e:
+        print(f"错误: 守护进程连接中断: {e}", file=sys.stderr)
+        return 1
+
+
+def main(argv=None) -> int:
+    """命令行入口"""
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if os.environ.get('WETRACE_NO_DAEMON') != '1' and not any(arg in LOCAL_COMMANDS for arg in argv):
+        code = forward(argv)
+        if code is not None:
+            return code
+    from wetrace_api import main as run
+
+    return run(argv)
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        sys.exit(130)
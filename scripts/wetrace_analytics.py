@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Wetrace 本地统计分析
+把消息流压缩为 array 列存储，一次遍历算出小时/星期/每日/月度分布、
+24×7 热力图、消息类型分布和发送者排行，结构与服务端分析接口一致
+"""
+
+import datetime
+import time
+from array import array
+from typing import Optional, List, Dict, Any, Iterable
+
+from wetrace_api import message_sender
+
+# 消息类型名称
+MESSAGE_TYPE_NAMES = {
+    1: '文本',
+    3: '图片',
+    34: '语音',
+    43: '视频',
+    47: '表情包',
+    49: '链接/文件',
+    10000: '系统消息',
+}
+
+# 统计需要的消息字段（拉取消息时传给 fields 参数；发送者由 message_sender 推断，
+# 群聊需要 Content 开头的 "wxid:\n"）
+MESSAGE_FIELDS = ('CreateTime', 'Type', 'IsSender', 'Talker', 'Sender', 'Content')
+
+# 1970-01-01 是星期四（0=周日）
+EPOCH_WEEKDAY = 4
+
+
+class MessageColumns:
+    """
+    消息的紧凑列存储
+
+    只保留统计需要的字段：CreateTime、Type、IsSender 和发送者（见 message_sender，
+    群聊中无法确定发送者的消息记为 None）。发送者按出现顺序编号，列中只存编号。
+    """
+
+    __slots__ = ('create_time', 'type', 'is_sender', 'sender', 'senders', '_sender_ids')
+
+    def __init__(self):
+        self.create_time = array('q')
+        self.type = array('l')
+        self.is_sender = array('b')
+        self.sender = array('l')
+        self.senders: List[Optional[str]] = []
+        self._sender_ids: Dict[Optional[str], int] = {}
+
+    def __len__(self) -> int:
+        return len(self.create_time)
+
+    def append(self, msg: Dict):
+        """追加一条消息"""
+        sender = message_sender(msg)
+        sender_id = self._sender_ids.get(sender)
+        if sender_id is None:
+            sender_id = self._sender_ids[sender] = len(self.senders)
+            self.senders.append(sender)
+        self.create_time.append(msg.get('CreateTime') or 0)
+        self.type.append(msg.get('Type') or 0)
+        self.is_sender.append(1 if msg.get('IsSender') else 0)
+        self.sender.append(sender_id)
+
+    def extend(self, messages: Iterable[Dict]):
+        """追加消息流，逐条压缩，不保留原始字典"""
+        for msg in messages:
+            self.append(msg)
+
+    @classmethod
+    def from_messages(cls, messages: Iterable[Dict]) -> 'MessageColumns':
+        """从消息流（get_messages / iter_messages / MirrorStore.iter_messages）构建列存储"""
+        columns = cls()
+        columns.extend(messages)
+        return columns
+
+
+class _UtcOffsets:
+    """按小时缓存本地时区偏移，兼顾夏令时与速度"""
+
+    __slots__ = ('fixed', '_cache')
+
+    def __init__(self, utc_offset: Optional[int] = None):
+        self.fixed = utc_offset
+        self._cache: Dict[int, int] = {}
+
+    def __call__(self, timestamp: int) -> int:
+        if self.fixed is not None:
+            return self.fixed
+        bucket = timestamp // 3600
+        offset = self._cache.get(bucket)
+        if offset is None:
+            offset = self._cache[bucket] = time.localtime(bucket * 3600).tm_gmtoff
+        return offset
+
+
+def compute_all(columns: MessageColumns,
+                start: Optional[int] = None,
+                end: Optional[int] = None,
+                utc_offset: Optional[int] = None) -> Dict[str, Any]:
+    """
+    一次遍历计算全部统计
+
+    Args:
+        columns: 消息列存储
+        start: 起始时间戳（含），None 表示不限
+        end: 结束时间戳（含），None 表示不限
+        utc_offset: 固定的时区偏移（秒），默认使用本地时区
+
+    Returns:
+        包含 hourly、weekday、daily、monthly、type_distribution、heatmap、
+        senders 和 summary 的字典
+    """
+    offsets = _UtcOffsets(utc_offset)
+    hourly = array('q', [0]) * 24
+    weekday = array('q', [0]) * 7
+    heatmap = array('q', [0]) * (24 * 7)
+    daily: Dict[int, int] = {}
+    types: Dict[int, int] = {}
+    sender_counts = array('q', [0]) * len(columns.senders)
+    sent = 0
+    total = 0
+    first = last = None
+
+    create_times = columns.create_time
+    msg_types = columns.type
+    is_sender = columns.is_sender
+    sender_ids = columns.sender
+
+    for i in range(len(create_times)):
+        ts = create_times[i]
+        if (start is not None and ts < start) or (end is not None and ts > end):
+            continue
+        local = ts + offsets(ts)
+        day = local // 86400
+        hour = (local % 86400) // 3600
+        wday = (day + EPOCH_WEEKDAY) % 7
+
+        hourly[hour] += 1
+        weekday[wday] += 1
+        heatmap[wday * 24 + hour] += 1
+        daily[day] = daily.get(day, 0) + 1
+        msg_type = msg_types[i]
+        types[msg_type] = types.get(msg_type, 0) + 1
+        sender_counts[sender_ids[i]] += 1
+        sent += is_sender[i]
+        total += 1
+        if first is None or ts < first:
+            first = ts
+        if last is None or ts > last:
+            last = ts
+
+    epoch = datetime.date(1970, 1, 1)
+    daily_list = []
+    monthly: Dict[str, int] = {}
+    for day in sorted(daily):
+        date = epoch + datetime.timedelta(days=day)
+        daily_list.append({'Date': date.isoformat(), 'Count': daily[day]})
+        month = date.strftime('%Y-%m')
+        monthly[month] = monthly.get(month, 0) + daily[day]
+
+    type_distribution = [
+        {
+            'Type': msg_type,
+            'TypeName': MESSAGE_TYPE_NAMES.get(msg_type, '其他'),
+            'Count': count,
+            'Percentage': round(count * 100 / total, 1) if total else 0.0,
+        }
+        for msg_type, count in sorted(types.items(), key=lambda item: -item[1])
+    ]
+
+    senders = [
+        {'Sender': columns.senders[sender_id], 'Count': count}
+        for sender_id, count in enumerate(sender_counts) if count
+    ]
+    senders.sort(key=lambda item: -item['Count'])
+
+    return {
+        'summary': {
+            'TotalMessages': total,
+            'SentMessages': sent,
+            'ReceivedMessages': total - sent,
+            'ActiveDays': len(daily),
+            'FirstMessageTime': first,
+            'LastMessageTime': last,
+        },
+        'hourly': [{'Hour': hour, 'Count': hourly[hour]} for hour in range(24)],
+        'weekday': [{'Weekday': wday, 'Count': weekday[wday]} for wday in range(7)],
+        'daily': daily_list,
+        'monthly': [{'Month': month, 'Count': count} for month, count in monthly.items()],
+        'type_distribution': type_distribution,
+        'heatmap': [list(heatmap[wday * 24:(wday + 1) * 24]) for wday in range(7)],
+        'senders': senders,
+    }
+
+
+def analyze_messages(messages: Iterable[Dict],
+                     start: Optional[int] = None,
+                     end: Optional[int] = None,
+                     utc_offset: Optional[int] = None) -> Dict[str, Any]:
+    """
+    从消息流直接计算全部统计
+
+    Args:
+        messages: 消息流
+        start: 起始时间戳（含）
+        end: 结束时间戳（含）
+        utc_offset: 固定的时区偏移（秒），默认使用本地时区
+
+    Returns:
+        同 compute_all
+    """
+    return compute_all(MessageColumns.from_messages(messages), start, end, utc_offset)
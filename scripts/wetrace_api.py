@@ -4,15 +4,28 @@
 Wetrace API Python Client
 微信聊天记录分析工具的 Python 客户端
 使用标准库，无需安装任何第三方依赖
+
+只在部分命令中用到的模块（sqlite3、csv、concurrent.futures 等）在使用处导入，以加快命令行启动
 """
 
 import json
-import urllib.request
+import os
+import zlib
+import http.client
 import urllib.parse
-import urllib.error
 import sys
 import io
-from typing import Optional, List, Dict, Any, Union
+import threading
+import time
+import datetime
+import email.utils
+from collections import deque
+from typing import Optional, List, Dict, Any, Union, Iterable, Callable
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，未安装时使用标准库
+    orjson = None
 
 # 修复 Windows 控制台编码问题
 if sys.platform == 'win32':
@@ -20,19 +33,1266 @@ if sys.platform == 'win32':
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
 
+# 流式下载时每次读取的字节数
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 默认导出目录
+DEFAULT_EXPORT_DIR = os.path.expanduser('~/wetrace-exports')
+
+# 服务端单页最多返回的记录数
+MAX_PAGE_SIZE = 1000
+
+# 分片并发遍历消息时，每个分片最多暂存的页数
+SHARD_BUFFER_PAGES = 2
+
+# 请求 JSON 接口时声明支持的压缩编码
+ACCEPT_ENCODING = 'gzip, deflate'
+
+# 请求体超过该字节数时才压缩上传
+COMPRESS_MIN_SIZE = 1024
+
+# 复用连接时，这些异常说明服务端已关闭了空闲连接，可以换一条新连接重试
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionError)
+
+
+# 按会话分析的类型与客户端方法名
+ANALYSIS_KINDS = {
+    'hourly': 'get_hourly_analysis',
+    'daily': 'get_daily_analysis',
+    'weekday': 'get_weekday_analysis',
+    'monthly': 'get_monthly_analysis',
+    'type': 'get_type_distribution',
+    'member': 'get_member_activity',
+    'repeat': 'get_repeat_analysis',
+    'wordcloud': 'get_wordcloud',
+}
+
+# 本地缓存默认路径
+DEFAULT_CACHE_PATH = os.path.expanduser('~/.wetrace/cache.sqlite3')
+
+# 本地消息镜像默认路径
+DEFAULT_MIRROR_PATH = os.path.expanduser('~/.wetrace/mirror.sqlite3')
+
+# 本地全文索引默认路径
+DEFAULT_INDEX_PATH = os.path.expanduser('~/.wetrace/search-index.sqlite3')
+
+# 本地词频库默认路径
+DEFAULT_TERMS_PATH = os.path.expanduser('~/.wetrace/terms.sqlite3')
+
+# 本地汇总库默认路径
+DEFAULT_ROLLUP_PATH = os.path.expanduser('~/.wetrace/rollup.sqlite3')
+
+# 各端点的默认缓存时间（秒），按最长前缀匹配，未匹配的端点不缓存
+DEFAULT_CACHE_TTLS = {
+    '/analysis/': 3600,
+    '/report/': 3600,
+    '/dashboard': 300,
+    '/contacts': 600,
+    '/chatrooms': 600,
+    '/contacts/need-contact': 300,
+    '/contacts/export': 0,
+}
+
+# 端点分类（最长前缀匹配），用于限流
+ENDPOINT_CLASSES = {
+    '/analysis/': 'analysis',
+    '/report/': 'analysis',
+    '/dashboard': 'analysis',
+    '/messages': 'messages',
+    '/search': 'messages',
+    '/export/': 'export',
+    '/contacts/export': 'export',
+}
+
+# 各类端点的默认限流参数：
+# rate/burst 为令牌桶的每秒请求数和突发容量，
+# concurrency/max_concurrency 为初始和最大并发数，
+# target_latency 为 p95 延迟目标（秒）
+DEFAULT_RATE_BUDGETS = {
+    'analysis': {'rate': 20.0, 'burst': 10, 'concurrency': 4, 'max_concurrency': 8, 'target_latency': 2.0},
+    'messages': {'rate': 50.0, 'burst': 20, 'concurrency': 8, 'max_concurrency': 16, 'target_latency': 1.0},
+    'export': {'rate': 2.0, 'burst': 2, 'concurrency': 2, 'max_concurrency': 4, 'target_latency': 10.0},
+}
+
+# 相对时间范围对应的天数
+RELATIVE_TIME_RANGES = {
+    'last_week': 7,
+    'last_month': 30,
+    'last_year': 365,
+}
+
+
+# 解析 JSON 响应体的函数，直接接受 bytes：装有 orjson 时使用 orjson，否则使用标准库
+json_loads: Callable[[bytes], Any] = orjson.loads if orjson is not None else json.loads
+
+
+def project_fields(data: Any, fields: Iterable[str]) -> Any:
+    """
+    只保留记录中的指定字段
+
+    支持记录列表、单条记录，以及 {'Items': [...]}（搜索结果）和
+    {'messages': [...]}（搜索上下文）结构；记录中没有的字段会被忽略。
+
+    Args:
+        data: 解码后的响应数据
+        fields: 需要保留的字段
+
+    Returns:
+        投影后的数据（不修改原数据）
+    """
+    if isinstance(data, list):
+        return [{field: record[field] for field in fields if field in record}
+                if isinstance(record, dict) else record for record in data]
+    if isinstance(data, dict):
+        for key in ('Items', 'messages'):
+            if isinstance(data.get(key), list):
+                return {**data, key: project_fields(data[key], fields)}
+        return {field: data[field] for field in fields if field in data}
+    return data
+
+
+def keyset_fields(fields: Optional[Iterable[str]]) -> tuple:
+    """
+    计算 Seq 游标分页实际请求的字段
+
+    游标分页需要 Seq 和 CreateTime，调用方没有要求时也要带上，产出前再去掉。
+
+    Returns:
+        (请求的字段, 产出前的裁剪函数)，不需要裁剪时裁剪函数为 None
+    """
+    if fields is None:
+        return None, None
+    fields = tuple(fields)
+    extra = tuple(field for field in ('Seq', 'CreateTime') if field not in fields)
+    if not extra:
+        return fields, None
+    return fields + extra, lambda msg: {field: msg[field] for field in fields if field in msg}
+
+
+# message_sender 对本人发送的消息返回的发送者（接口不返回本人的用户名）
+SELF_SENDER = 'self'
+
+
+def message_sender(msg: Dict) -> Optional[str]:
+    """
+    推断消息的发送者用户名
+
+    /messages 的消息结构（见 references/api.md）不含发送者字段：本人发送的消息
+    （IsSender=1）返回 SELF_SENDER，单聊中对方发送的消息返回会话用户名 Talker；
+    群聊消息的 Content 以 "wxid:\n" 开头时取其中的用户名，否则无法确定，返回 None。
+    服务端返回了 Sender 字段时直接使用。
+    """
+    sender = msg.get('Sender')
+    if sender:
+        return sender
+    if msg.get('IsSender'):
+        return SELF_SENDER
+    talker = msg.get('Talker')
+    if talker and not talker.endswith('@chatroom'):
+        return talker
+    prefix, sep, _ = (msg.get('Content') or '').partition(':\n')
+    if sep and prefix and ' ' not in prefix and len(prefix) <= 64:
+        return prefix
+    return None
+
+
+def hit_key(hit) -> tuple:
+    """搜索结果条目（含 Talker 和 Seq 的字典）或 (talker, seq) 元组的 (talker, seq)"""
+    if isinstance(hit, dict):
+        return hit['Talker'], hit['Seq']
+    talker, seq = hit
+    return talker, seq
+
+
+def plan_context_windows(hits: Iterable, before: int, after: int,
+                         max_window: int = MAX_PAGE_SIZE) -> List[tuple]:
+    """
+    把搜索结果按会话分组，重叠或相邻的上下文窗口合并为一个请求
+
+    同一会话内 Seq 严格递增，两条消息之间的消息数不超过 Seq 之差，
+    因此 Seq 之差不超过 before + after + 1 的两个窗口一定重叠或相邻。
+    合并后的请求以第一条为锚点，after 取覆盖最后一条之后 after 条消息所需的上界；
+    整个窗口超过 max_window 条时另起一个请求。
+
+    Returns:
+        [(talker, 锚点 seq, before, after, [该请求覆盖的 seq])]
+    """
+    by_talker: Dict[str, set] = {}
+    for hit in hits:
+        talker, seq = hit_key(hit)
+        by_talker.setdefault(talker, set()).add(seq)
+    windows = []
+    for talker, seqs in by_talker.items():
+        group: List[int] = []
+        for seq in sorted(seqs):
+            if group and (seq - group[-1] > before + after + 1
+                          or seq - group[0] + before + after + 1 > max_window):
+                windows.append((talker, group[0], before, group[-1] - group[0] + after, group))
+                group = []
+            group.append(seq)
+        if group:
+            windows.append((talker, group[0], before, group[-1] - group[0] + after, group))
+    return windows
+
+
+def split_context(messages: List[Dict], seqs: Iterable[int],
+                  before: int, after: int) -> Dict[int, Optional[Dict]]:
+    """
+    从合并窗口的消息中切出每条命中的上下文，结构与 get_search_context 一致
+
+    Returns:
+        {seq: {'messages': [...], 'anchor_index': int}}，窗口中没有该消息时为 None
+    """
+    positions = {msg.get('Seq'): i for i, msg in enumerate(messages)}
+    contexts = {}
+    for seq in seqs:
+        i = positions.get(seq)
+        if i is None:
+            contexts[seq] = None
+            continue
+        lo = max(0, i - before)
+        contexts[seq] = {'messages': messages[lo:i + after + 1], 'anchor_index': i - lo}
+    return contexts
+
+
+def plan_time_shards(monthly: List[Dict], shards: int,
+                     start: Optional[int] = None, end: Optional[int] = None) -> List[str]:
+    """
+    按月度消息数把会话历史切分为连续、互不重叠的时间范围
+
+    按累计消息数在月份边界处切分，使各分片的消息数尽量接近；
+    第一个分片从 start（默认第一个有消息的月份）开始，最后一个分片到 end
+    （默认最后一个有消息的月份和今天中较晚的一个）为止，相邻分片首尾相接。
+
+    Args:
+        monthly: get_monthly_analysis 的结果（[{'Month': 'YYYY-MM', 'Count': int}]）
+        shards: 最多切分的分片数
+        start: 起始时间戳（含）
+        end: 结束时间戳（含）
+
+    Returns:
+        "YYYY-MM-DD~YYYY-MM-DD" 格式的时间范围列表，没有消息时为空列表
+    """
+    first_month = datetime.date.fromtimestamp(start).strftime('%Y-%m') if start is not None else None
+    last_month = datetime.date.fromtimestamp(end).strftime('%Y-%m') if end is not None else None
+    months = sorted((item['Month'], item['Count']) for item in monthly
+                    if item.get('Count') and (first_month is None or item['Month'] >= first_month)
+                    and (last_month is None or item['Month'] <= last_month))
+    if not months:
+        return []
+
+    total = sum(count for _, count in months)
+    starts = [months[0][0]]
+    done = 0
+    for i, (month, count) in enumerate(months[:-1]):
+        done += count
+        if len(starts) < shards and done >= total * len(starts) / shards:
+            starts.append(months[i + 1][0])
+
+    def month_start(month: str) -> datetime.date:
+        return datetime.datetime.strptime(month, '%Y-%m').date()
+
+    boundaries = [month_start(month) for month in starts]
+    if start is not None:
+        boundaries[0] = datetime.date.fromtimestamp(start)
+    last = month_start(months[-1][0])
+    last = (last.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
+    last = datetime.date.fromtimestamp(end) if end is not None else max(last, datetime.date.today())
+    ends = [boundary - datetime.timedelta(days=1) for boundary in boundaries[1:]] + [last]
+    return [f"{lo.isoformat()}~{hi.isoformat()}" for lo, hi in zip(boundaries, ends)]
+
+
+def parse_time_range(time_range: Optional[str]) -> tuple:
+    """
+    将时间范围解析为本地时间的 Unix 时间戳区间
+
+    Args:
+        time_range: 时间范围 (如 "2024-01-01~2024-01-31"、"last_week" 或 "last_7_days")
+
+    Returns:
+        (start, end) 元组，闭区间；无法确定的一端为 None
+    """
+    if not time_range:
+        return None, None
+
+    if '~' in time_range:
+        start_str, end_str = (part.strip() for part in time_range.split('~', 1))
+        start = end = None
+        if start_str:
+            start = int(datetime.datetime.strptime(start_str, '%Y-%m-%d').timestamp())
+        if end_str:
+            end_day = datetime.datetime.strptime(end_str, '%Y-%m-%d') + datetime.timedelta(days=1)
+            end = int(end_day.timestamp()) - 1
+        return start, end
+
+    days = RELATIVE_TIME_RANGES.get(time_range)
+    if days is None and time_range.startswith('last_') and time_range.endswith('_days'):
+        try:
+            days = int(time_range[len('last_'):-len('_days')])
+        except ValueError:
+            days = None
+    if days is None:
+        raise ValueError(f"无法解析的时间范围: {time_range}")
+    return int(time.time()) - days * 86400, None
+
+
+# ==================== 异常 ====================
+
+class WetraceError(Exception):
+    """Wetrace 客户端异常基类"""
+
+
+class ConnectionFailed(WetraceError):
+    """无法连接服务端或连接中断"""
+
+
+class CircuitOpenError(ConnectionFailed):
+    """熔断器处于打开状态，请求被直接拒绝"""
+
+
+class HTTPError(WetraceError):
+    """服务端返回错误状态码"""
+
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class BadRequestError(HTTPError):
+    """400：参数无效"""
+
+
+class NotFoundError(HTTPError):
+    """404：资源不存在（或数据库未加载）"""
+
+
+class TooManyRequestsError(HTTPError):
+    """429：请求过多"""
+
+
+class ServerError(HTTPError):
+    """5xx：服务端错误"""
+
+
+def make_http_error(status: int, body: bytes,
+                    retry_after: Optional[float] = None) -> HTTPError:
+    """根据状态码和错误响应体构造对应的异常"""
+    error_msg = body.decode('utf-8', errors='replace')
+    try:
+        error_data = json.loads(error_msg)
+    except json.JSONDecodeError:
+        message = error_msg
+    else:
+        message = error_data.get('error', error_msg) if isinstance(error_data, dict) else error_msg
+
+    if status == 400:
+        cls = BadRequestError
+    elif status == 404:
+        cls = NotFoundError
+    elif status == 429:
+        cls = TooManyRequestsError
+    elif status >= 500:
+        cls = ServerError
+    else:
+        cls = HTTPError
+    return cls(status, message, retry_after)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 响应头（秒数或 HTTP 日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+# ==================== 重试与熔断 ====================
+
+class RetryPolicy:
+    """
+    失败重试策略
+
+    只重试幂等方法。连接失败、429 和 5xx 会重试，退避时间为带完全抖动的
+    指数退避；服务端返回 Retry-After 时以其为准（不超过 max_retry_after）。
+    """
+
+    def __init__(self, max_retries: int = 3,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 30.0,
+                 max_retry_after: float = 120.0,
+                 retry_statuses: tuple = (429, 500, 502, 503, 504),
+                 methods: tuple = ('GET', 'HEAD', 'OPTIONS')):
+        """
+        初始化重试策略
+
+        Args:
+            max_retries: 最大重试次数
+            backoff_base: 第一次重试的退避上限（秒），之后每次翻倍
+            backoff_max: 退避时间上限（秒）
+            max_retry_after: Retry-After 的最大等待时间（秒）
+            retry_statuses: 需要重试的状态码
+            methods: 允许重试的 HTTP 方法
+        """
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.retry_statuses = retry_statuses
+        self.methods = methods
+
+    def should_retry(self, method: str, error: Exception, attempt: int) -> bool:
+        """判断第 attempt 次（从 0 开始）失败后是否重试"""
+        if attempt >= self.max_retries or method.upper() not in self.methods:
+            return False
+        if isinstance(error, CircuitOpenError):
+            return False
+        if isinstance(error, ConnectionFailed):
+            return True
+        return isinstance(error, HTTPError) and error.status in self.retry_statuses
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """第 attempt 次重试前的等待时间（秒）"""
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        import random
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    连续失败（连接失败或 5xx）达到阈值后打开，期间请求直接失败；
+    经过 recovery_timeout 后进入半开状态，只放行一个探测请求，
+    探测成功则关闭，失败则重新打开。线程安全。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        """
+        初始化熔断器
+
+        Args:
+            failure_threshold: 打开熔断器的连续失败次数
+            recovery_timeout: 打开后多久允许探测（秒）
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """请求前检查，熔断器打开时抛出 CircuitOpenError"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN:
+                remaining = self._opened_at + self.recovery_timeout - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(f"连接失败: 服务暂不可用，{remaining:.0f} 秒后重试")
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self._probing:
+                raise CircuitOpenError("连接失败: 服务暂不可用，正在探测恢复")
+            self._probing = True
+
+    def record_success(self):
+        """记录一次成功"""
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        """记录一次失败"""
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class TokenBucket:
+    """令牌桶，每秒补充 rate 个令牌，最多积累 burst 个。线程安全。"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        """
+        初始化令牌桶
+
+        Args:
+            rate: 每秒补充的令牌数
+            burst: 桶容量（默认与 rate 相同，至少为 1）
+        """
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取出一个令牌，令牌不足时等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class ConcurrencyController:
+    """
+    AIMD 自适应并发控制
+
+    每完成 window 个请求评估一次：p95 延迟超过目标或错误率超过阈值时，
+    并发上限乘以 backoff（乘性减）；否则在并发上限被用满时加 1（加性增）。
+    线程安全。
+    """
+
+    def __init__(self, concurrency: int = 4,
+                 min_concurrency: int = 1,
+                 max_concurrency: int = 16,
+                 target_latency: float = 2.0,
+                 max_error_rate: float = 0.1,
+                 window: int = 20,
+                 backoff: float = 0.5):
+        """
+        初始化并发控制器
+
+        Args:
+            concurrency: 初始并发上限
+            min_concurrency: 最小并发上限
+            max_concurrency: 最大并发上限
+            target_latency: p95 延迟目标（秒）
+            max_error_rate: 错误率阈值
+            window: 每次评估的请求数
+            backoff: 乘性减的系数
+        """
+        self.limit = float(concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self.backoff = backoff
+        self.inflight = 0
+        self.last_p95: Optional[float] = None
+        self.last_error_rate: Optional[float] = None
+        self._latencies: List[float] = []
+        self._errors = 0
+        self._saturated = False
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """占用一个并发名额，名额用满时等待"""
+        with self._cond:
+            while self.inflight >= max(1, int(self.limit)):
+                self._cond.wait()
+            self.inflight += 1
+            if self.inflight >= int(self.limit):
+                self._saturated = True
+
+    def release(self, latency: float, error: bool = False):
+        """
+        释放名额并记录请求结果
+
+        Args:
+            latency: 请求耗时（秒）
+            error: 是否为过载类错误（连接失败、429、5xx）
+        """
+        with self._cond:
+            self.inflight -= 1
+            self._latencies.append(latency)
+            self._errors += error
+            if len(self._latencies) >= self.window:
+                self._adjust()
+            self._cond.notify_all()
+
+    def _adjust(self):
+        latencies = sorted(self._latencies)
+        p95 = latencies[max(0, -(-len(latencies) * 95 // 100) - 1)]
+        error_rate = self._errors / len(latencies)
+        if p95 > self.target_latency or error_rate > self.max_error_rate:
+            self.limit = max(self.min_concurrency, self.limit * self.backoff)
+        elif self._saturated:
+            self.limit = min(self.max_concurrency, self.limit + 1)
+        self.last_p95 = p95
+        self.last_error_rate = error_rate
+        self._latencies = []
+        self._errors = 0
+        self._saturated = False
+
+
+class RequestLimiter:
+    """
+    按端点分类限流
+
+    每类端点（见 ENDPOINT_CLASSES）有独立的令牌桶和自适应并发控制器，
+    未分类的端点不限流。
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, Dict]] = None,
+                 classes: Optional[Dict[str, str]] = None):
+        """
+        初始化限流器
+
+        Args:
+            budgets: 各类端点的限流参数（默认 DEFAULT_RATE_BUDGETS）
+            classes: 端点前缀到分类的映射（默认 ENDPOINT_CLASSES）
+        """
+        if budgets is None:
+            budgets = DEFAULT_RATE_BUDGETS
+        self.classes = dict(ENDPOINT_CLASSES if classes is None else classes)
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.controllers: Dict[str, ConcurrencyController] = {}
+        for name, budget in budgets.items():
+            budget = dict(budget)
+            self.buckets[name] = TokenBucket(budget.pop('rate'), budget.pop('burst', None))
+            self.controllers[name] = ConcurrencyController(**budget)
+
+    def classify(self, endpoint: str) -> Optional[str]:
+        """获取端点所属的分类，不限流的端点返回 None"""
+        best = None
+        for prefix in self.classes:
+            if endpoint.startswith(prefix) and (best is None or len(prefix) > len(best)):
+                best = prefix
+        return self.classes[best] if best is not None else None
+
+    def acquire(self, name: Optional[str]):
+        """请求前等待令牌和并发名额"""
+        if name not in self.controllers:
+            return
+        self.buckets[name].acquire()
+        self.controllers[name].acquire()
+
+    def release(self, name: Optional[str], latency: float, error: bool = False):
+        """请求结束后释放并发名额"""
+        if name in self.controllers:
+            self.controllers[name].release(latency, error)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        获取各分类的当前状态
+
+        Returns:
+            {分类: {'concurrency': 当前并发上限, 'inflight': 在途请求数,
+                    'rate': 每秒请求数, 'p95': 最近一次评估的 p95 延迟,
+                    'error_rate': 最近一次评估的错误率}}
+        """
+        return {
+            name: {
+                'concurrency': max(1, int(controller.limit)),
+                'inflight': controller.inflight,
+                'rate': self.buckets[name].rate,
+                'p95': controller.last_p95,
+                'error_rate': controller.last_error_rate,
+            }
+            for name, controller in self.controllers.items()
+        }
+
+
+class StreamDecoder:
+    """
+    按 Content-Encoding 流式解压响应体
+
+    支持 gzip 和 deflate；deflate 按规范是带 zlib 头的数据，
+    也兼容部分服务端发送的不带头的原始 deflate 数据。
+    """
+
+    ENCODINGS = ('gzip', 'x-gzip', 'deflate')
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self._raw_fallback = encoding == 'deflate'
+        wbits = zlib.MAX_WBITS if encoding == 'deflate' else 16 + zlib.MAX_WBITS
+        self._obj = zlib.decompressobj(wbits)
+
+    @property
+    def has_pending(self) -> bool:
+        """是否还有已读入但因 max_length 限制尚未解压的数据"""
+        return bool(self._obj.unconsumed_tail)
+
+    @property
+    def eof(self) -> bool:
+        """压缩流是否已完整结束"""
+        return self._obj.eof
+
+    def decompress(self, data: bytes, max_length: int = 0) -> bytes:
+        """解压一段数据，max_length 大于 0 时最多返回这么多字节（其余留到下次）"""
+        data = self._obj.unconsumed_tail + data
+        try:
+            result = self._obj.decompress(data, max_length)
+        except zlib.error:
+            if not self._raw_fallback:
+                raise
+            self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+            result = self._obj.decompress(data, max_length)
+        self._raw_fallback = False
+        return result
+
+    def flush(self) -> bytes:
+        """输入结束，返回剩余的解压数据"""
+        return self._obj.flush()
+
+
+def decode_content(encoding: Optional[str], data: bytes) -> bytes:
+    """
+    按 Content-Encoding 解压完整的响应体
+
+    Args:
+        encoding: Content-Encoding 响应头（None 或 identity 表示未压缩）
+        data: 响应体
+
+    Returns:
+        解压后的数据（不支持的编码原样返回）
+    """
+    encoding = (encoding or '').strip().lower()
+    if encoding not in StreamDecoder.ENCODINGS or not data:
+        return data
+    decoder = StreamDecoder(encoding)
+    try:
+        result = decoder.decompress(data) + decoder.flush()
+    except zlib.error as e:
+        raise WetraceError(f"响应解压失败: {e}")
+    if not decoder.eof:
+        raise WetraceError("响应解压失败: 压缩数据不完整")
+    return result
+
+
+def is_loopback(host: Optional[str]) -> bool:
+    """判断主机是否为本机地址"""
+    if not host or host.lower() == 'localhost' or host.startswith('127.'):
+        return True
+    import ipaddress
+
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def encode_body(data: Any, compress: bool = True) -> tuple:
+    """
+    把请求数据编码为 JSON 请求体
+
+    Args:
+        data: 请求数据（bytes 原样发送）
+        compress: 请求体超过 COMPRESS_MIN_SIZE 字节时是否 gzip 压缩
+
+    Returns:
+        (请求体, 请求头, 压缩前的字节数)
+    """
+    if isinstance(data, bytes):
+        body = data
+        headers = {'Content-Type': 'application/octet-stream'}
+    else:
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+    size = len(body)
+    if compress and size >= COMPRESS_MIN_SIZE:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        body = compressor.compress(body) + compressor.flush()
+        headers['Content-Encoding'] = 'gzip'
+    return body, headers, size
+
+
+class PooledResponse:
+    """连接池中的 HTTP 响应，关闭时将连接归还连接池；压缩的响应体在读取时流式解压"""
+
+    def __init__(self, pool: 'ConnectionPool', conn: http.client.HTTPConnection,
+                 response: http.client.HTTPResponse,
+                 started: float = 0.0, connect_time: float = 0.0):
+        self._pool = pool
+        self._conn = conn
+        self._response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        # 计时（time.monotonic）：请求开始时刻、建立连接耗时、收到响应头的耗时
+        self.started = started
+        self.connect_time = connect_time
+        self.ttfb = time.monotonic() - started if started else 0.0
+        # 网络上收到的字节数和解压后的字节数
+        self.bytes_read = 0
+        self.bytes_decoded = 0
+        encoding = (response.headers.get('Content-Encoding') or '').strip().lower()
+        self._decoder = StreamDecoder(encoding) if encoding in StreamDecoder.ENCODINGS else None
+        # 关闭时的回调，参数为响应本身
+        self.on_close = None
+
+    def _read_raw(self, amt: Optional[int] = None) -> bytes:
+        data = self._response.read(amt)
+        self.bytes_read += len(data)
+        return data
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        """读取（解压后的）响应体，amt 为最多返回的字节数"""
+        if self._decoder is None:
+            data = self._read_raw(amt)
+            self.bytes_decoded += len(data)
+            return data
+        try:
+            if amt is None:
+                data = self._decoder.decompress(self._read_raw()) + self._decoder.flush()
+                self._check_eof()
+            else:
+                data = b''
+                while not data:
+                    chunk = b'' if self._decoder.has_pending else self._read_raw(DOWNLOAD_CHUNK_SIZE)
+                    if not chunk and not self._decoder.has_pending:
+                        data = self._decoder.flush()
+                        self._check_eof()
+                        break
+                    data = self._decoder.decompress(chunk, amt)
+        except zlib.error as e:
+            raise WetraceError(f"响应解压失败: {e}")
+        self.bytes_decoded += len(data)
+        return data
+
+    def _check_eof(self):
+        if not self._decoder.eof and self.bytes_read:
+            raise WetraceError("响应解压失败: 压缩数据不完整")
+
+    def close(self):
+        """关闭响应；如果响应体已读完且连接可复用，则归还连接池"""
+        if self._conn is None:
+            return
+        if self.on_close is not None:
+            self.on_close(self)
+        conn, self._conn = self._conn, None
+        if self._response.isclosed() and not self._response.will_close:
+            self._pool._put_conn(conn)
+        else:
+            self._response.close()
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    HTTP/1.1 keep-alive 连接池
+
+    线程安全，可在多个线程之间共享。空闲连接按后进先出复用，
+    超过 idle_timeout 的空闲连接会被丢弃；复用的连接如果已被服务端关闭，
+    会自动换一条新连接重试。
+    """
+
+    def __init__(self, base_url: str, maxsize: int = 10,
+                 idle_timeout: float = 30.0,
+                 timeout: Optional[float] = None,
+                 stale_retries: int = 1):
+        """
+        初始化连接池
+
+        Args:
+            base_url: API 基础 URL（只使用其中的协议、主机和端口）
+            maxsize: 最多保留的空闲连接数
+            idle_timeout: 空闲连接的最长保留时间（秒）
+            timeout: socket 超时时间（秒），None 表示不超时
+            stale_retries: 复用连接失效时的最大重试次数
+        """
+        parsed = urllib.parse.urlsplit(base_url)
+        self.scheme = parsed.scheme or 'http'
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.stale_retries = stale_retries
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _new_conn(self) -> http.client.HTTPConnection:
+        """创建新连接"""
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _get_conn(self):
+        """取出一条空闲连接，没有可用的空闲连接时新建一条"""
+        expired = []
+        conn = None
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                candidate, last_used = self._idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    conn = candidate
+                    break
+                expired.append(candidate)
+        for stale in expired:
+            stale.close()
+        if conn is not None:
+            return conn, True
+        return self._new_conn(), False
+
+    def _put_conn(self, conn: http.client.HTTPConnection):
+        """归还连接，连接池已满或已关闭时直接关闭连接"""
+        with self._lock:
+            if not self._closed and len(self._idle) < self.maxsize:
+                self._idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def request(self, method: str, url: str,
+                headers: Optional[Dict[str, str]] = None,
+                body: Optional[bytes] = None) -> PooledResponse:
+        """
+        发送请求
+
+        Args:
+            method: HTTP 方法
+            url: 请求路径（含查询参数）
+            headers: 请求头
+            body: 请求体
+
+        Returns:
+            响应对象，使用完毕后必须关闭
+        """
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            connect_time = 0.0
+            conn, reused = self._get_conn()
+            try:
+                if not reused:
+                    conn.connect()
+                    connect_time = time.monotonic() - started
+                conn.request(method, url, body=body, headers=headers or {})
+                response = conn.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                if reused and attempt < self.stale_retries:
+                    attempt += 1
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            return PooledResponse(self, conn, response, started, connect_time)
+
+    def close(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, deque()
+        for conn, _ in idle:
+            conn.close()
+
+
+class ResponseCache:
+    """
+    基于 SQLite 的本地响应缓存
+
+    只缓存 GET 请求，键由方法、端点和排序后的查询参数组成。
+    每个端点有各自的缓存时间；过期条目如果带有 ETag / Last-Modified，
+    会向服务端发送条件请求重新验证。缓存总大小超过上限时按最近最少使用淘汰。
+    线程安全。
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH,
+                 ttls: Optional[Dict[str, float]] = None,
+                 default_ttl: float = 0,
+                 max_bytes: int = 256 * 1024 * 1024):
+        """
+        初始化缓存
+
+        Args:
+            path: SQLite 文件路径
+            ttls: 端点前缀到缓存时间（秒）的映射，默认为 DEFAULT_CACHE_TTLS
+            default_ttl: 未匹配任何前缀的端点的缓存时间，0 表示不缓存
+            max_bytes: 缓存内容的总大小上限（字节）
+        """
+        self.path = path
+        self.ttls = dict(DEFAULT_CACHE_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        import sqlite3
+
+        self._lock = threading.Lock()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                content_type TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access);
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+        """)
+        self._db.commit()
+
+    @staticmethod
+    def make_key(method: str, endpoint: str, params: Optional[Dict] = None) -> str:
+        """生成缓存键，查询参数按名称排序"""
+        key = f"{method.upper()} /{endpoint.strip('/')}"
+        if params:
+            key = f"{key}?{urllib.parse.urlencode(sorted(params.items()))}"
+        return key
+
+    def ttl_for(self, endpoint: str) -> float:
+        """获取端点的缓存时间，按最长前缀匹配"""
+        endpoint = '/' + endpoint.lstrip('/')
+        matched = None
+        for prefix in self.ttls:
+            if endpoint.startswith(prefix) and (matched is None or len(prefix) > len(matched)):
+                matched = prefix
+        return self.ttls[matched] if matched is not None else self.default_ttl
+
+    def _count(self, name: str, amount: int = 1):
+        self._db.execute(
+            "INSERT INTO stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount))
+
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        读取缓存条目
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            条目字典（content_type、body、etag、last_modified、fresh），不存在时返回 None
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT content_type, body, etag, last_modified, expires_at "
+                "FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count('misses')
+                self._db.commit()
+                return None
+            fresh = row[4] > now
+            self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self._count('hits' if fresh else 'stale')
+            self._db.commit()
+        return {
+            'content_type': row[0],
+            'body': row[1],
+            'etag': row[2],
+            'last_modified': row[3],
+            'fresh': fresh,
+        }
+
+    def put(self, key: str, content_type: str, body: bytes, ttl: float,
+            etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """写入缓存条目，并按 LRU 淘汰超出大小上限的条目"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(key, content_type, body, size, etag, last_modified, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, content_type, body, len(body), etag, last_modified, now + ttl, now))
+            self._count('stores')
+            self._evict()
+            self._db.commit()
+
+    def refresh(self, key: str, ttl: float):
+        """服务端确认缓存仍然有效（304）后延长有效期"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE entries SET expires_at = ?, last_access = ? WHERE key = ?",
+                (now + ttl, now, key))
+            self._count('revalidated')
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._db.execute(
+                "SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        self._count('evictions', evicted)
+
+    def invalidate(self):
+        """清空所有缓存条目（统计数据保留）"""
+        with self._lock:
+            self._db.execute("DELETE FROM entries")
+            self._count('invalidations')
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计
+
+        Returns:
+            条目数、总大小以及命中/未命中等累计计数
+        """
+        with self._lock:
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            counters = dict(self._db.execute("SELECT name, value FROM stats").fetchall())
+        result = {'path': self.path, 'entries': entries, 'bytes': size,
+                  'max_bytes': self.max_bytes}
+        for name in ('hits', 'misses', 'stale', 'revalidated', 'stores',
+                     'evictions', 'invalidations'):
+            result[name] = counters.get(name, 0)
+        lookups = result['hits'] + result['misses'] + result['stale']
+        result['hit_rate'] = round((result['hits'] + result['revalidated']) / lookups, 4) if lookups else 0.0
+        return result
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Flight:
+    """一个正在进行的请求，供相同请求的其他调用方等待其结果"""
+
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
 class WetraceClient:
     """Wetrace API 客户端"""
 
-    def __init__(self, base_url: str = "http://127.0.0.1:5200/api/v1"):
+    def __init__(self, base_url: str = "http://127.0.0.1:5200/api/v1",
+                 pool: Optional[ConnectionPool] = None,
+                 pool_size: int = 10,
+                 idle_timeout: float = 30.0,
+                 timeout: Optional[float] = None,
+                 stale_retries: int = 1,
+                 cache: Optional[ResponseCache] = None,
+                 coalesce: bool = True,
+                 memo_ttl: float = 0.0,
+                 retry: Optional[RetryPolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None,
+                 limiter: Optional[RequestLimiter] = None,
+                 metrics=None,
+                 decoder: Optional[Callable[[bytes], Any]] = None,
+                 compress: Optional[bool] = None):
         """
         初始化客户端
 
         Args:
             base_url: API 基础 URL
+            pool: 共享的连接池（默认为本客户端新建一个）
+            pool_size: 最多保留的空闲连接数
+            idle_timeout: 空闲连接的最长保留时间（秒）
+            timeout: socket 超时时间（秒）
+            stale_retries: 复用连接失效时的最大重试次数
+            cache: 本地响应缓存（默认不缓存）
+            coalesce: 是否合并并发的相同 GET 请求
+            memo_ttl: GET 请求完成后，相同请求在多少秒内直接复用其结果（0 表示不复用）
+            retry: 失败重试策略（默认 RetryPolicy()，传入 RetryPolicy(max_retries=0) 关闭重试）
+            breaker: 熔断器（默认 CircuitBreaker()）
+            limiter: 按端点分类的限流器（默认不限流）
+            metrics: 请求指标接收器（带 record(sample) 方法，如 wetrace_metrics.MetricsCollector），
+                     也可以传入列表
+            decoder: 解析 JSON 响应体的函数，参数为 bytes（默认 json_loads）
+            compress: 是否与服务端协商 gzip/deflate 压缩传输，并压缩较大的请求体
+                      （默认只在服务端不在本机时压缩，本机上压缩的 CPU 开销大于节省的传输时间）
         """
         self.base_url = base_url.rstrip('/')
+        self._base_path = urllib.parse.urlsplit(self.base_url).path
+        if compress is None:
+            compress = not is_loopback(urllib.parse.urlsplit(self.base_url).hostname)
+        self.compress = compress
+        # 服务端拒绝压缩的请求体（415）后不再压缩上传
+        self.compress_uploads = compress
+        if pool is None:
+            pool = ConnectionPool(self.base_url, maxsize=pool_size,
+                                  idle_timeout=idle_timeout, timeout=timeout,
+                                  stale_retries=stale_retries)
+        self.pool = pool
+        self.cache = cache
+        self.coalesce = coalesce
+        self.memo_ttl = memo_ttl
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.limiter = limiter
+        if metrics is None:
+            metrics = ()
+        elif not isinstance(metrics, (list, tuple)):
+            metrics = (metrics,)
+        self.metrics = tuple(metrics)
+        if decoder is not None:
+            self.json_loads = decoder
+        self._flight_lock = threading.Lock()
+        self._inflight: Dict[str, _Flight] = {}
+        self._memo: Dict[str, tuple] = {}
+
+    def close(self):
+        """关闭客户端持有的连接和缓存"""
+        self.pool.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _build_url(self, endpoint: str, params: Optional[Dict] = None) -> str:
+        """拼接请求路径和查询参数"""
+        url = f"{self._base_path}/{endpoint.lstrip('/')}"
 
-    def _request(self, method: str, endpoint: str, params: Optional[Dict] = None) -> Union[Dict, List, bytes]:
+        # 添加查询参数
+        if params:
+            query_string = urllib.parse.urlencode(params)
+            url = f"{url}?{query_string}"
+        return url
+
+    def _request(self, method: str, endpoint: str, params: Optional[Dict] = None,
+                 fields: Optional[Iterable[str]] = None,
+                 data: Any = None) -> Union[Dict, List, bytes]:
         """
         发送 HTTP 请求
 
@@ -40,43 +1300,404 @@ class WetraceClient:
             method: HTTP 方法
             endpoint: API 端点
             params: 查询参数
+            fields: 只保留记录中的这些字段（见 project_fields）
+            data: 请求体数据（编码为 JSON，较大时 gzip 压缩，见 encode_body）
 
         Returns:
             响应数据
         """
-        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        if method == 'GET' and data is None and (self.coalesce or self.memo_ttl > 0):
+            content_type, body = self._fetch_coalesced(endpoint, params)
+        else:
+            content_type, body = self._fetch(method, endpoint, params, data)
+        return self._decode_body(content_type, body, fields)
 
-        # 添加查询参数
-        if params:
-            query_string = urllib.parse.urlencode(params)
-            url = f"{url}?{query_string}"
+    def _fetch_coalesced(self, endpoint: str, params: Optional[Dict]) -> tuple:
+        """
+        合并并发的相同 GET 请求
+
+        以规范化后的请求（端点 + 排序后的参数）为键，同一时刻只有一个调用方
+        真正发出请求，其他调用方等待并共享其响应体（各自解码，互不影响）。
+        设置了 memo_ttl 时，刚完成的响应在该时间内直接复用。
 
-        # 创建请求
-        req = urllib.request.Request(url, method=method)
+        Returns:
+            (content_type, 响应体)
+        """
+        key = ResponseCache.make_key('GET', endpoint, params)
+        with self._flight_lock:
+            memo = self._memo.get(key)
+            if memo is not None and memo[0] > time.monotonic():
+                return memo[1]
+            flight = self._inflight.get(key) if self.coalesce else None
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                if self.coalesce:
+                    self._inflight[key] = flight
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
 
         try:
-            with urllib.request.urlopen(req) as response:
-                content_type = response.headers.get('Content-Type', '')
+            flight.result = self._fetch('GET', endpoint, params)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flight_lock:
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                if flight.error is None and self.memo_ttl > 0:
+                    now = time.monotonic()
+                    for stale in [k for k, (expires, _) in self._memo.items() if expires <= now]:
+                        del self._memo[stale]
+                    self._memo[key] = (now + self.memo_ttl, flight.result)
+            flight.event.set()
+        return flight.result
+
+    def _fetch(self, method: str, endpoint: str, params: Optional[Dict] = None,
+               data: Any = None) -> tuple:
+        """
+        发送请求并读取响应体（经过本地缓存）
+
+        Returns:
+            (content_type, 解压后的响应体)
+        """
+        url = self._build_url(endpoint, params)
+
+        headers = {}
+        if self.compress:
+            headers['Accept-Encoding'] = ACCEPT_ENCODING
+        if data is not None:
+            return self._upload(method, url, headers, data)
+
+        # 查询本地缓存，过期条目带校验信息时发送条件请求
+        cache_key = entry = None
+        ttl = 0
+        if self.cache is not None and method == 'GET':
+            ttl = self.cache.ttl_for(endpoint)
+            if ttl > 0:
+                cache_key = self.cache.make_key(method, endpoint, params)
+                entry = self.cache.get(cache_key)
+                if entry is not None:
+                    if entry['fresh']:
+                        if self.metrics:
+                            self._emit_metrics(method, endpoint, None, len(entry['body']),
+                                               cache='hit')
+                        return entry['content_type'], entry['body']
+                    if entry['etag']:
+                        headers['If-None-Match'] = entry['etag']
+                    if entry['last_modified']:
+                        headers['If-Modified-Since'] = entry['last_modified']
+
+        response = self._send(method, url, headers=headers,
+                              cache='miss' if cache_key is not None else None)
+
+        with response:
+            if response.status == 304 and entry is not None:
+                response.read()
+                self.cache.refresh(cache_key, ttl)
+                return entry['content_type'], entry['body']
+
+            content_type = response.headers.get('Content-Type', '')
+            data = response.read()
+
+        if cache_key is not None:
+            self.cache.put(cache_key, content_type, data, ttl,
+                           etag=response.headers.get('ETag'),
+                           last_modified=response.headers.get('Last-Modified'))
+        elif self.cache is not None and method != 'GET':
+            # 修改类请求（如删除会话）会影响列表和统计结果，清空缓存
+            self.cache.invalidate()
+        if method != 'GET':
+            self._invalidate_memo()
+
+        return content_type, data
+
+    def _invalidate_memo(self):
+        """修改类请求之后清空已完成 GET 请求的结果"""
+        with self._flight_lock:
+            self._memo.clear()
+
+    def _upload(self, method: str, url: str, headers: Dict[str, str], data: Any) -> tuple:
+        """
+        发送带请求体的请求；服务端不接受压缩的请求体（415）时改为不压缩重发
+
+        Returns:
+            (content_type, 解压后的响应体)
+        """
+        while True:
+            body, body_headers, size = encode_body(data, self.compress_uploads)
+            try:
+                response = self._send(method, url, headers={**headers, **body_headers},
+                                      body=body, upload_size=size)
+            except HTTPError as e:
+                if e.status == 415 and 'Content-Encoding' in body_headers:
+                    self.compress_uploads = False
+                    continue
+                raise
+            break
+        with response:
+            content_type = response.headers.get('Content-Type', '')
+            result = response.read()
+        if self.cache is not None:
+            self.cache.invalidate()
+        self._invalidate_memo()
+        return content_type, result
+
+    def _download(self, endpoint: str, params: Optional[Dict], dest,
+                  progress=None, resume: bool = True) -> int:
+        """
+        将文件类响应分块写入磁盘或可写对象，不在内存中缓存完整内容
+
+        写入路径时先写到 "<路径>.part"，完成后原子地重命名；
+        resume 为 True 且存在未完成的 .part 文件时，使用 HTTP Range 断点续传
+        （服务端不支持 Range 时从头下载）。
 
-                # 如果是文件下载，返回字节
-                if 'application/octet-stream' in content_type or \
-                   'application/zip' in content_type or \
-                   'application/pdf' in content_type:
-                    return response.read()
+        Args:
+            endpoint: API 端点
+            params: 查询参数
+            dest: 目标文件路径，或带 write 方法的可写对象
+            progress: 进度回调 progress(已下载字节数, 总字节数或 None)
+            resume: 是否断点续传
+
+        Returns:
+            文件总字节数
+        """
+        url = self._build_url(endpoint, params)
+
+        if hasattr(dest, 'write'):
+            response = self._open_download(url, {})
+            with response:
+                return self._copy_response(response, dest, 0, self._content_length(response), progress)
+
+        dest = os.fspath(dest)
+        part_path = f"{dest}.part"
+        offset = os.path.getsize(part_path) if resume and os.path.exists(part_path) else 0
+        headers = {'Range': f"bytes={offset}-"} if offset else {}
+
+        response = self._open_download(url, headers)
+        if response.status == 416:
+            # 已下载的部分与服务端文件不一致，从头下载
+            response.close()
+            offset = 0
+            response = self._open_download(url, {})
+
+        with response:
+            total = self._content_length(response)
+            if response.status == 206:
+                content_range = response.headers.get('Content-Range', '')
+                if content_range.startswith(f"bytes {offset}-"):
+                    size = content_range.rpartition('/')[2]
+                    total = int(size) if size.isdigit() else None
+                else:
+                    raise WetraceError(f"无法断点续传: Content-Range {content_range!r}")
+            else:
+                offset = 0
+
+            dest_dir = os.path.dirname(os.path.abspath(dest))
+            os.makedirs(dest_dir, exist_ok=True)
+            with open(part_path, 'ab' if offset else 'wb') as f:
+                size = self._copy_response(response, f, offset, total, progress)
+
+        os.replace(part_path, dest)
+        return size
+
+    def _open_download(self, url: str, headers: Dict[str, str]) -> PooledResponse:
+        """发送下载请求，错误响应转换为异常"""
+        return self._send('GET', url, headers=headers, passthrough=(416,))
+
+    def _send(self, method: str, url: str,
+              headers: Optional[Dict[str, str]] = None,
+              body: Optional[bytes] = None,
+              passthrough: tuple = (),
+              cache: Optional[str] = None,
+              upload_size: Optional[int] = None) -> PooledResponse:
+        """
+        发送请求：经过熔断器检查，按重试策略重试，错误状态码转换为异常
 
-                # 否则解析 JSON
-                data = response.read()
-                return json.loads(data.decode('utf-8'))
+        Args:
+            method: HTTP 方法
+            url: 请求路径（含查询参数）
+            headers: 请求头
+            body: 请求体
+            passthrough: 不转换为异常、直接返回的错误状态码
+            cache: 记录到指标中的缓存查询结果（miss，收到 304 时记为 revalidated）
+            upload_size: 压缩前的请求体字节数（记录到指标中）
 
-        except urllib.error.HTTPError as e:
-            error_msg = e.read().decode('utf-8')
+        Returns:
+            响应对象（状态码小于 400 或在 passthrough 中）
+        """
+        endpoint = urllib.parse.urlsplit(url).path[len(self._base_path):]
+        limit_class = None
+        if self.limiter is not None:
+            limit_class = self.limiter.classify(endpoint)
+        sent = len(body) if body is not None else 0
+        upload = (sent, sent if upload_size is None else upload_size)
+        attempt = 0
+        error = None
+        while True:
+            try:
+                self.breaker.before_request()
+            except CircuitOpenError:
+                if error is None:
+                    raise
+                # 重试过程中熔断器打开时，报告最后一次真实的错误
+                raise error
+            retry_after = None
+            if self.limiter is not None:
+                self.limiter.acquire(limit_class)
+            started = time.monotonic()
             try:
-                error_data = json.loads(error_msg)
-                raise Exception(f"HTTP {e.code}: {error_data.get('error', error_msg)}")
-            except json.JSONDecodeError:
-                raise Exception(f"HTTP {e.code}: {error_msg}")
-        except urllib.error.URLError as e:
-            raise Exception(f"连接失败: {e.reason}")
+                response = self.pool.request(method, url, headers=headers, body=body)
+            except (OSError, http.client.HTTPException) as e:
+                if self.limiter is not None:
+                    self.limiter.release(limit_class, time.monotonic() - started, True)
+                if self.metrics:
+                    self._emit_metrics(method, endpoint, None, 0,
+                                       total=time.monotonic() - started, attempt=attempt,
+                                       upload=upload)
+                self.breaker.record_failure()
+                error = ConnectionFailed(f"连接失败: {e}")
+            else:
+                if self.metrics:
+                    response.on_close = self._metrics_on_close(method, endpoint, cache, attempt, upload)
+                if self.limiter is not None:
+                    # 延迟按收到响应头计算，反映服务端的处理时间
+                    overloaded = response.status == 429 or response.status >= 500
+                    self.limiter.release(limit_class, time.monotonic() - started, overloaded)
+                if response.status < 400 or response.status in passthrough:
+                    self.breaker.record_success()
+                    return response
+                with response:
+                    error_body = response.read()
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                error = make_http_error(response.status, error_body, retry_after)
+                if response.status >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+
+            if not self.retry.should_retry(method, error, attempt):
+                raise error
+            time.sleep(self.retry.delay(attempt, retry_after))
+            attempt += 1
+
+    def _metrics_on_close(self, method: str, endpoint: str,
+                          cache: Optional[str], attempt: int, upload: tuple = (0, 0)):
+        """生成在响应关闭时记录指标的回调"""
+        def on_close(response: PooledResponse):
+            self._emit_metrics(
+                method, endpoint, response.status, response.bytes_read,
+                connect=response.connect_time, ttfb=response.ttfb,
+                total=time.monotonic() - response.started,
+                cache='revalidated' if response.status == 304 else cache,
+                attempt=attempt, decoded=response.bytes_decoded, upload=upload)
+        return on_close
+
+    def _emit_metrics(self, method: str, endpoint: str, status: Optional[int],
+                      size: int, connect: Optional[float] = None,
+                      ttfb: Optional[float] = None, total: Optional[float] = None,
+                      cache: Optional[str] = None, attempt: int = 0,
+                      decoded: Optional[int] = None, upload: tuple = (0, 0)):
+        """
+        把一个请求记录发送给全部指标接收器
+
+        size 是网络上收到的响应体字节数，decoded 是解压后的字节数（默认与 size 相同），
+        upload 是请求体 (发送的字节数, 压缩前的字节数)。
+        """
+        sample = {
+            'ts': time.time(),
+            'method': method,
+            'endpoint': endpoint,
+            'status': status,
+            'error': (status is None and cache != 'hit') or (status is not None and status >= 400),
+            'bytes': size,
+            'decoded_bytes': size if decoded is None else decoded,
+            'sent_bytes': upload[0],
+            'sent_decoded_bytes': upload[1],
+            'connect': connect,
+            'ttfb': ttfb,
+            'total': total,
+            'cache': cache,
+            'attempt': attempt,
+        }
+        for sink in self.metrics:
+            sink.record(sample)
+
+    @staticmethod
+    def _content_length(response: PooledResponse) -> Optional[int]:
+        length = response.headers.get('Content-Length')
+        return int(length) if length and length.isdigit() else None
+
+    @staticmethod
+    def _copy_response(response: PooledResponse, f, offset: int,
+                       total: Optional[int], progress=None) -> int:
+        """把响应体分块写入文件对象，返回写入后的总字节数"""
+        done = offset
+        if progress:
+            progress(done, total)
+        while True:
+            chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            f.write(chunk)
+            done += len(chunk)
+            if progress:
+                progress(done, total)
+        return done
+
+    @staticmethod
+    def _raise_for_status(status: int, body: bytes, retry_after: Optional[float] = None):
+        """将错误响应转换为异常"""
+        raise make_http_error(status, body, retry_after)
+
+    # 解析 JSON 响应体的函数（可通过 decoder 参数替换）
+    json_loads = staticmethod(json_loads)
+
+    def _decode_body(self, content_type: str, data: bytes,
+                     fields: Optional[Iterable[str]] = None) -> Union[Dict, List, bytes]:
+        """根据 Content-Type 解码响应体，指定 fields 时只保留这些字段"""
+        # 如果是文件下载，返回字节
+        if 'application/octet-stream' in content_type or \
+           'application/zip' in content_type or \
+           'application/pdf' in content_type:
+            return data
+
+        # 否则直接从 bytes 解析 JSON，不经过 str 中间层
+        result = self.json_loads(data)
+        if fields is not None:
+            result = project_fields(result, fields)
+        return result
+
+    def _paginate(self, fetch, page_size: int):
+        """
+        按 limit/offset 逐页拉取并逐条产出记录
+
+        Args:
+            fetch: 接收 limit 和 offset 关键字参数、返回一页数据的函数
+            page_size: 每页数量（不超过 MAX_PAGE_SIZE）
+
+        Yields:
+            单条记录
+        """
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        offset = 0
+        while True:
+            page = fetch(limit=page_size, offset=offset)
+            if isinstance(page, dict):
+                items = page.get('Items') or []
+                has_more = page.get('HasMore', True)
+            else:
+                items = page or []
+                has_more = True
+            yield from items
+            if len(items) < page_size or not has_more:
+                return
+            offset += len(items)
 
     # ==================== 会话管理 ====================
 
@@ -99,6 +1720,22 @@ class WetraceClient:
 
         return self._request('GET', '/sessions', params=params)
 
+    def iter_sessions(self, keyword: Optional[str] = None,
+                      page_size: int = MAX_PAGE_SIZE):
+        """
+        逐条遍历全部会话，自动分页
+
+        Args:
+            keyword: 会话名称搜索关键词
+            page_size: 每页数量
+
+        Yields:
+            会话
+        """
+        return self._paginate(
+            lambda limit, offset: self.get_sessions(keyword, limit=limit, offset=offset),
+            page_size)
+
     def delete_session(self, session_id: str) -> Dict:
         """
         删除会话
@@ -118,7 +1755,8 @@ class WetraceClient:
                     keyword: Optional[str] = None,
                     time_range: Optional[str] = None,
                     reverse: bool = False,
-                    limit: int = 50, offset: int = 0) -> List[Dict]:
+                    limit: int = 50, offset: int = 0,
+                    fields: Optional[Iterable[str]] = None) -> List[Dict]:
         """
         获取消息列表
 
@@ -130,6 +1768,8 @@ class WetraceClient:
             reverse: 是否倒序
             limit: 返回结果数量
             offset: 分页偏移量
+            fields: 只保留消息中的这些字段（如 ['Seq', 'CreateTime', 'Type']），
+                    不保留 CompressContent、BytesExtra 等用不到的大字段
 
         Returns:
             消息列表
@@ -144,7 +1784,190 @@ class WetraceClient:
         if time_range:
             params['time_range'] = time_range
 
-        return self._request('GET', '/messages', params=params)
+        return self._request('GET', '/messages', params=params, fields=fields)
+
+    def iter_messages(self, talker_id: Optional[str] = None,
+                      time_range: Optional[str] = None,
+                      page_size: int = MAX_PAGE_SIZE,
+                      sender_id: Optional[str] = None,
+                      keyword: Optional[str] = None,
+                      reverse: bool = False,
+                      keyset: bool = False,
+                      fields: Optional[Iterable[str]] = None):
+        """
+        逐条遍历消息，自动分页，内存占用与消息总数无关
+
+        Args:
+            talker_id: 会话用户名
+            time_range: 时间范围
+            page_size: 每页数量
+            sender_id: 发送者用户名
+            keyword: 搜索关键词
+            reverse: 是否倒序
+            keyset: 使用 Seq 游标分页（仅支持单个会话的升序遍历，
+                    不能与 sender_id、keyword、reverse 同时使用）
+            fields: 只保留消息中的这些字段
+
+        Yields:
+            消息
+        """
+        if keyset:
+            if not talker_id or sender_id or keyword or reverse:
+                raise ValueError("keyset 分页只支持按 talker_id 升序遍历")
+            return self.iter_messages_keyset(talker_id, time_range=time_range,
+                                             page_size=page_size, fields=fields)
+
+        return self._paginate(
+            lambda limit, offset: self.get_messages(
+                talker_id=talker_id, sender_id=sender_id, keyword=keyword,
+                time_range=time_range, reverse=reverse,
+                limit=limit, offset=offset, fields=fields),
+            page_size)
+
+    def iter_messages_keyset(self, talker_id: str,
+                             time_range: Optional[str] = None,
+                             page_size: int = MAX_PAGE_SIZE,
+                             after_seq: Optional[int] = None,
+                             fields: Optional[Iterable[str]] = None):
+        """
+        按 Seq 游标逐条遍历某个会话的消息（升序）
+
+        第一页通过 /messages 获取，之后每页都以上一页最后一条消息的 Seq
+        为锚点调用 /search/context 取其后的消息，不再使用 offset，
+        因此每页的代价固定，遍历过程中有新消息写入也不会导致错页。
+
+        Args:
+            talker_id: 会话用户名
+            time_range: 时间范围
+            page_size: 每页数量
+            after_seq: 从该 Seq 之后继续遍历（不含该条消息），用于断点续传
+            fields: 只保留消息中的这些字段
+
+        Yields:
+            消息
+        """
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        start, end = parse_time_range(time_range)
+        last_seq = after_seq
+        fetch_fields, trim = keyset_fields(fields)
+
+        if last_seq is None:
+            page = self.get_messages(talker_id=talker_id, time_range=time_range,
+                                     limit=page_size, offset=0, fields=fetch_fields)
+            for msg in page:
+                yield trim(msg) if trim else msg
+                last_seq = msg['Seq']
+            if len(page) < page_size:
+                return
+
+        while True:
+            context = self.get_search_context(talker_id, last_seq, before=0, after=page_size,
+                                              fields=fetch_fields)
+            messages = context.get('messages') or []
+            anchor = context.get('anchor_index', 0)
+            page = [msg for msg in messages[anchor + 1:] if msg['Seq'] > last_seq]
+            for msg in page:
+                create_time = msg.get('CreateTime', 0)
+                if end is not None and create_time > end:
+                    return
+                if start is not None and create_time < start:
+                    continue
+                yield trim(msg) if trim else msg
+            # /search/context 的 after 没有文档化的上限，服务端可能截断，
+            # 所以只有空页才表示遍历结束
+            if not page:
+                return
+            last_seq = page[-1]['Seq']
+
+    def iter_messages_sharded(self, talker_id: str,
+                              time_range: Optional[str] = None,
+                              shards: int = 4,
+                              page_size: int = MAX_PAGE_SIZE,
+                              fields: Optional[Iterable[str]] = None,
+                              max_buffered: int = SHARD_BUFFER_PAGES):
+        """
+        按时间范围分片并发遍历某个会话的消息，按 Seq 升序产出
+
+        先用 get_monthly_analysis 的月度消息数把历史切成消息数相近的几个连续时间范围
+        （见 plan_time_shards），每个分片在独立的线程中按 Seq 游标拉取，
+        再用堆把各分片的消息流归并为 Seq 顺序。适合拉取大群的完整历史。
+
+        每个分片最多暂存 max_buffered 页尚未产出的消息，暂存满时该分片暂停拉取，
+        内存占用约为 分片数 × (max_buffered + 1) 页，与消息总数无关；
+        0 表示不限（调用方处理得慢时，后面的分片会把整个时间范围都暂存在内存中）。
+
+        Args:
+            talker_id: 会话用户名
+            time_range: 时间范围
+            shards: 最多切分的分片数（即并发数）
+            page_size: 每页数量
+            fields: 只保留消息中的这些字段
+            max_buffered: 每个分片最多暂存的页数
+
+        Yields:
+            消息
+        """
+        start, end = parse_time_range(time_range)
+        ranges = plan_time_shards(self.get_monthly_analysis(talker_id), shards, start, end)
+        if len(ranges) <= 1:
+            yield from self.iter_messages_keyset(talker_id, time_range=time_range,
+                                                 page_size=page_size, fields=fields)
+            return
+
+        import heapq
+        import queue
+
+        fetch_fields, trim = keyset_fields(fields)
+        stop = threading.Event()
+        done = object()
+        queues = [queue.Queue(maxsize=max_buffered) for _ in ranges]
+
+        def put(q, item) -> bool:
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce(shard_range: str, q):
+            try:
+                page = []
+                for msg in self.iter_messages_keyset(talker_id, time_range=shard_range,
+                                                     page_size=page_size, fields=fetch_fields):
+                    create_time = msg.get('CreateTime', 0)
+                    if (start is not None and create_time < start) or (end is not None and create_time > end):
+                        continue
+                    page.append(msg)
+                    if len(page) >= page_size:
+                        if not put(q, page):
+                            return
+                        page = []
+                if page and not put(q, page):
+                    return
+                put(q, done)
+            except BaseException as e:
+                put(q, e)
+
+        def drain(q):
+            while True:
+                item = q.get()
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield from item
+
+        threads = [threading.Thread(target=produce, args=(shard_range, q), daemon=True)
+                   for shard_range, q in zip(ranges, queues)]
+        for thread in threads:
+            thread.start()
+        try:
+            for msg in heapq.merge(*(drain(q) for q in queues), key=lambda msg: msg['Seq']):
+                yield trim(msg) if trim else msg
+        finally:
+            stop.set()
 
     # ==================== 联系人管理 ====================
 
@@ -167,6 +1990,22 @@ class WetraceClient:
 
         return self._request('GET', '/contacts', params=params)
 
+    def iter_contacts(self, keyword: Optional[str] = None,
+                      page_size: int = MAX_PAGE_SIZE):
+        """
+        逐条遍历全部联系人，自动分页
+
+        Args:
+            keyword: 搜索关键词
+            page_size: 每页数量
+
+        Yields:
+            联系人
+        """
+        return self._paginate(
+            lambda limit, offset: self.get_contacts(keyword, limit=limit, offset=offset),
+            page_size)
+
     def get_contact(self, contact_id: str) -> Dict:
         """
         获取单个联系人
@@ -192,21 +2031,26 @@ class WetraceClient:
         return self._request('GET', '/contacts/need-contact', params={'days': days})
 
     def export_contacts(self, format: str = 'csv',
-                       keyword: Optional[str] = None) -> bytes:
+                       keyword: Optional[str] = None,
+                       dest=None, progress=None) -> Union[bytes, int]:
         """
         导出联系人
 
         Args:
             format: 导出格式 ("csv" 或 "xlsx")
             keyword: 筛选关键词
+            dest: 目标文件路径或可写对象，指定时流式写入
+            progress: 进度回调 progress(已下载字节数, 总字节数或 None)
 
         Returns:
-            文件内容
+            文件内容；指定 dest 时返回文件字节数
         """
         params = {'format': format}
         if keyword:
             params['keyword'] = keyword
 
+        if dest is not None:
+            return self._download('/contacts/export', params, dest, progress)
         return self._request('GET', '/contacts/export', params=params)
 
     # ==================== 群聊管理 ====================
@@ -230,6 +2074,22 @@ class WetraceClient:
 
         return self._request('GET', '/chatrooms', params=params)
 
+    def iter_chatrooms(self, keyword: Optional[str] = None,
+                       page_size: int = MAX_PAGE_SIZE):
+        """
+        逐条遍历全部群聊，自动分页
+
+        Args:
+            keyword: 搜索关键词
+            page_size: 每页数量
+
+        Yields:
+            群聊
+        """
+        return self._paginate(
+            lambda limit, offset: self.get_chatrooms(keyword, limit=limit, offset=offset),
+            page_size)
+
     def get_chatroom(self, chatroom_id: str) -> Dict:
         """
         获取单个群聊
@@ -249,7 +2109,8 @@ class WetraceClient:
               sender: Optional[str] = None,
               msg_type: Optional[int] = None,
               time_range: Optional[str] = None,
-              limit: int = 50, offset: int = 0) -> Dict:
+              limit: int = 50, offset: int = 0,
+              fields: Optional[Iterable[str]] = None) -> Dict:
         """
         全文搜索
 
@@ -261,6 +2122,7 @@ class WetraceClient:
             time_range: 时间范围
             limit: 返回结果数量
             offset: 分页偏移量
+            fields: Items 中每条结果只保留这些字段
 
         Returns:
             搜索结果
@@ -275,10 +2137,39 @@ class WetraceClient:
         if time_range:
             params['time_range'] = time_range
 
-        return self._request('GET', '/search', params=params)
+        return self._request('GET', '/search', params=params, fields=fields)
+
+    def iter_search(self, keyword: str,
+                    talker: Optional[str] = None,
+                    sender: Optional[str] = None,
+                    msg_type: Optional[int] = None,
+                    time_range: Optional[str] = None,
+                    page_size: int = MAX_PAGE_SIZE,
+                    fields: Optional[Iterable[str]] = None):
+        """
+        逐条遍历全部搜索结果，自动分页，HasMore 为 false 时停止
+
+        Args:
+            keyword: 搜索关键词
+            talker: 会话用户名
+            sender: 发送者用户名
+            msg_type: 消息类型
+            time_range: 时间范围
+            page_size: 每页数量
+            fields: 每条结果只保留这些字段
+
+        Yields:
+            搜索结果条目（Items 中的元素）
+        """
+        return self._paginate(
+            lambda limit, offset: self.search(
+                keyword, talker=talker, sender=sender, msg_type=msg_type,
+                time_range=time_range, limit=limit, offset=offset, fields=fields),
+            page_size)
 
     def get_search_context(self, talker: str, seq: int,
-                          before: int = 10, after: int = 10) -> Dict:
+                          before: int = 10, after: int = 10,
+                          fields: Optional[Iterable[str]] = None) -> Dict:
         """
         获取搜索结果的上下文消息
 
@@ -287,12 +2178,66 @@ class WetraceClient:
             seq: 消息序列号
             before: 之前的消息数量
             after: 之后的消息数量
+            fields: 只保留消息中的这些字段
 
         Returns:
             上下文消息
         """
         params = {'talker': talker, 'seq': seq, 'before': before, 'after': after}
-        return self._request('GET', '/search/context', params=params)
+        return self._request('GET', '/search/context', params=params, fields=fields)
+
+    def get_contexts_bulk(self, hits: Iterable, before: int = 10, after: int = 10,
+                          fields: Optional[Iterable[str]] = None,
+                          max_workers: int = 8,
+                          max_window: int = MAX_PAGE_SIZE) -> List[Dict]:
+        """
+        批量获取搜索结果的上下文
+
+        同一会话中重叠或相邻的窗口合并为一个请求（见 plan_context_windows），
+        各请求并发执行，再按 Seq 切出每条命中的上下文。
+
+        Args:
+            hits: 搜索结果条目（含 Talker 和 Seq）或 (talker, seq) 元组
+            before: 每条命中之前的消息数量
+            after: 每条命中之后的消息数量
+            fields: 只保留消息中的这些字段
+            max_workers: 最大并发线程数
+            max_window: 合并后单个请求最多覆盖的消息数
+
+        Returns:
+            与 hits 一一对应的上下文，结构与 get_search_context 一致
+        """
+        hits = list(hits)
+        windows = plan_context_windows(hits, before, after, max_window)
+        fetch_fields, trim = keyset_fields(fields)
+
+        def run(window):
+            talker, anchor, window_before, window_after, seqs = window
+            merged = self.get_search_context(talker, anchor, before=window_before,
+                                             after=window_after, fields=fetch_fields)
+            contexts = split_context(merged.get('messages') or [], seqs, before, after)
+            for seq, context in contexts.items():
+                if context is None:
+                    # 合并窗口中没有这条消息（例如服务端截断了窗口），单独请求
+                    contexts[seq] = self.get_search_context(talker, seq, before=before,
+                                                            after=after, fields=fetch_fields)
+            return talker, contexts
+
+        if len(windows) <= 1 or max_workers <= 1:
+            outcomes = [run(window) for window in windows]
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                outcomes = list(executor.map(run, windows))
+
+        contexts = {}
+        for talker, by_seq in outcomes:
+            for seq, context in by_seq.items():
+                if trim:
+                    context = dict(context, messages=[trim(msg) for msg in context.get('messages') or []])
+                contexts[(talker, seq)] = context
+        return [contexts[hit_key(hit)] for hit in hits]
 
     # ==================== 总览数据 ====================
 
@@ -437,12 +2382,55 @@ class WetraceClient:
         """
         return self._request('GET', f'/analysis/wordcloud/{session_id}')
 
+    def analyze_many(self, session_ids: List[str],
+                     kinds: Optional[List[str]] = None,
+                     max_workers: int = 8) -> tuple:
+        """
+        并发获取多个会话的多种分析数据
+
+        Args:
+            session_ids: 会话 ID 列表
+            kinds: 分析类型列表（ANALYSIS_KINDS 的键，默认全部）
+            max_workers: 最大并发线程数
+
+        Returns:
+            (results, errors) 元组，两者都以 (session_id, kind) 为键，
+            results 的值为分析数据，errors 的值为错误信息
+        """
+        kinds = list(kinds or ANALYSIS_KINDS)
+        unknown = [kind for kind in kinds if kind not in ANALYSIS_KINDS]
+        if unknown:
+            raise ValueError(f"未知的分析类型: {', '.join(unknown)}")
+
+        tasks = [(session_id, kind) for session_id in dict.fromkeys(session_ids)
+                 for kind in kinds]
+        results = {}
+        errors = {}
+        if not tasks:
+            return results, errors
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        def run(task):
+            session_id, kind = task
+            return getattr(self, ANALYSIS_KINDS[kind])(session_id)
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {executor.submit(run, task): task for task in tasks}
+            for future, task in futures.items():
+                try:
+                    results[task] = future.result()
+                except Exception as e:
+                    errors[task] = str(e)
+        return results, errors
+
     # ==================== 数据导出 ====================
 
     def export_chat(self, talker: str,
                    name: Optional[str] = None,
                    time_range: Optional[str] = None,
-                   format: str = 'html') -> bytes:
+                   format: str = 'html',
+                   dest=None, progress=None) -> Union[bytes, int]:
         """
         导出聊天记录
 
@@ -451,9 +2439,11 @@ class WetraceClient:
             name: 显示名称
             time_range: 时间范围
             format: 导出格式 ("html", "txt", "csv", "xlsx", "docx", "pdf")
+            dest: 目标文件路径或可写对象，指定时流式写入
+            progress: 进度回调 progress(已下载字节数, 总字节数或 None)
 
         Returns:
-            文件内容
+            文件内容；指定 dest 时返回文件字节数
         """
         params = {'talker': talker, 'format': format}
         if name:
@@ -461,11 +2451,14 @@ class WetraceClient:
         if time_range:
             params['time_range'] = time_range
 
+        if dest is not None:
+            return self._download('/export/chat', params, dest, progress)
         return self._request('GET', '/export/chat', params=params)
 
     def export_forensic(self, talker: str,
                        name: Optional[str] = None,
-                       time_range: Optional[str] = None) -> bytes:
+                       time_range: Optional[str] = None,
+                       dest=None, progress=None) -> Union[bytes, int]:
         """
         导出取证记录
 
@@ -473,9 +2466,11 @@ class WetraceClient:
             talker: 会话用户名
             name: 显示名称
             time_range: 时间范围
+            dest: 目标文件路径或可写对象，指定时流式写入
+            progress: 进度回调 progress(已下载字节数, 总字节数或 None)
 
         Returns:
-            ZIP 文件内容
+            ZIP 文件内容；指定 dest 时返回文件字节数
         """
         params = {'talker': talker}
         if name:
@@ -483,26 +2478,199 @@ class WetraceClient:
         if time_range:
             params['time_range'] = time_range
 
+        if dest is not None:
+            return self._download('/export/forensic', params, dest, progress)
         return self._request('GET', '/export/forensic', params=params)
 
     def export_voices(self, talker: str,
-                     time_range: Optional[str] = None) -> bytes:
+                     time_range: Optional[str] = None,
+                     dest=None, progress=None) -> Union[bytes, int]:
         """
         导出语音消息
 
         Args:
             talker: 会话用户名
             time_range: 时间范围
+            dest: 目标文件路径或可写对象，指定时流式写入
+            progress: 进度回调 progress(已下载字节数, 总字节数或 None)
 
         Returns:
-            ZIP 文件内容
+            ZIP 文件内容；指定 dest 时返回文件字节数
         """
         params = {'talker': talker}
         if time_range:
             params['time_range'] = time_range
 
+        if dest is not None:
+            return self._download('/export/voices', params, dest, progress)
         return self._request('GET', '/export/voices', params=params)
 
+    def export_many(self, sessions: List[Union[str, Dict]],
+                    export_type: str = 'chat',
+                    output_dir: str = DEFAULT_EXPORT_DIR,
+                    format: str = 'html',
+                    time_range: Optional[str] = None,
+                    max_workers: int = 4,
+                    manifest_path: Optional[str] = None,
+                    skip_unchanged: bool = True,
+                    on_done=None) -> Dict:
+        """
+        并发批量导出多个会话，并写入 JSON 清单
+
+        清单记录每个会话的文件路径、大小、SHA-256、耗时和会话的 LastMessageTime。
+        再次运行时，LastMessageTime 未变化且文件仍然存在的会话会被跳过。
+
+        Args:
+            sessions: 会话列表，元素为会话 ID 或 get_sessions 返回的会话字典
+            export_type: 导出类型 ("chat"、"forensic" 或 "voices")
+            output_dir: 输出目录
+            format: 导出格式（用于 chat 导出和文件扩展名）
+            time_range: 时间范围
+            max_workers: 最大并发导出数
+            manifest_path: 清单路径（默认为输出目录下的 manifest_{export_type}.json）
+            skip_unchanged: 是否跳过自上次导出以来没有新消息的会话
+            on_done: 每个会话完成后的回调 on_done(talker, entry)
+
+        Returns:
+            清单字典
+        """
+        manifest_path, previous, targets = self._prepare_export_many(
+            sessions, export_type, output_dir, manifest_path)
+
+        def run(talker, session):
+            filepath = os.path.join(output_dir, export_filename(export_type, talker, format))
+            skipped = self._skipped_export(previous.get(talker), session, filepath,
+                                           time_range, skip_unchanged)
+            if skipped is not None:
+                return skipped
+            started = time.monotonic()
+            try:
+                self._export_session(export_type, talker, session, filepath, format, time_range)
+            except Exception as e:
+                return self._export_entry(session, filepath, time_range, started, e)
+            return self._export_entry(session, filepath, time_range, started)
+
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        entries = {}
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {executor.submit(run, talker, session): talker
+                       for talker, session in targets.items()}
+            for future in as_completed(futures):
+                talker = futures[future]
+                entries[talker] = future.result()
+                if on_done:
+                    on_done(talker, entries[talker])
+
+        return self._write_export_manifest(manifest_path, export_type, format, targets, entries)
+
+    @staticmethod
+    def _prepare_export_many(sessions: List[Union[str, Dict]], export_type: str,
+                             output_dir: str, manifest_path: Optional[str]) -> tuple:
+        """
+        批量导出前的准备：检查导出类型，创建输出目录并读取上次的清单
+
+        Returns:
+            (清单路径, 上次清单中的会话条目, 以会话 ID 为键的会话字典)
+        """
+        if export_type not in ('chat', 'forensic', 'voices'):
+            raise ValueError(f"不支持批量导出的类型: {export_type}")
+
+        os.makedirs(output_dir, exist_ok=True)
+        manifest_path = manifest_path or os.path.join(output_dir, f"manifest_{export_type}.json")
+        previous = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as f:
+                previous = json.load(f).get('sessions', {})
+
+        targets = {}
+        for session in sessions:
+            if isinstance(session, dict):
+                targets[session['UserName']] = session
+            else:
+                targets[session] = {'UserName': session}
+        return manifest_path, previous, targets
+
+    @staticmethod
+    def _skipped_export(old: Optional[Dict], session: Dict, filepath: str,
+                        time_range: Optional[str], skip_unchanged: bool) -> Optional[Dict]:
+        """会话自上次导出以来没有新消息且文件未变时返回跳过的条目，否则返回 None"""
+        last_message_time = session.get('LastMessageTime')
+        if skip_unchanged and old and old.get('status') in ('exported', 'skipped') \
+                and last_message_time is not None \
+                and old.get('last_message_time') == last_message_time \
+                and old.get('time_range') == time_range \
+                and os.path.exists(filepath) and os.path.getsize(filepath) == old.get('size'):
+            return dict(old, status='skipped')
+        return None
+
+    def _export_session(self, export_type: str, talker: str, session: Dict, filepath: str,
+                        format: str, time_range: Optional[str]):
+        """把单个会话导出到 filepath"""
+        if export_type == 'chat':
+            return self.export_chat(talker, name=session.get('NickName'), time_range=time_range,
+                                    format=format, dest=filepath)
+        if export_type == 'forensic':
+            return self.export_forensic(talker, name=session.get('NickName'),
+                                        time_range=time_range, dest=filepath)
+        return self.export_voices(talker, time_range=time_range, dest=filepath)
+
+    @staticmethod
+    def _export_entry(session: Dict, filepath: str, time_range: Optional[str],
+                      started: float, error: Optional[Exception] = None) -> Dict:
+        """生成单个会话的清单条目"""
+        entry = {
+            'file': filepath,
+            'last_message_time': session.get('LastMessageTime'),
+            'time_range': time_range,
+        }
+        if error is not None:
+            entry.update(status='failed', error=str(error),
+                         seconds=round(time.monotonic() - started, 3))
+            return entry
+        entry.update(status='exported',
+                     size=os.path.getsize(filepath),
+                     sha256=file_sha256(filepath),
+                     seconds=round(time.monotonic() - started, 3),
+                     exported_at=int(time.time()))
+        return entry
+
+    @staticmethod
+    def _write_export_manifest(manifest_path: str, export_type: str, format: str,
+                               targets: Dict, entries: Dict) -> Dict:
+        """汇总各会话的条目并原子地写入清单"""
+        manifest = {
+            'generated_at': int(time.time()),
+            'export_type': export_type,
+            'format': format,
+            'sessions': {talker: entries[talker] for talker in targets},
+        }
+        manifest['summary'] = {
+            status: sum(1 for entry in entries.values() if entry['status'] == status)
+            for status in ('exported', 'skipped', 'failed')
+        }
+        tmp_path = f"{manifest_path}.part"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+        return manifest
+
+
+def export_filename(export_type: str, talker: Optional[str], format: str) -> str:
+    """导出文件名"""
+    return f"{export_type}_{talker or 'export'}.{format}"
+
+
+def file_sha256(path: str) -> str:
+    """分块计算文件的 SHA-256"""
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 
 # ==================== 命令行接口 ====================
 
@@ -511,187 +2679,891 @@ def print_json(data):
     print(json.dumps(data, ensure_ascii=False, indent=2))
 
 
+# 列表命令支持的输出格式
+OUTPUT_FORMATS = ('json', 'ndjson', 'compact', 'csv')
+
+
+class RecordWriter:
+    """
+    逐条输出记录，每条写完立即刷新，不在内存中累积结果
+
+    - json：与 print_json 相同的缩进 JSON 数组
+    - ndjson：每行一条紧凑 JSON
+    - compact：单行紧凑 JSON 数组
+    - csv：以第一条记录的字段为表头，嵌套字段编码为 JSON
+    """
+
+    def __init__(self, output: str = 'json', stream=None):
+        """
+        初始化
+
+        Args:
+            output: 输出格式（OUTPUT_FORMATS 之一）
+            stream: 输出流（默认标准输出）
+        """
+        if output not in OUTPUT_FORMATS:
+            raise ValueError(f"不支持的输出格式: {output}")
+        self.output = output
+        self.stream = stream if stream is not None else sys.stdout
+        self.count = 0
+        self._csv = None
+
+    def write(self, record: Any):
+        """输出一条记录"""
+        stream = self.stream
+        if self.output == 'ndjson':
+            stream.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        elif self.output == 'compact':
+            stream.write(('[' if not self.count else ',')
+                         + json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+        elif self.output == 'csv':
+            self._write_csv(record)
+        else:
+            text = json.dumps(record, ensure_ascii=False, indent=2).replace('\n', '\n  ')
+            stream.write(('[\n  ' if not self.count else ',\n  ') + text)
+        self.count += 1
+        stream.flush()
+
+    def _write_csv(self, record: Any):
+        if not isinstance(record, dict):
+            record = {'value': record}
+        if self._csv is None:
+            import csv
+
+            self._csv = csv.DictWriter(self.stream, fieldnames=list(record),
+                                       extrasaction='ignore', lineterminator='\n')
+            self._csv.writeheader()
+        self._csv.writerow({
+            key: json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+            for key, value in record.items()
+        })
+
+    def write_all(self, records: Iterable) -> int:
+        """输出全部记录并结束输出，返回记录数"""
+        for record in records:
+            self.write(record)
+        self.close()
+        return self.count
+
+    def close(self):
+        """结束输出（补全 JSON 数组的结尾）"""
+        if self.output == 'json':
+            self.stream.write('[]\n' if not self.count else '\n]\n')
+        elif self.output == 'compact':
+            self.stream.write('[]\n' if not self.count else ']\n')
+        self.stream.flush()
+
+
+def print_records(args, records: Iterable):
+    """按 --output 逐条输出列表命令的结果"""
+    RecordWriter(args.output).write_all(records)
+
+
+def make_client(args) -> WetraceClient:
+    """根据命令行全局参数创建客户端（在守护进程中由 args.clients 提供常驻的客户端）"""
+    clients = getattr(args, 'clients', None)
+    if clients is not None:
+        return clients.get(args)
+    cache = None
+    if not args.no_cache:
+        cache_path = args.cache or os.environ.get('WETRACE_CACHE')
+        if cache_path:
+            cache = ResponseCache(cache_path)
+    limiter = RequestLimiter() if args.throttle else None
+    return WetraceClient(args.base_url, cache=cache,
+                         retry=RetryPolicy(max_retries=args.retries),
+                         compress={'auto': None, 'on': True, 'off': False}[args.compress],
+                         limiter=limiter,
+                         metrics=getattr(args, 'metrics', None))
+
+
+def make_resolver(args):
+    """创建联系人解析器（在守护进程中由 args.clients 提供常驻的解析器，预加载的数据在命令之间复用）"""
+    clients = getattr(args, 'clients', None)
+    if clients is not None:
+        return clients.get_resolver(args)
+    from wetrace_resolver import ContactResolver
+
+    return ContactResolver(make_client(args))
+
+
+def add_output_arguments(parser, paginated: bool = True):
+    """为列表命令添加 --output（以及 --all、--page-size）参数"""
+    parser.add_argument('--output', choices=OUTPUT_FORMATS, default='json',
+                        help='输出格式：json（默认）、ndjson（每行一条）、compact（单行）、csv；'
+                             '记录逐条输出，不必等待全部结果')
+    if paginated:
+        parser.add_argument('--all', action='store_true',
+                            help='自动分页获取全部结果（忽略 --limit 和 --offset）')
+        parser.add_argument('--page-size', type=int, default=MAX_PAGE_SIZE,
+                            help=f'--all 时每页的数量（默认 {MAX_PAGE_SIZE}）')
+
+
+def parse_fields(value: str) -> List[str]:
+    """解析逗号分隔的字段列表"""
+    import argparse
+
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    if not fields:
+        raise argparse.ArgumentTypeError('字段列表不能为空')
+    return fields
+
+
+def add_fields_argument(parser):
+    """为消息类命令添加 --fields 参数"""
+    parser.add_argument('--fields', type=parse_fields, metavar='F1,F2',
+                        help='只输出这些字段（逗号分隔，如 Seq,CreateTime,Type）')
+
+
 def cmd_sessions(args):
     """获取会话列表"""
-    client = WetraceClient(args.base_url)
-    sessions = client.get_sessions(
-        keyword=args.keyword,
-        limit=args.limit,
-        offset=args.offset
-    )
-    print_json(sessions)
+    client = make_client(args)
+    if args.all:
+        sessions = client.iter_sessions(keyword=args.keyword, page_size=args.page_size)
+    else:
+        sessions = client.get_sessions(
+            keyword=args.keyword,
+            limit=args.limit,
+            offset=args.offset
+        )
+    print_records(args, sessions)
 
 
 def cmd_messages(args):
     """获取消息列表"""
-    client = WetraceClient(args.base_url)
-    messages = client.get_messages(
-        talker_id=args.talker,
-        sender_id=args.sender,
-        keyword=args.keyword,
-        time_range=args.time_range,
-        reverse=args.reverse,
-        limit=args.limit,
-        offset=args.offset
-    )
-    print_json(messages)
+    client = make_client(args)
+    if args.all and args.shards > 1:
+        if not args.talker or args.sender or args.keyword or args.reverse:
+            raise ValueError("--shards 只支持按 --talker 升序遍历")
+        messages = client.iter_messages_sharded(
+            args.talker,
+            time_range=args.time_range,
+            shards=args.shards,
+            page_size=args.page_size,
+            fields=args.fields,
+            max_buffered=args.shard_buffer
+        )
+    elif args.all:
+        messages = client.iter_messages(
+            talker_id=args.talker,
+            sender_id=args.sender,
+            keyword=args.keyword,
+            time_range=args.time_range,
+            reverse=args.reverse,
+            page_size=args.page_size,
+            fields=args.fields
+        )
+    else:
+        messages = client.get_messages(
+            talker_id=args.talker,
+            sender_id=args.sender,
+            keyword=args.keyword,
+            time_range=args.time_range,
+            reverse=args.reverse,
+            limit=args.limit,
+            offset=args.offset,
+            fields=args.fields
+        )
+    print_records(args, messages)
 
 
 def cmd_contacts(args):
     """获取联系人列表"""
-    client = WetraceClient(args.base_url)
-    contacts = client.get_contacts(
-        keyword=args.keyword,
-        limit=args.limit,
-        offset=args.offset
-    )
-    print_json(contacts)
+    client = make_client(args)
+    if args.all:
+        contacts = client.iter_contacts(keyword=args.keyword, page_size=args.page_size)
+    else:
+        contacts = client.get_contacts(
+            keyword=args.keyword,
+            limit=args.limit,
+            offset=args.offset
+        )
+    print_records(args, contacts)
 
 
 def cmd_contact(args):
     """获取单个联系人"""
-    client = WetraceClient(args.base_url)
+    client = make_client(args)
     contact = client.get_contact(args.id)
     print_json(contact)
 
 
 def cmd_need_contact(args):
     """获取需要跟进的联系人"""
-    client = WetraceClient(args.base_url)
+    client = make_client(args)
     contacts = client.get_need_contact(days=args.days)
-    print_json(contacts)
+    print_records(args, contacts)
 
 
 def cmd_chatrooms(args):
     """获取群聊列表"""
-    client = WetraceClient(args.base_url)
-    chatrooms = client.get_chatrooms(
-        keyword=args.keyword,
-        limit=args.limit,
-        offset=args.offset
-    )
-    print_json(chatrooms)
+    client = make_client(args)
+    if args.all:
+        chatrooms = client.iter_chatrooms(keyword=args.keyword, page_size=args.page_size)
+    else:
+        chatrooms = client.get_chatrooms(
+            keyword=args.keyword,
+            limit=args.limit,
+            offset=args.offset
+        )
+    print_records(args, chatrooms)
 
 
 def cmd_chatroom(args):
     """获取单个群聊"""
-    client = WetraceClient(args.base_url)
+    client = make_client(args)
     chatroom = client.get_chatroom(args.id)
+    if args.member_names:
+        from wetrace_resolver import ChatroomRecord
+
+        chatroom['MemberNames'] = make_resolver(args).resolve(ChatroomRecord(chatroom).members)
     print_json(chatroom)
 
 
 def cmd_search(args):
     """全文搜索"""
-    client = WetraceClient(args.base_url)
-    results = client.search(
+    if args.local:
+        from wetrace_index import SearchIndex
+
+        searcher = SearchIndex(args.index or DEFAULT_INDEX_PATH)
+    else:
+        searcher = make_client(args)
+    if args.all:
+        print_records(args, searcher.iter_search(
+            keyword=args.keyword,
+            talker=args.talker,
+            sender=args.sender,
+            msg_type=args.type,
+            time_range=args.time_range,
+            page_size=args.page_size,
+            fields=args.fields
+        ))
+        return
+    results = searcher.search(
         keyword=args.keyword,
         talker=args.talker,
         sender=args.sender,
         msg_type=args.type,
         time_range=args.time_range,
         limit=args.limit,
-        offset=args.offset
+        offset=args.offset,
+        fields=args.fields
     )
-    print_json(results)
+    if args.output == 'json':
+        # 保持原有输出：包含 Total 和 HasMore 的完整结果
+        print_json(results)
+    else:
+        print_records(args, results['Items'])
+
+
+def read_hits(source: str) -> List[Dict]:
+    """从文件（"-" 表示标准输入）读取搜索结果，每行一个 JSON 对象（search --output ndjson 的输出）"""
+    if source == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(source, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    return [json.loads(line) for line in lines if line.strip()]
 
 
 def cmd_search_context(args):
     """获取搜索上下文"""
-    client = WetraceClient(args.base_url)
-    context = client.get_search_context(
-        talker=args.talker,
-        seq=args.seq,
-        before=args.before,
-        after=args.after
-    )
-    print_json(context)
+    client = make_client(args)
+    if args.hits:
+        hits = [hit_key(hit) for hit in read_hits(args.hits)]
+    elif args.talker and args.seq:
+        hits = [(args.talker, seq) for seq in args.seq]
+    else:
+        raise ValueError("需要指定 --talker 和 --seq，或 --hits")
+    if not args.hits and len(hits) == 1:
+        context = client.get_search_context(
+            talker=args.talker,
+            seq=args.seq[0],
+            before=args.before,
+            after=args.after
+        )
+        print_json(context)
+        return
+    contexts = client.get_contexts_bulk(hits, before=args.before, after=args.after,
+                                        max_workers=args.workers)
+    print_json([dict(context, Talker=talker, Seq=seq)
+                for (talker, seq), context in zip(hits, contexts)])
 
 
 def cmd_dashboard(args):
     """获取概览数据"""
-    client = WetraceClient(args.base_url)
+    if args.local:
+        from wetrace_rollup import RollupStore
+
+        with RollupStore(args.rollup_db or DEFAULT_ROLLUP_PATH) as store:
+            print_json(store.dashboard(time_range=args.time_range))
+        return
+    client = make_client(args)
     dashboard = client.get_dashboard()
     print_json(dashboard)
 
 
+def read_session_ids(source: str) -> List[str]:
+    """从文件（"-" 表示标准输入）读取会话 ID，每行一个，忽略空行和 # 注释"""
+    if source == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(source, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    return [line.strip() for line in lines
+            if line.strip() and not line.strip().startswith('#')]
+
+
+def cmd_local_analysis(client: WetraceClient, args) -> Dict:
+    """在本地一次遍历计算全部统计，消息来自本地镜像或 API"""
+    from wetrace_analytics import MESSAGE_FIELDS, analyze_messages
+
+    if not args.session_id:
+        raise ValueError("local-all 需要指定会话 ID")
+    start, end = parse_time_range(args.time_range)
+    if args.mirror:
+        from wetrace_mirror import MirrorStore
+        with MirrorStore(args.mirror) as store:
+            return analyze_messages(store.iter_messages(args.session_id), start, end)
+    messages = client.iter_messages(args.session_id, time_range=args.time_range, keyset=True,
+                                    fields=MESSAGE_FIELDS)
+    return analyze_messages(messages, start, end)
+
+
+def cmd_local_wordcloud(args) -> List[Dict]:
+    """从本地词频库合并出词云，支持时间范围和多个会话"""
+    from wetrace_terms import TermStore
+
+    talkers = None
+    if args.analysis_type == 'wordcloud':
+        if not args.session_id:
+            raise ValueError("wordcloud 需要指定会话 ID")
+        talkers = [talker for talker in args.session_id.split(',') if talker]
+    with TermStore(args.terms_db or DEFAULT_TERMS_PATH) as store:
+        return store.wordcloud(talkers, time_range=args.time_range, limit=args.limit)
+
+
+def cmd_local_rollup(args):
+    """从本地汇总库算出分布、社交排行榜或年度报告，支持时间范围和多个会话"""
+    from wetrace_rollup import DISTRIBUTION_KINDS, RollupStore
+
+    kind = args.analysis_type
+    if kind not in DISTRIBUTION_KINDS + ('top_contacts', 'annual'):
+        raise ValueError(f"{kind} 不支持 --local")
+    with RollupStore(args.rollup_db or DEFAULT_ROLLUP_PATH) as store:
+        if kind == 'top_contacts':
+            return store.top_contacts(limit=args.limit, time_range=args.time_range)
+        if kind == 'annual':
+            return store.annual_report(year=args.year)
+        talkers = [talker for talker in args.session_id.split(',') if talker] if args.session_id else None
+        return store.distribution(kind, talkers, time_range=args.time_range)
+
+
 def cmd_analysis(args):
     """数据分析"""
-    client = WetraceClient(args.base_url)
-
-    analysis_map = {
-        'hourly': client.get_hourly_analysis,
-        'daily': client.get_daily_analysis,
-        'weekday': client.get_weekday_analysis,
-        'monthly': client.get_monthly_analysis,
-        'type': client.get_type_distribution,
-        'member': client.get_member_activity,
-        'repeat': client.get_repeat_analysis,
-        'wordcloud': client.get_wordcloud,
-    }
-
-    if args.analysis_type == 'top_contacts':
+    client = make_client(args)
+
+    if args.batch:
+        kinds = args.kinds.split(',') if args.kinds else [args.analysis_type]
+        unknown = [kind for kind in kinds if kind not in ANALYSIS_KINDS]
+        if unknown:
+            print(f"错误: 批量模式不支持的分析类型 '{', '.join(unknown)}'")
+            return
+        results, errors = client.analyze_many(
+            read_session_ids(args.batch),
+            kinds=kinds,
+            max_workers=args.workers
+        )
+        output = {'results': {}, 'errors': {}}
+        for (session_id, kind), data in results.items():
+            output['results'].setdefault(session_id, {})[kind] = data
+        for (session_id, kind), error in errors.items():
+            output['errors'].setdefault(session_id, {})[kind] = error
+        print_json(output)
+        return
+
+    if args.analysis_type == 'local-all':
+        result = cmd_local_analysis(client, args)
+    elif args.local and args.analysis_type in ('wordcloud', 'wordcloud_global'):
+        result = cmd_local_wordcloud(args)
+    elif args.local:
+        result = cmd_local_rollup(args)
+    elif args.analysis_type == 'top_contacts':
         result = client.get_top_contacts()
     elif args.analysis_type == 'wordcloud_global':
         result = client.get_global_wordcloud()
     elif args.analysis_type == 'annual':
         result = client.get_annual_report(year=args.year)
     else:
-        func = analysis_map.get(args.analysis_type)
-        if not func:
+        method = ANALYSIS_KINDS.get(args.analysis_type)
+        if not method:
             print(f"错误: 未知的分析类型 '{args.analysis_type}'")
             return
-        result = func(args.session_id)
+        result = getattr(client, method)(args.session_id)
 
     print_json(result)
 
 
+def print_progress(done: int, total: Optional[int]):
+    """在标准错误输出下载进度"""
+    if total:
+        sys.stderr.write(f"\r已下载 {done / 1048576:.1f} / {total / 1048576:.1f} MB ({done * 100 // total}%)")
+    else:
+        sys.stderr.write(f"\r已下载 {done / 1048576:.1f} MB")
+    if total is not None and done >= total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
 def cmd_export(args):
     """数据导出"""
-    client = WetraceClient(args.base_url)
+    client = make_client(args)
+
+    if args.all or args.from_file:
+        cmd_export_many(client, args)
+        return
+
+    output_dir = DEFAULT_EXPORT_DIR
+    os.makedirs(output_dir, exist_ok=True)
+
+    filename = export_filename(args.export_type, args.talker, args.format)
+    filepath = os.path.join(output_dir, filename)
+    progress = None if args.quiet else print_progress
 
+    # 流式写入文件
     if args.export_type == 'chat':
-        data = client.export_chat(
+        client.export_chat(
             talker=args.talker,
             name=args.name,
             time_range=args.time_range,
-            format=args.format
+            format=args.format,
+            dest=filepath,
+            progress=progress
         )
     elif args.export_type == 'forensic':
-        data = client.export_forensic(
+        client.export_forensic(
             talker=args.talker,
             name=args.name,
-            time_range=args.time_range
+            time_range=args.time_range,
+            dest=filepath,
+            progress=progress
         )
     elif args.export_type == 'voices':
-        data = client.export_voices(
+        client.export_voices(
             talker=args.talker,
-            time_range=args.time_range
+            time_range=args.time_range,
+            dest=filepath,
+            progress=progress
         )
     elif args.export_type == 'contacts':
-        data = client.export_contacts(
+        client.export_contacts(
             format=args.format,
-            keyword=args.keyword
+            keyword=args.keyword,
+            dest=filepath,
+            progress=progress
         )
     else:
         print(f"错误: 未知的导出类型 '{args.export_type}'")
         return
 
-    # 保存文件
-    import os
-    output_dir = os.path.expanduser('~/wetrace-exports')
-    os.makedirs(output_dir, exist_ok=True)
+    print(f"文件已保存到: {filepath}")
 
-    filename = f"{args.export_type}_{args.talker or 'export'}.{args.format}"
-    filepath = os.path.join(output_dir, filename)
 
-    with open(filepath, 'wb') as f:
-        f.write(data)
+def cmd_export_many(client: WetraceClient, args):
+    """批量导出多个会话"""
+    if args.export_type == 'contacts':
+        print("错误: contacts 导出不支持批量模式")
+        return
 
-    print(f"文件已保存到: {filepath}")
+    # 会话的 LastMessageTime 用于跳过没有新消息的会话
+    keyword = None if args.from_file else args.keyword
+    sessions = {session['UserName']: session
+                for session in client.iter_sessions(keyword=keyword)}
+    if args.from_file:
+        targets = [sessions.get(talker, talker) for talker in read_session_ids(args.from_file)]
+    else:
+        targets = list(sessions.values())
+
+    def on_done(talker, entry):
+        if not args.quiet:
+            print(f"[{entry['status']}] {talker} {entry.get('error', '')}".rstrip(),
+                  file=sys.stderr)
+
+    manifest = client.export_many(
+        targets,
+        export_type=args.export_type,
+        output_dir=args.output_dir or DEFAULT_EXPORT_DIR,
+        format=args.format,
+        time_range=args.time_range,
+        max_workers=args.workers,
+        skip_unchanged=not args.force,
+        on_done=on_done
+    )
+    print_json(manifest['summary'])
 
 
-def main():
-    """命令行入口"""
+def cmd_sync(args):
+    """增量同步到本地镜像"""
+    from wetrace_mirror import MirrorStore
+
+    client = make_client(args)
+    with MirrorStore(args.db or DEFAULT_MIRROR_PATH) as store:
+        if args.stats:
+            print_json(store.stats())
+            return
+
+        def on_done(talker, outcome):
+            if args.quiet:
+                return
+            if isinstance(outcome, Exception):
+                print(f"[failed] {talker} {outcome}", file=sys.stderr)
+            else:
+                print(f"[synced] {talker} +{outcome}", file=sys.stderr)
+
+        talkers = args.talker or (read_session_ids(args.from_file) if args.from_file else None)
+        result = store.sync(
+            client,
+            talkers=talkers,
+            keyword=args.keyword,
+            include_directory=not args.skip_contacts,
+            max_workers=args.workers,
+            on_done=on_done
+        )
+        print_json(result)
+
+
+def cmd_index(args):
+    """增量更新本地全文索引"""
+    from wetrace_index import SearchIndex
+
+    with SearchIndex(args.db or DEFAULT_INDEX_PATH) as index:
+        if not args.stats:
+            talkers = args.talker or None
+            if args.mirror:
+                from wetrace_mirror import MirrorStore
+                with MirrorStore(args.mirror) as store:
+                    added = index.update_from_mirror(store, talkers)
+            else:
+                added = index.update_from_client(make_client(args), talkers)
+            print(f"新增索引 {added} 条消息", file=sys.stderr)
+        print_json(index.stats())
+
+
+def cmd_terms(args):
+    """增量更新本地词频库"""
+    from wetrace_terms import TermStore
+
+    with TermStore(args.db or DEFAULT_TERMS_PATH) as store:
+        if not args.stats:
+            talkers = args.talker or None
+            if args.mirror:
+                from wetrace_mirror import MirrorStore
+                with MirrorStore(args.mirror) as mirror:
+                    added = store.update_from_mirror(mirror, talkers)
+            else:
+                added = store.update_from_client(make_client(args), talkers)
+            print(f"新增统计 {added} 条文本消息", file=sys.stderr)
+        print_json(store.stats())
+
+
+def cmd_rollup(args):
+    """增量更新本地汇总库，或与服务端核对"""
+    from wetrace_rollup import RollupStore
+
+    with RollupStore(args.db or DEFAULT_ROLLUP_PATH) as store:
+        if args.verify:
+            result = store.verify(make_client(args), year=args.year)
+            print_json(result)
+            if not result['ok']:
+                mismatched = sum(1 for item in result['checks'] if not item['ok'])
+                raise WetraceError(f"本地汇总与服务端有 {mismatched} 项不一致")
+            return
+        if not args.stats:
+            talkers = args.talker or None
+            if args.mirror:
+                from wetrace_mirror import MirrorStore
+                with MirrorStore(args.mirror) as mirror:
+                    added = store.update_from_mirror(mirror, talkers)
+            else:
+                added = store.update_from_client(make_client(args), talkers)
+            print(f"新增汇总 {added} 条消息", file=sys.stderr)
+        print_json(store.stats())
+
+
+def cmd_serve(args):
+    """启动守护进程"""
+    from wetrace_daemon import serve
+
+    serve(args)
+
+
+def cmd_repl(args):
+    """交互模式"""
+    from wetrace_daemon import repl
+
+    repl(args)
+
+
+def _setup_sessions_parser(parser):
+    """sessions 命令的参数"""
+    parser.add_argument('--keyword', help='搜索关键词')
+    parser.add_argument('--limit', type=int, default=50, help='返回数量')
+    parser.add_argument('--offset', type=int, default=0, help='偏移量')
+    add_output_arguments(parser)
+    parser.set_defaults(func=cmd_sessions)
+
+
+def _setup_messages_parser(parser):
+    """messages 命令的参数"""
+    parser.add_argument('--talker', help='会话用户名')
+    parser.add_argument('--sender', help='发送者用户名')
+    parser.add_argument('--keyword', help='搜索关键词')
+    parser.add_argument('--time-range', help='时间范围')
+    parser.add_argument('--reverse', action='store_true', help='倒序')
+    parser.add_argument('--limit', type=int, default=50, help='返回数量')
+    parser.add_argument('--offset', type=int, default=0, help='偏移量')
+    add_output_arguments(parser)
+    add_fields_argument(parser)
+    parser.add_argument('--shards', type=int, default=1,
+                       help='--all 时按月度消息数把时间范围切成多少个分片并发拉取（默认 1，不分片）')
+    parser.add_argument('--shard-buffer', type=int, default=SHARD_BUFFER_PAGES,
+                       help=f'--shards 时每个分片最多暂存的页数（默认 {SHARD_BUFFER_PAGES}，0 表示不限）')
+    parser.set_defaults(func=cmd_messages)
+
+
+def _setup_contacts_parser(parser):
+    """contacts 命令的参数"""
+    parser.add_argument('--keyword', help='搜索关键词')
+    parser.add_argument('--limit', type=int, default=50, help='返回数量')
+    parser.add_argument('--offset', type=int, default=0, help='偏移量')
+    add_output_arguments(parser)
+    parser.set_defaults(func=cmd_contacts)
+
+
+def _setup_contact_parser(parser):
+    """contact 命令的参数"""
+    parser.add_argument('id', help='联系人用户名')
+    parser.set_defaults(func=cmd_contact)
+
+
+def _setup_need_contact_parser(parser):
+    """need-contact 命令的参数"""
+    parser.add_argument('--days', type=int, default=7, help='天数')
+    add_output_arguments(parser, paginated=False)
+    parser.set_defaults(func=cmd_need_contact)
+
+
+def _setup_chatrooms_parser(parser):
+    """chatrooms 命令的参数"""
+    parser.add_argument('--keyword', help='搜索关键词')
+    parser.add_argument('--limit', type=int, default=50, help='返回数量')
+    parser.add_argument('--offset', type=int, default=0, help='偏移量')
+    add_output_arguments(parser)
+    parser.set_defaults(func=cmd_chatrooms)
+
+
+def _setup_chatroom_parser(parser):
+    """chatroom 命令的参数"""
+    parser.add_argument('id', help='群聊 ID')
+    parser.add_argument('--member-names', action='store_true',
+                       help='附带成员 ID 到显示名称（备注 > 昵称 > ID）的映射 MemberNames')
+    parser.set_defaults(func=cmd_chatroom)
+
+
+def _setup_search_parser(parser):
+    """search 命令的参数"""
+    parser.add_argument('--keyword', required=True, help='搜索关键词')
+    parser.add_argument('--talker', help='会话用户名')
+    parser.add_argument('--sender', help='发送者用户名')
+    parser.add_argument('--type', type=int, help='消息类型')
+    parser.add_argument('--time-range', help='时间范围')
+    parser.add_argument('--limit', type=int, default=50, help='返回数量')
+    parser.add_argument('--offset', type=int, default=0, help='偏移量')
+    add_output_arguments(parser)
+    add_fields_argument(parser)
+    parser.add_argument('--local', action='store_true', help='使用本地全文索引搜索（先运行 index 命令）')
+    parser.add_argument('--index', metavar='PATH', help='本地索引路径（默认 ~/.wetrace/search-index.sqlite3）')
+    parser.set_defaults(func=cmd_search)
+
+
+def _setup_search_context_parser(parser):
+    """search-context 命令的参数"""
+    parser.add_argument('--talker', help='会话用户名')
+    parser.add_argument('--seq', type=int, action='append',
+                       help='消息序列号（可重复，多个时批量获取并合并重叠的窗口）')
+    parser.add_argument('--hits', metavar='FILE',
+                       help='批量获取文件中每条搜索结果的上下文（search --output ndjson 的输出，"-" 表示标准输入）')
+    parser.add_argument('--before', type=int, default=10, help='之前消息数')
+    parser.add_argument('--after', type=int, default=10, help='之后消息数')
+    parser.add_argument('--workers', type=int, default=8, help='批量获取时的并发数')
+    parser.set_defaults(func=cmd_search_context)
+
+
+def _setup_dashboard_parser(parser):
+    """dashboard 命令的参数"""
+    parser.add_argument('--local', action='store_true', help='使用本地汇总库（先运行 rollup 命令）')
+    parser.add_argument('--time-range', help='时间范围（用于 --local）')
+    parser.add_argument('--rollup-db', metavar='PATH', help='本地汇总库路径（默认 ~/.wetrace/rollup.sqlite3）')
+    parser.set_defaults(func=cmd_dashboard)
+
+
+def _setup_analysis_parser(parser):
+    """analysis 命令的参数"""
+    parser.add_argument('analysis_type',
+                       choices=['hourly', 'daily', 'weekday', 'monthly',
+                               'type', 'member', 'repeat', 'wordcloud',
+                               'wordcloud_global', 'top_contacts', 'annual',
+                               'local-all'],
+                       help='分析类型（local-all 在本地一次算出全部统计）')
+    parser.add_argument('session_id', nargs='?', help='会话 ID')
+    parser.add_argument('--year', type=int, help='年份（用于 annual）')
+    parser.add_argument('--time-range', help='时间范围（用于 local-all 和 --local 词云）')
+    parser.add_argument('--mirror', nargs='?', const=DEFAULT_MIRROR_PATH,
+                       metavar='PATH', help='local-all 从本地镜像读取消息（默认 ~/.wetrace/mirror.sqlite3）')
+    parser.add_argument('--local', action='store_true',
+                       help='在本地计算：wordcloud / wordcloud_global 使用本地词频库（先运行 terms 命令），'
+                            'hourly、daily、weekday、monthly、type、top_contacts、annual 使用本地汇总库'
+                            '（先运行 rollup 命令）；支持 --time-range，多个会话 ID 用逗号分隔，不指定时为全部会话')
+    parser.add_argument('--terms-db', metavar='PATH', help='本地词频库路径（默认 ~/.wetrace/terms.sqlite3）')
+    parser.add_argument('--rollup-db', metavar='PATH', help='本地汇总库路径（默认 ~/.wetrace/rollup.sqlite3）')
+    parser.add_argument('--limit', type=int, default=100,
+                       help='--local 时词云返回的词数、社交排行榜的人数')
+    parser.add_argument('--batch', metavar='FILE',
+                       help='批量模式：从文件读取会话 ID（每行一个，"-" 表示标准输入）')
+    parser.add_argument('--kinds', help='批量模式下的分析类型，逗号分隔（默认为 analysis_type）')
+    parser.add_argument('--workers', type=int, default=8, help='批量模式的并发数')
+    parser.set_defaults(func=cmd_analysis)
+
+
+def _setup_export_parser(parser):
+    """export 命令的参数"""
+    parser.add_argument('export_type',
+                       choices=['chat', 'forensic', 'voices', 'contacts'],
+                       help='导出类型')
+    parser.add_argument('--talker', help='会话用户名')
+    parser.add_argument('--name', help='显示名称')
+    parser.add_argument('--time-range', help='时间范围')
+    parser.add_argument('--format', default='html',
+                       choices=['html', 'txt', 'csv', 'xlsx', 'docx', 'pdf'],
+                       help='导出格式')
+    parser.add_argument('--keyword', help='搜索关键词（用于 contacts，批量模式下用于筛选会话）')
+    parser.add_argument('--all', action='store_true', help='批量导出全部会话（可配合 --keyword 筛选）')
+    parser.add_argument('--from-file', metavar='FILE',
+                       help='批量导出文件中列出的会话（每行一个，"-" 表示标准输入）')
+    parser.add_argument('--output-dir', help='批量导出的输出目录（默认 ~/wetrace-exports）')
+    parser.add_argument('--workers', type=int, default=4, help='批量导出的并发数')
+    parser.add_argument('--force', action='store_true', help='批量导出时不跳过未变化的会话')
+    parser.add_argument('--quiet', action='store_true', help='不显示下载进度')
+    parser.set_defaults(func=cmd_export)
+
+
+def _setup_sync_parser(parser):
+    """sync 命令的参数"""
+    parser.add_argument('--db', help='镜像数据库路径（默认 ~/.wetrace/mirror.sqlite3）')
+    parser.add_argument('--talker', action='append', help='只同步指定会话（可重复）')
+    parser.add_argument('--from-file', metavar='FILE',
+                       help='只同步文件中列出的会话（每行一个，"-" 表示标准输入）')
+    parser.add_argument('--keyword', help='按会话名称筛选')
+    parser.add_argument('--workers', type=int, default=4, help='并发同步的会话数')
+    parser.add_argument('--skip-contacts', action='store_true', help='不同步联系人和群聊列表')
+    parser.add_argument('--stats', action='store_true', help='只输出镜像统计')
+    parser.add_argument('--quiet', action='store_true', help='不显示每个会话的进度')
+    parser.set_defaults(func=cmd_sync)
+
+
+def _setup_index_parser(parser):
+    """index 命令的参数"""
+    parser.add_argument('--db', help='索引路径（默认 ~/.wetrace/search-index.sqlite3）')
+    parser.add_argument('--talker', action='append', help='只索引指定会话（可重复）')
+    parser.add_argument('--mirror', nargs='?', const=DEFAULT_MIRROR_PATH, metavar='PATH',
+                       help='从本地镜像读取消息（默认 ~/.wetrace/mirror.sqlite3），否则通过 API 拉取')
+    parser.add_argument('--stats', action='store_true', help='只输出索引统计')
+    parser.set_defaults(func=cmd_index)
+
+
+def _setup_terms_parser(parser):
+    """terms 命令的参数"""
+    parser.add_argument('--db', help='词频库路径（默认 ~/.wetrace/terms.sqlite3）')
+    parser.add_argument('--talker', action='append', help='只统计指定会话（可重复）')
+    parser.add_argument('--mirror', nargs='?', const=DEFAULT_MIRROR_PATH, metavar='PATH',
+                       help='从本地镜像读取消息（默认 ~/.wetrace/mirror.sqlite3），否则通过 API 拉取')
+    parser.add_argument('--stats', action='store_true', help='只输出词频库统计')
+    parser.set_defaults(func=cmd_terms)
+
+
+def _setup_rollup_parser(parser):
+    """rollup 命令的参数"""
+    parser.add_argument('--db', help='汇总库路径（默认 ~/.wetrace/rollup.sqlite3）')
+    parser.add_argument('--talker', action='append', help='只汇总指定会话（可重复）')
+    parser.add_argument('--mirror', nargs='?', const=DEFAULT_MIRROR_PATH, metavar='PATH',
+                       help='从本地镜像读取消息（默认 ~/.wetrace/mirror.sqlite3），否则通过 API 拉取')
+    parser.add_argument('--stats', action='store_true', help='只输出汇总库统计')
+    parser.add_argument('--verify', action='store_true',
+                       help='与服务端的概览、社交排行榜和年度报告核对，不一致时退出码为 1')
+    parser.add_argument('--year', type=int, help='--verify 核对的年度报告年份（默认当前年份）')
+    parser.set_defaults(func=cmd_rollup)
+
+
+def _setup_serve_parser(parser):
+    """serve 命令的参数"""
+    parser.add_argument('--socket', metavar='PATH',
+                       help='监听的 Unix socket 路径（默认 ~/.wetrace/daemon.sock；'
+                            '不支持 Unix socket 的系统上改为监听本机 TCP 端口，并把地址写入该文件）')
+    parser.add_argument('--idle-timeout', type=float, default=1800,
+                       help='空闲多少秒后自动退出（默认 1800，0 表示不退出）')
+    parser.add_argument('--memo-ttl', type=float, default=0.0,
+                       help='相同 GET 请求在多少秒内直接复用结果（默认 0，不复用）')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--detach', action='store_true', help='在后台运行，开始监听后返回')
+    group.add_argument('--stop', action='store_true', help='停止正在运行的守护进程')
+    group.add_argument('--status', action='store_true', help='查看正在运行的守护进程的状态')
+    parser.set_defaults(func=cmd_serve)
+
+
+def _setup_repl_parser(parser):
+    """repl 命令的参数"""
+    parser.add_argument('--memo-ttl', type=float, default=0.0,
+                       help='相同 GET 请求在多少秒内直接复用结果（默认 0，不复用）')
+    parser.set_defaults(func=cmd_repl)
+
+
+# 子命令：名称 -> (帮助, 添加参数的函数)
+COMMANDS = {
+    'sessions': ('获取会话列表', _setup_sessions_parser),
+    'messages': ('获取消息列表', _setup_messages_parser),
+    'contacts': ('获取联系人列表', _setup_contacts_parser),
+    'contact': ('获取单个联系人', _setup_contact_parser),
+    'need-contact': ('获取需要跟进的联系人', _setup_need_contact_parser),
+    'chatrooms': ('获取群聊列表', _setup_chatrooms_parser),
+    'chatroom': ('获取单个群聊', _setup_chatroom_parser),
+    'search': ('全文搜索', _setup_search_parser),
+    'search-context': ('获取搜索上下文', _setup_search_context_parser),
+    'dashboard': ('获取概览数据', _setup_dashboard_parser),
+    'analysis': ('数据分析', _setup_analysis_parser),
+    'export': ('数据导出', _setup_export_parser),
+    'sync': ('增量同步消息到本地镜像', _setup_sync_parser),
+    'index': ('增量更新本地全文索引', _setup_index_parser),
+    'terms': ('增量更新本地词频库', _setup_terms_parser),
+    'rollup': ('增量更新本地汇总库', _setup_rollup_parser),
+    'serve': ('启动守护进程，保持客户端连接和缓存，供 wetrace.py 转发命令', _setup_serve_parser),
+    'repl': ('交互模式：从标准输入逐行读取并执行命令', _setup_repl_parser),
+}
+
+# 需要值的全局参数（识别子命令时跳过其后的值）
+GLOBAL_VALUE_OPTIONS = ('--base-url', '--retries', '--compress', '--metrics-file')
+
+# 与客户端配置有关的全局参数（守护进程中作为转发命令的默认值）
+CLIENT_OPTIONS = ('base_url', 'retries', 'compress', 'throttle', 'cache', 'no_cache')
+
+
+def build_parser(command: Optional[str] = None):
+    """
+    构建命令行解析器
+
+    Args:
+        command: 只为该子命令添加参数（其余子命令只注册名称，用于加快启动），
+                 None 表示全部添加
+    """
     import argparse
 
     parser = argparse.ArgumentParser(
@@ -701,117 +3573,126 @@ def main():
 
     parser.add_argument('--base-url', default='http://127.0.0.1:5200/api/v1',
                        help='API 基础 URL')
+    parser.add_argument('--retries', type=int, default=3,
+                       help='GET 请求失败（连接失败、429、5xx）时的最大重试次数')
+    parser.add_argument('--compress', choices=('auto', 'on', 'off'), default='auto',
+                       help='是否与服务端协商 gzip/deflate 压缩传输（默认 auto：服务端不在本机时压缩）')
+    parser.add_argument('--throttle', action='store_true',
+                       help='按端点分类（分析、消息、导出）限流，并根据延迟和错误率自动调整并发数')
+    parser.add_argument('--profile', action='store_true',
+                       help='命令结束后按端点输出请求耗时报告（p50/p95/p99）')
+    parser.add_argument('--metrics-file', metavar='PATH',
+                       help='把每个请求的指标追加写入 JSONL 文件')
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_PATH, metavar='PATH',
+                       help=f'启用本地响应缓存（默认路径 {DEFAULT_CACHE_PATH}，'
+                            '也可通过环境变量 WETRACE_CACHE 指定）')
+    parser.add_argument('--no-cache', action='store_true', help='禁用本地响应缓存')
+    parser.add_argument('--cache-stats', action='store_true',
+                       help='命令结束后输出缓存统计（到标准错误）')
 
     subparsers = parser.add_subparsers(dest='command', help='可用命令')
-
-    # sessions 命令
-    p_sessions = subparsers.add_parser('sessions', help='获取会话列表')
-    p_sessions.add_argument('--keyword', help='搜索关键词')
-    p_sessions.add_argument('--limit', type=int, default=50, help='返回数量')
-    p_sessions.add_argument('--offset', type=int, default=0, help='偏移量')
-    p_sessions.set_defaults(func=cmd_sessions)
-
-    # messages 命令
-    p_messages = subparsers.add_parser('messages', help='获取消息列表')
-    p_messages.add_argument('--talker', help='会话用户名')
-    p_messages.add_argument('--sender', help='发送者用户名')
-    p_messages.add_argument('--keyword', help='搜索关键词')
-    p_messages.add_argument('--time-range', help='时间范围')
-    p_messages.add_argument('--reverse', action='store_true', help='倒序')
-    p_messages.add_argument('--limit', type=int, default=50, help='返回数量')
-    p_messages.add_argument('--offset', type=int, default=0, help='偏移量')
-    p_messages.set_defaults(func=cmd_messages)
-
-    # contacts 命令
-    p_contacts = subparsers.add_parser('contacts', help='获取联系人列表')
-    p_contacts.add_argument('--keyword', help='搜索关键词')
-    p_contacts.add_argument('--limit', type=int, default=50, help='返回数量')
-    p_contacts.add_argument('--offset', type=int, default=0, help='偏移量')
-    p_contacts.set_defaults(func=cmd_contacts)
-
-    # contact 命令
-    p_contact = subparsers.add_parser('contact', help='获取单个联系人')
-    p_contact.add_argument('id', help='联系人用户名')
-    p_contact.set_defaults(func=cmd_contact)
-
-    # need-contact 命令
-    p_need = subparsers.add_parser('need-contact', help='获取需要跟进的联系人')
-    p_need.add_argument('--days', type=int, default=7, help='天数')
-    p_need.set_defaults(func=cmd_need_contact)
-
-    # chatrooms 命令
-    p_chatrooms = subparsers.add_parser('chatrooms', help='获取群聊列表')
-    p_chatrooms.add_argument('--keyword', help='搜索关键词')
-    p_chatrooms.add_argument('--limit', type=int, default=50, help='返回数量')
-    p_chatrooms.add_argument('--offset', type=int, default=0, help='偏移量')
-    p_chatrooms.set_defaults(func=cmd_chatrooms)
-
-    # chatroom 命令
-    p_chatroom = subparsers.add_parser('chatroom', help='获取单个群聊')
-    p_chatroom.add_argument('id', help='群聊 ID')
-    p_chatroom.set_defaults(func=cmd_chatroom)
-
-    # search 命令
-    p_search = subparsers.add_parser('search', help='全文搜索')
-    p_search.add_argument('--keyword', required=True, help='搜索关键词')
-    p_search.add_argument('--talker', help='会话用户名')
-    p_search.add_argument('--sender', help='发送者用户名')
-    p_search.add_argument('--type', type=int, help='消息类型')
-    p_search.add_argument('--time-range', help='时间范围')
-    p_search.add_argument('--limit', type=int, default=50, help='返回数量')
-    p_search.add_argument('--offset', type=int, default=0, help='偏移量')
-    p_search.set_defaults(func=cmd_search)
-
-    # search-context 命令
-    p_context = subparsers.add_parser('search-context', help='获取搜索上下文')
-    p_context.add_argument('--talker', required=True, help='会话用户名')
-    p_context.add_argument('--seq', type=int, required=True, help='消息序列号')
-    p_context.add_argument('--before', type=int, default=10, help='之前消息数')
-    p_context.add_argument('--after', type=int, default=10, help='之后消息数')
-    p_context.set_defaults(func=cmd_search_context)
-
-    # dashboard 命令
-    p_dashboard = subparsers.add_parser('dashboard', help='获取概览数据')
-    p_dashboard.set_defaults(func=cmd_dashboard)
-
-    # analysis 命令
-    p_analysis = subparsers.add_parser('analysis', help='数据分析')
-    p_analysis.add_argument('analysis_type',
-                           choices=['hourly', 'daily', 'weekday', 'monthly',
-                                   'type', 'member', 'repeat', 'wordcloud',
-                                   'wordcloud_global', 'top_contacts', 'annual'],
-                           help='分析类型')
-    p_analysis.add_argument('session_id', nargs='?', help='会话 ID')
-    p_analysis.add_argument('--year', type=int, help='年份（用于 annual）')
-    p_analysis.set_defaults(func=cmd_analysis)
-
-    # export 命令
-    p_export = subparsers.add_parser('export', help='数据导出')
-    p_export.add_argument('export_type',
-                         choices=['chat', 'forensic', 'voices', 'contacts'],
-                         help='导出类型')
-    p_export.add_argument('--talker', help='会话用户名')
-    p_export.add_argument('--name', help='显示名称')
-    p_export.add_argument('--time-range', help='时间范围')
-    p_export.add_argument('--format', default='html',
-                         choices=['html', 'txt', 'csv', 'xlsx', 'docx', 'pdf'],
-                         help='导出格式')
-    p_export.add_argument('--keyword', help='搜索关键词（用于 contacts）')
-    p_export.set_defaults(func=cmd_export)
-
-    args = parser.parse_args()
+    for name, (help_text, setup) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help_text)
+        if command is None or name == command:
+            setup(subparser)
+    return parser
+
+
+def find_command(argv: List[str]) -> Optional[str]:
+    """在命令行参数中找出子命令名称，找不到时返回 None"""
+    previous = None
+    for arg in argv:
+        if arg == '--':
+            return None
+        if not arg.startswith('-'):
+            if arg in COMMANDS and previous not in GLOBAL_VALUE_OPTIONS:
+                return arg
+            if previous is None or not previous.startswith('-'):
+                return None
+        previous = arg
+    return None
+
+
+def parse_args(argv: Optional[List[str]] = None, namespace=None):
+    """
+    解析命令行参数
+
+    只为识别出的子命令构建完整的解析器；识别结果与解析结果不一致时，
+    改用完整的解析器重新解析。
+
+    Args:
+        argv: 命令行参数（默认 sys.argv[1:]）
+        namespace: 预先设置了部分属性的命名空间（这些属性不会被默认值覆盖）
+    """
+    import copy
+
+    if argv is None:
+        argv = sys.argv[1:]
+    command = find_command(argv)
+    if command is not None:
+        args = build_parser(command).parse_args(argv, copy.copy(namespace))
+        if args.command == command:
+            return args
+    return build_parser().parse_args(argv, copy.copy(namespace))
+
+
+def run_command(args) -> int:
+    """
+    执行解析后的命令
+
+    Returns:
+        退出码
+    """
+    if args.cache_stats and not args.command:
+        cache_path = args.cache or os.environ.get('WETRACE_CACHE') or DEFAULT_CACHE_PATH
+        with ResponseCache(cache_path) as cache:
+            print_json(cache.stats())
+        return 0
 
     if not args.command:
-        parser.print_help()
-        return
-
+        build_parser().print_help()
+        return 0
+
+    args.metrics = []
+    if args.profile:
+        from wetrace_metrics import MetricsCollector
+        args.metrics.append(MetricsCollector())
+    if args.metrics_file:
+        from wetrace_metrics import JsonlMetricsSink
+        args.metrics.append(JsonlMetricsSink(args.metrics_file))
+
+    started = time.monotonic()
     try:
         args.func(args)
+    except BrokenPipeError:
+        raise
     except Exception as e:
         print(f"错误: {e}")
-        import sys
-        sys.exit(1)
+        return 1
+    finally:
+        for sink in args.metrics:
+            sink.close()
+        if args.profile:
+            print(args.metrics[0].format_report(), file=sys.stderr)
+            print(f"命令耗时: {(time.monotonic() - started) * 1000:.1f} ms", file=sys.stderr)
+        if args.cache_stats and not args.no_cache:
+            cache_path = args.cache or os.environ.get('WETRACE_CACHE') or DEFAULT_CACHE_PATH
+            with ResponseCache(cache_path) as cache:
+                print(json.dumps(cache.stats(), ensure_ascii=False), file=sys.stderr)
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口"""
+    args = parse_args(argv)
+    try:
+        return run_command(args)
+    except BrokenPipeError:
+        # 下游（如 head）提前关闭了管道：停止输出，不打印错误
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return 1
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,941 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Wetrace API 异步客户端
+基于 asyncio.open_connection 实现的 HTTP/1.1 传输层，仅使用标准库
+"""
+
+import asyncio
+import heapq
+import os
+import ssl
+import time
+import urllib.parse
+import zlib
+from collections import deque
+from typing import Optional, List, Dict, Union, Iterable, Callable, Any
+
+from wetrace_api import (
+    ACCEPT_ENCODING,
+    ANALYSIS_KINDS,
+    DEFAULT_EXPORT_DIR,
+    DOWNLOAD_CHUNK_SIZE,
+    MAX_PAGE_SIZE,
+    CircuitBreaker,
+    CircuitOpenError,
+    ConnectionFailed,
+    HTTPError,
+    RetryPolicy,
+    SHARD_BUFFER_PAGES,
+    StreamDecoder,
+    WetraceClient,
+    WetraceError,
+    decode_content,
+    encode_body,
+    export_filename,
+    hit_key,
+    is_loopback,
+    keyset_fields,
+    parse_retry_after,
+    parse_time_range,
+    plan_context_windows,
+    plan_time_shards,
+    split_context,
+)
+
+
+class AsyncResponse:
+    """异步请求的完整响应"""
+
+    def __init__(self, status: int, reason: str, headers: Dict[str, str], body: bytes):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+class AsyncStreamResponse:
+    """
+    流式读取响应体的异步响应
+
+    响应体读完时连接归还连接池，没读完就关闭时直接关闭连接；
+    压缩的响应体在读取时流式解压。
+    """
+
+    def __init__(self, pool: 'AsyncConnectionPool',
+                 reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 method: str, status: int, reason: str, headers: Dict[str, str],
+                 keep_alive: bool):
+        self._pool = pool
+        self._reader = reader
+        self._writer = writer
+        self._keep_alive = keep_alive
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        # 网络上收到的字节数和解压后的字节数
+        self.bytes_read = 0
+        self.bytes_decoded = 0
+        # 关闭时的回调，参数为响应本身
+        self.on_close = None
+
+        # 剩余的响应体字节数：None 表示分块传输或读到连接关闭为止
+        self._chunked = False
+        self._chunk_left = 0
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            self._remaining = 0
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            self._remaining = None
+            self._chunked = True
+        elif 'content-length' in headers:
+            self._remaining = int(headers['content-length'])
+        else:
+            self._remaining = None
+            self._keep_alive = False
+        encoding = headers.get('content-encoding', '').strip().lower()
+        self._decoder = StreamDecoder(encoding) if encoding in StreamDecoder.ENCODINGS else None
+        if self._remaining == 0:
+            self._release()
+
+    def _release(self):
+        """响应体已读完，归还或关闭连接"""
+        writer, self._writer = self._writer, None
+        if writer is None:
+            return
+        if self._keep_alive:
+            self._pool._put_conn(self._reader, writer)
+        else:
+            writer.close()
+
+    async def _read_raw(self, amt: int) -> bytes:
+        if self._writer is None:
+            return b''
+        reader = self._reader
+        if self._chunked:
+            if not self._chunk_left:
+                size_line = await reader.readline()
+                size = int(size_line.split(b';', 1)[0].strip(), 16)
+                if size == 0:
+                    # 跳过 trailer
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    self._release()
+                    return b''
+                self._chunk_left = size
+            data = await reader.read(min(amt, self._chunk_left))
+            if not data:
+                raise asyncio.IncompleteReadError(b'', self._chunk_left)
+            self._chunk_left -= len(data)
+            if not self._chunk_left:
+                await reader.readexactly(2)
+        elif self._remaining is None:
+            data = await reader.read(amt)
+            if not data:
+                self._release()
+                return b''
+        else:
+            data = await reader.read(min(amt, self._remaining))
+            if not data:
+                raise asyncio.IncompleteReadError(b'', self._remaining)
+            self._remaining -= len(data)
+            if not self._remaining:
+                self._release()
+        self.bytes_read += len(data)
+        return data
+
+    async def read(self, amt: Optional[int] = None) -> bytes:
+        """读取（解压后的）响应体，amt 为最多返回的字节数，None 表示读完全部；读完时返回 b''"""
+        if amt is None:
+            chunks = []
+            while True:
+                chunk = await self.read(DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+        if self._pool.timeout is None:
+            data = await self._read(amt)
+        else:
+            data = await asyncio.wait_for(self._read(amt), self._pool.timeout)
+        self.bytes_decoded += len(data)
+        return data
+
+    async def _read(self, amt: int) -> bytes:
+        if self._decoder is None:
+            return await self._read_raw(amt)
+        try:
+            while True:
+                chunk = b'' if self._decoder.has_pending else await self._read_raw(DOWNLOAD_CHUNK_SIZE)
+                if not chunk and not self._decoder.has_pending:
+                    data = self._decoder.flush()
+                    if not self._decoder.eof and self.bytes_read:
+                        raise WetraceError("响应解压失败: 压缩数据不完整")
+                    return data
+                data = self._decoder.decompress(chunk, amt)
+                if data:
+                    return data
+        except zlib.error as e:
+            raise WetraceError(f"响应解压失败: {e}")
+
+    def close(self):
+        """关闭响应；响应体没读完时关闭连接"""
+        if self.on_close is not None:
+            on_close, self.on_close = self.on_close, None
+            on_close(self)
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncConnectionPool:
+    """
+    基于 asyncio 的 HTTP/1.1 keep-alive 连接池
+
+    与 ConnectionPool 的行为一致：空闲连接后进先出复用，超过 idle_timeout
+    的空闲连接会被丢弃，复用的连接如果已被服务端关闭则换一条新连接重试。
+    只能在创建它的事件循环中使用。
+    """
+
+    def __init__(self, base_url: str, maxsize: int = 10,
+                 idle_timeout: float = 30.0,
+                 timeout: Optional[float] = None,
+                 stale_retries: int = 1):
+        """
+        初始化连接池
+
+        Args:
+            base_url: API 基础 URL（只使用其中的协议、主机和端口）
+            maxsize: 最多保留的空闲连接数
+            idle_timeout: 空闲连接的最长保留时间（秒）
+            timeout: 单个请求的超时时间（秒），None 表示不超时
+            stale_retries: 复用连接失效时的最大重试次数
+        """
+        parsed = urllib.parse.urlsplit(base_url)
+        self.scheme = parsed.scheme or 'http'
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port or (443 if self.scheme == 'https' else 80)
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.stale_retries = stale_retries
+        self._idle = deque()
+        self._closed = False
+
+    @property
+    def _host_header(self) -> str:
+        default_port = 443 if self.scheme == 'https' else 80
+        if self.port == default_port:
+            return self.host
+        return f"{self.host}:{self.port}"
+
+    async def _get_conn(self):
+        """取出一条空闲连接，没有可用的空闲连接时新建一条"""
+        now = time.monotonic()
+        while self._idle:
+            reader, writer, last_used = self._idle.pop()
+            if now - last_used <= self.idle_timeout and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+        context = ssl.create_default_context() if self.scheme == 'https' else None
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=context)
+        return reader, writer, False
+
+    def _put_conn(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """归还连接，连接池已满或已关闭时直接关闭连接"""
+        if not self._closed and len(self._idle) < self.maxsize and not writer.is_closing():
+            self._idle.append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+
+    async def request(self, method: str, url: str,
+                      headers: Optional[Dict[str, str]] = None,
+                      body: Optional[bytes] = None) -> AsyncResponse:
+        """
+        发送请求并读取完整响应
+
+        Args:
+            method: HTTP 方法
+            url: 请求路径（含查询参数）
+            headers: 请求头
+            body: 请求体
+
+        Returns:
+            响应对象
+        """
+        if self.timeout is None:
+            return await self._request(method, url, headers, body)
+        return await asyncio.wait_for(self._request(method, url, headers, body), self.timeout)
+
+    async def open(self, method: str, url: str,
+                   headers: Optional[Dict[str, str]] = None,
+                   body: Optional[bytes] = None) -> AsyncStreamResponse:
+        """
+        发送请求并只读取响应头，响应体由调用方流式读取
+
+        Args:
+            method: HTTP 方法
+            url: 请求路径（含查询参数）
+            headers: 请求头
+            body: 请求体
+
+        Returns:
+            响应对象，使用完毕后必须关闭
+        """
+        if self.timeout is None:
+            return await self._request(method, url, headers, body, stream=True)
+        return await asyncio.wait_for(self._request(method, url, headers, body, stream=True),
+                                      self.timeout)
+
+    async def _request(self, method, url, headers, body, stream: bool = False):
+        attempt = 0
+        while True:
+            reader, writer, reused = await self._get_conn()
+            try:
+                writer.write(self._encode_request(method, url, headers, body))
+                await writer.drain()
+                if stream:
+                    status, reason, response_headers, keep_alive = await self._read_head(reader)
+                    return AsyncStreamResponse(self, reader, writer, method, status, reason,
+                                               response_headers, keep_alive)
+                response, keep_alive = await self._read_response(reader, method)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused and attempt < self.stale_retries:
+                    attempt += 1
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self._put_conn(reader, writer)
+            else:
+                writer.close()
+            return response
+
+    def _encode_request(self, method, url, headers, body) -> bytes:
+        lines = [f"{method} {url} HTTP/1.1", f"Host: {self._host_header}"]
+        all_headers = {'Accept-Encoding': 'identity'}
+        all_headers.update(headers or {})
+        if body is not None or method in ('POST', 'PUT', 'PATCH'):
+            all_headers['Content-Length'] = str(len(body or b''))
+        lines.extend(f"{name}: {value}" for name, value in all_headers.items())
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        return head + (body or b'')
+
+    @staticmethod
+    async def _read_head(reader: asyncio.StreamReader) -> tuple:
+        """读取状态行和响应头，返回 (状态码, 原因短语, 响应头, 连接是否可复用)"""
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("服务端关闭了连接")
+        version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        status = int(status)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+        return status, reason, headers, keep_alive
+
+    async def _read_response(self, reader: asyncio.StreamReader, method: str):
+        """读取一个响应，返回 (响应, 连接是否可复用)"""
+        status, reason, headers, keep_alive = await self._read_head(reader)
+
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            body = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await self._read_chunked(reader)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+
+        return AsyncResponse(status, reason, headers, body), keep_alive
+
+    @staticmethod
+    async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+        chunks = []
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                # 跳过 trailer
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    def close(self):
+        """关闭所有空闲连接"""
+        self._closed = True
+        idle, self._idle = self._idle, deque()
+        for _, writer, _ in idle:
+            writer.close()
+
+
+class AsyncWetraceClient(WetraceClient):
+    """
+    Wetrace API 异步客户端
+
+    方法与 WetraceClient 一致，但所有请求方法都需要 await，
+    iter_* 分页方法返回异步迭代器（使用 async for 遍历）。
+    WetraceClient 中不经过 _request 的方法（下载、批量导出、分片遍历等）都有各自的异步版本，
+    新增这类方法时需要同时在这里实现，wetrace_bench.py 的 async_surface 场景会逐个检查。
+    同时在途的请求数由信号量限制，失败重试和熔断与 WetraceClient 相同。
+    """
+
+    def __init__(self, base_url: str = "http://127.0.0.1:5200/api/v1",
+                 pool: Optional[AsyncConnectionPool] = None,
+                 pool_size: int = 10,
+                 idle_timeout: float = 30.0,
+                 timeout: Optional[float] = None,
+                 stale_retries: int = 1,
+                 max_concurrency: int = 100,
+                 retry: Optional[RetryPolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None,
+                 metrics=None,
+                 decoder: Optional[Callable[[bytes], Any]] = None,
+                 compress: Optional[bool] = None):
+        """
+        初始化客户端
+
+        Args:
+            base_url: API 基础 URL
+            pool: 共享的连接池（默认为本客户端新建一个）
+            pool_size: 最多保留的空闲连接数
+            idle_timeout: 空闲连接的最长保留时间（秒）
+            timeout: 单个请求的超时时间（秒）
+            stale_retries: 复用连接失效时的最大重试次数
+            max_concurrency: 最大在途请求数
+            retry: 失败重试策略（默认 RetryPolicy()，传入 RetryPolicy(max_retries=0) 关闭重试）
+            breaker: 熔断器（默认 CircuitBreaker()，可以与同步客户端共用）
+            metrics: 请求指标接收器或接收器列表（只记录状态码、字节数和总耗时）
+            decoder: 解析 JSON 响应体的函数，参数为 bytes（默认 json_loads）
+            compress: 是否与服务端协商 gzip/deflate 压缩传输，并压缩较大的请求体
+                      （默认只在服务端不在本机时压缩）
+        """
+        self.base_url = base_url.rstrip('/')
+        self._base_path = urllib.parse.urlsplit(self.base_url).path
+        if compress is None:
+            compress = not is_loopback(urllib.parse.urlsplit(self.base_url).hostname)
+        self.compress = compress
+        self.compress_uploads = compress
+        if pool is None:
+            pool = AsyncConnectionPool(self.base_url, maxsize=pool_size,
+                                       idle_timeout=idle_timeout, timeout=timeout,
+                                       stale_retries=stale_retries)
+        self.pool = pool
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        if metrics is None:
+            metrics = ()
+        elif not isinstance(metrics, (list, tuple)):
+            metrics = (metrics,)
+        self.metrics = tuple(metrics)
+        if decoder is not None:
+            self.json_loads = decoder
+
+    async def close(self):
+        """关闭客户端持有的连接"""
+        self.pool.close()
+
+    def __enter__(self):
+        raise TypeError("AsyncWetraceClient 需要使用 async with")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _request(self, method: str, endpoint: str,
+                       params: Optional[Dict] = None,
+                       fields: Optional[Iterable[str]] = None,
+                       data: Any = None) -> Union[Dict, List, bytes]:
+        """
+        发送 HTTP 请求
+
+        Args:
+            method: HTTP 方法
+            endpoint: API 端点
+            params: 查询参数
+            fields: 只保留记录中的这些字段
+            data: 请求体数据（编码为 JSON，较大时 gzip 压缩）
+
+        Returns:
+            响应数据
+        """
+        url = self._build_url(endpoint, params)
+        headers = {'Accept-Encoding': ACCEPT_ENCODING} if self.compress else {}
+        if data is None:
+            response = await self._send(method, url, headers)
+        else:
+            while True:
+                body, body_headers, size = encode_body(data, self.compress_uploads)
+                try:
+                    response = await self._send(method, url, {**headers, **body_headers}, body, size)
+                except HTTPError as e:
+                    if e.status == 415 and 'Content-Encoding' in body_headers:
+                        self.compress_uploads = False
+                        continue
+                    raise
+                break
+        return self._decode_body(response.headers.get('content-type', ''), response.body, fields)
+
+    async def _send(self, method: str, url: str, headers: Dict[str, str],
+                    body: Optional[bytes] = None,
+                    upload_size: Optional[int] = None,
+                    passthrough: tuple = (),
+                    stream: bool = False) -> Union[AsyncResponse, AsyncStreamResponse]:
+        """
+        发送请求：经过熔断器检查，按重试策略重试（用 asyncio.sleep 退避），
+        解压响应体，错误状态码转换为异常
+
+        Args:
+            method: HTTP 方法
+            url: 请求路径（含查询参数）
+            headers: 请求头
+            body: 请求体
+            upload_size: 压缩前的请求体字节数（记录到指标中）
+            passthrough: 不转换为异常、直接返回的错误状态码
+            stream: 只读取响应头，返回 AsyncStreamResponse 由调用方流式读取并关闭
+
+        Returns:
+            响应对象（状态码小于 400 或在 passthrough 中）
+        """
+        attempt = 0
+        error = None
+        while True:
+            try:
+                self.breaker.before_request()
+            except CircuitOpenError:
+                if error is None:
+                    raise
+                # 重试过程中熔断器打开时，报告最后一次真实的错误
+                raise error
+            try:
+                response = await self._send_once(method, url, headers, body, upload_size,
+                                                  passthrough, stream, attempt)
+            except ConnectionFailed as e:
+                self.breaker.record_failure()
+                error = e
+            except HTTPError as e:
+                if e.status >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                error = e
+            except WetraceError:
+                # 响应解压失败等，服务端本身是可用的
+                self.breaker.record_success()
+                raise
+            else:
+                self.breaker.record_success()
+                return response
+
+            if not self.retry.should_retry(method, error, attempt):
+                raise error
+            retry_after = error.retry_after if isinstance(error, HTTPError) else None
+            await asyncio.sleep(self.retry.delay(attempt, retry_after))
+            attempt += 1
+
+    async def _send_once(self, method: str, url: str, headers: Dict[str, str],
+                         body: Optional[bytes], upload_size: Optional[int],
+                         passthrough: tuple, stream: bool,
+                         attempt: int) -> Union[AsyncResponse, AsyncStreamResponse]:
+        """发送一次请求（参数同 _send，attempt 为重试次数，记录到指标中）"""
+        path = urllib.parse.urlsplit(url).path[len(self._base_path):]
+        upload = (len(body or b''), len(body or b'') if upload_size is None else upload_size)
+
+        async with self._semaphore:
+            started = time.monotonic()
+            try:
+                if stream:
+                    response = await self.pool.open(method, url, headers=headers, body=body)
+                else:
+                    response = await self.pool.request(method, url, headers=headers, body=body)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                if self.metrics:
+                    self._emit_metrics(method, path, None, 0, total=time.monotonic() - started,
+                                       attempt=attempt, upload=upload)
+                raise ConnectionFailed(f"连接失败: {e}")
+        if stream:
+            if self.metrics:
+                response.on_close = lambda r: self._emit_metrics(
+                    method, path, r.status, r.bytes_read, total=time.monotonic() - started,
+                    attempt=attempt, decoded=r.bytes_decoded, upload=upload)
+            if response.status >= 400 and response.status not in passthrough:
+                with response:
+                    error_body = await response.read()
+                self._raise_for_status(response.status, error_body,
+                                       parse_retry_after(response.headers.get('retry-after')))
+            return response
+        size = len(response.body)
+        response.body = decode_content(response.headers.get('content-encoding'), response.body)
+        if self.metrics:
+            self._emit_metrics(method, path, response.status, size,
+                               total=time.monotonic() - started, attempt=attempt,
+                               decoded=len(response.body), upload=upload)
+
+        if response.status >= 400 and response.status not in passthrough:
+            self._raise_for_status(response.status, response.body,
+                                   parse_retry_after(response.headers.get('retry-after')))
+        return response
+
+    async def _download(self, endpoint: str, params: Optional[Dict], dest,
+                        progress=None, resume: bool = True) -> int:
+        """
+        将文件类响应分块写入磁盘或可写对象，参见 WetraceClient._download
+
+        Returns:
+            文件总字节数
+        """
+        url = self._build_url(endpoint, params)
+
+        if hasattr(dest, 'write'):
+            with await self._open_download(url, {}) as response:
+                return await self._copy_response(response, dest, 0,
+                                                 self._content_length(response), progress)
+
+        dest = os.fspath(dest)
+        part_path = f"{dest}.part"
+        offset = os.path.getsize(part_path) if resume and os.path.exists(part_path) else 0
+        headers = {'Range': f"bytes={offset}-"} if offset else {}
+
+        response = await self._open_download(url, headers)
+        if response.status == 416:
+            # 已下载的部分与服务端文件不一致，从头下载
+            response.close()
+            offset = 0
+            response = await self._open_download(url, {})
+
+        with response:
+            total = self._content_length(response)
+            if response.status == 206:
+                content_range = response.headers.get('content-range', '')
+                if content_range.startswith(f"bytes {offset}-"):
+                    size = content_range.rpartition('/')[2]
+                    total = int(size) if size.isdigit() else None
+                else:
+                    raise WetraceError(f"无法断点续传: Content-Range {content_range!r}")
+            else:
+                offset = 0
+
+            dest_dir = os.path.dirname(os.path.abspath(dest))
+            os.makedirs(dest_dir, exist_ok=True)
+            with open(part_path, 'ab' if offset else 'wb') as f:
+                size = await self._copy_response(response, f, offset, total, progress)
+
+        os.replace(part_path, dest)
+        return size
+
+    async def _open_download(self, url: str, headers: Dict[str, str]) -> AsyncStreamResponse:
+        """发送下载请求，错误响应转换为异常"""
+        return await self._send('GET', url, headers, passthrough=(416,), stream=True)
+
+    @staticmethod
+    def _content_length(response: AsyncStreamResponse) -> Optional[int]:
+        length = response.headers.get('content-length')
+        return int(length) if length and length.isdigit() else None
+
+    @staticmethod
+    async def _copy_response(response: AsyncStreamResponse, f, offset: int,
+                             total: Optional[int], progress=None) -> int:
+        """把响应体分块写入文件对象，返回写入后的总字节数"""
+        done = offset
+        if progress:
+            progress(done, total)
+        while True:
+            chunk = await response.read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            f.write(chunk)
+            done += len(chunk)
+            if progress:
+                progress(done, total)
+        return done
+
+    async def _paginate(self, fetch, page_size: int):
+        """
+        按 limit/offset 逐页拉取并逐条产出记录
+
+        Args:
+            fetch: 接收 limit 和 offset 关键字参数、返回一页数据的协程函数
+            page_size: 每页数量（不超过 MAX_PAGE_SIZE）
+
+        Yields:
+            单条记录
+        """
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        offset = 0
+        while True:
+            page = await fetch(limit=page_size, offset=offset)
+            if isinstance(page, dict):
+                items = page.get('Items') or []
+                has_more = page.get('HasMore', True)
+            else:
+                items = page or []
+                has_more = True
+            for item in items:
+                yield item
+            if len(items) < page_size or not has_more:
+                return
+            offset += len(items)
+
+    async def iter_messages_keyset(self, talker_id: str,
+                                   time_range: Optional[str] = None,
+                                   page_size: int = MAX_PAGE_SIZE,
+                                   after_seq: Optional[int] = None,
+                                   fields: Optional[Iterable[str]] = None):
+        """
+        按 Seq 游标逐条遍历某个会话的消息（升序），参见 WetraceClient.iter_messages_keyset
+
+        Args:
+            talker_id: 会话用户名
+            time_range: 时间范围
+            page_size: 每页数量
+            after_seq: 从该 Seq 之后继续遍历（不含该条消息）
+            fields: 只保留消息中的这些字段
+
+        Yields:
+            消息
+        """
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        start, end = parse_time_range(time_range)
+        last_seq = after_seq
+        fetch_fields, trim = keyset_fields(fields)
+
+        if last_seq is None:
+            page = await self.get_messages(talker_id=talker_id, time_range=time_range,
+                                           limit=page_size, offset=0, fields=fetch_fields)
+            for msg in page:
+                yield trim(msg) if trim else msg
+                last_seq = msg['Seq']
+            if len(page) < page_size:
+                return
+
+        while True:
+            context = await self.get_search_context(talker_id, last_seq, before=0, after=page_size,
+                                                    fields=fetch_fields)
+            messages = context.get('messages') or []
+            anchor = context.get('anchor_index', 0)
+            page = [msg for msg in messages[anchor + 1:] if msg['Seq'] > last_seq]
+            for msg in page:
+                create_time = msg.get('CreateTime', 0)
+                if end is not None and create_time > end:
+                    return
+                if start is not None and create_time < start:
+                    continue
+                yield trim(msg) if trim else msg
+            # /search/context 的 after 没有文档化的上限，服务端可能截断，
+            # 所以只有空页才表示遍历结束
+            if not page:
+                return
+            last_seq = page[-1]['Seq']
+
+    async def iter_messages_sharded(self, talker_id: str,
+                                    time_range: Optional[str] = None,
+                                    shards: int = 4,
+                                    page_size: int = MAX_PAGE_SIZE,
+                                    fields: Optional[Iterable[str]] = None,
+                                    max_buffered: int = SHARD_BUFFER_PAGES):
+        """
+        按时间范围分片并发遍历某个会话的消息（Seq 升序），参见 WetraceClient.iter_messages_sharded
+
+        每个分片是一个任务，按页放入各自的队列（最多暂存 max_buffered 页，0 表示不限），
+        再按 Seq 归并产出。
+
+        Yields:
+            消息
+        """
+        start, end = parse_time_range(time_range)
+        ranges = plan_time_shards(await self.get_monthly_analysis(talker_id), shards, start, end)
+        if len(ranges) <= 1:
+            async for msg in self.iter_messages_keyset(talker_id, time_range=time_range,
+                                                       page_size=page_size, fields=fields):
+                yield msg
+            return
+
+        fetch_fields, trim = keyset_fields(fields)
+        queues = [asyncio.Queue(maxsize=max_buffered) for _ in ranges]
+
+        async def produce(shard_range: str, queue: asyncio.Queue):
+            try:
+                page = []
+                async for msg in self.iter_messages_keyset(talker_id, time_range=shard_range,
+                                                           page_size=page_size, fields=fetch_fields):
+                    create_time = msg.get('CreateTime', 0)
+                    if (start is not None and create_time < start) or (end is not None and create_time > end):
+                        continue
+                    page.append(msg)
+                    if len(page) >= page_size:
+                        await queue.put(page)
+                        page = []
+                if page:
+                    await queue.put(page)
+                await queue.put(None)
+            except Exception as e:
+                await queue.put(e)
+
+        async def drain(queue: asyncio.Queue):
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                for msg in item:
+                    yield msg
+
+        tasks = [asyncio.ensure_future(produce(shard_range, queue))
+                 for shard_range, queue in zip(ranges, queues)]
+        streams = [drain(queue) for queue in queues]
+        heap = []
+
+        async def pull(index: int):
+            try:
+                msg = await streams[index].__anext__()
+            except StopAsyncIteration:
+                return
+            heapq.heappush(heap, (msg['Seq'], index, msg))
+
+        try:
+            for index in range(len(streams)):
+                await pull(index)
+            while heap:
+                _, index, msg = heapq.heappop(heap)
+                yield trim(msg) if trim else msg
+                await pull(index)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def analyze_many(self, session_ids: List[str],
+                           kinds: Optional[List[str]] = None,
+                           max_workers: int = 8) -> tuple:
+        """
+        并发获取多个会话的多种分析数据
+
+        Args:
+            session_ids: 会话 ID 列表
+            kinds: 分析类型列表（ANALYSIS_KINDS 的键，默认全部）
+            max_workers: 本次批量调用的最大并发数
+
+        Returns:
+            (results, errors) 元组，两者都以 (session_id, kind) 为键
+        """
+        kinds = list(kinds or ANALYSIS_KINDS)
+        unknown = [kind for kind in kinds if kind not in ANALYSIS_KINDS]
+        if unknown:
+            raise ValueError(f"未知的分析类型: {', '.join(unknown)}")
+
+        tasks = [(session_id, kind) for session_id in dict.fromkeys(session_ids)
+                 for kind in kinds]
+        limit = asyncio.Semaphore(max(1, max_workers))
+
+        async def run(task):
+            session_id, kind = task
+            async with limit:
+                return await getattr(self, ANALYSIS_KINDS[kind])(session_id)
+
+        outcomes = await asyncio.gather(*(run(task) for task in tasks), return_exceptions=True)
+        results = {}
+        errors = {}
+        for task, outcome in zip(tasks, outcomes):
+            if isinstance(outcome, Exception):
+                errors[task] = str(outcome)
+            else:
+                results[task] = outcome
+        return results, errors
+
+    async def get_contexts_bulk(self, hits: Iterable, before: int = 10, after: int = 10,
+                                fields: Optional[Iterable[str]] = None,
+                                max_workers: int = 8,
+                                max_window: int = MAX_PAGE_SIZE) -> List[Dict]:
+        """
+        批量获取搜索结果的上下文，合并重叠或相邻的窗口（参数同 WetraceClient.get_contexts_bulk）
+
+        Returns:
+            与 hits 一一对应的上下文
+        """
+        hits = list(hits)
+        fetch_fields, trim = keyset_fields(fields)
+        limit = asyncio.Semaphore(max(1, max_workers))
+
+        async def run(window):
+            talker, anchor, window_before, window_after, seqs = window
+            async with limit:
+                merged = await self.get_search_context(talker, anchor, before=window_before,
+                                                       after=window_after, fields=fetch_fields)
+                contexts = split_context(merged.get('messages') or [], seqs, before, after)
+                for seq, context in contexts.items():
+                    if context is None:
+                        contexts[seq] = await self.get_search_context(talker, seq, before=before,
+                                                                      after=after, fields=fetch_fields)
+            return talker, contexts
+
+        outcomes = await asyncio.gather(
+            *(run(window) for window in plan_context_windows(hits, before, after, max_window)))
+        contexts = {}
+        for talker, by_seq in outcomes:
+            for seq, context in by_seq.items():
+                if trim:
+                    context = dict(context, messages=[trim(msg) for msg in context.get('messages') or []])
+                contexts[(talker, seq)] = context
+        return [contexts[hit_key(hit)] for hit in hits]
+
+    async def export_many(self, sessions: List[Union[str, Dict]],
+                          export_type: str = 'chat',
+                          output_dir: str = DEFAULT_EXPORT_DIR,
+                          format: str = 'html',
+                          time_range: Optional[str] = None,
+                          max_workers: int = 4,
+                          manifest_path: Optional[str] = None,
+                          skip_unchanged: bool = True,
+                          on_done=None) -> Dict:
+        """
+        并发批量导出多个会话，并写入 JSON 清单（参数同 WetraceClient.export_many）
+
+        Returns:
+            清单字典
+        """
+        manifest_path, previous, targets = self._prepare_export_many(
+            sessions, export_type, output_dir, manifest_path)
+        limit = asyncio.Semaphore(max(1, max_workers))
+        entries = {}
+
+        async def run(talker, session):
+            filepath = os.path.join(output_dir, export_filename(export_type, talker, format))
+            entry = self._skipped_export(previous.get(talker), session, filepath,
+                                         time_range, skip_unchanged)
+            if entry is None:
+                async with limit:
+                    started = time.monotonic()
+                    try:
+                        await self._export_session(export_type, talker, session, filepath,
+                                                   format, time_range)
+                    except Exception as e:
+                        entry = self._export_entry(session, filepath, time_range, started, e)
+                    else:
+                        entry = self._export_entry(session, filepath, time_range, started)
+            entries[talker] = entry
+            if on_done:
+                on_done(talker, entry)
+
+        await asyncio.gather(*(run(talker, session) for talker, session in targets.items()))
+        return self._write_export_manifest(manifest_path, export_type, format, targets, entries)
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Wetrace 客户端性能基准
+默认启动本地模拟服务（wetrace_mock_server.py），依次运行分页遍历、并发分析、
+批量导出和搜索等场景，输出吞吐量、请求延迟分位数和峰值内存，
+并可以保存基准结果、与之前的结果比较以发现性能退化
+"""
+
+import asyncio
+import inspect
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional, List, Dict, Any
+
+from wetrace_api import ANALYSIS_KINDS, HTTPError, WetraceClient
+from wetrace_metrics import MetricsCollector
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 搜索场景使用的关键词（取自模拟服务的词表）
+SEARCH_KEYWORDS = ('项目', '会议', '客户', '周报', '上线', '合同', '火锅', '生日', '部署', 'bug',
+                   '复盘', '加班', '快递', '面试', '装修', '天气', '孩子', '咖啡', '出差', '预算')
+
+
+def top_sessions(client: WetraceClient, count: int) -> List[str]:
+    """按消息数从多到少取前 count 个会话"""
+    sessions = list(client.iter_sessions())
+    sessions.sort(key=lambda session: -(session.get('MessageCount') or 0))
+    return [session['UserName'] for session in sessions[:count]]
+
+
+# ==================== 场景 ====================
+# 每个场景接收 (client, sessions, options)，返回处理的记录数
+
+def scenario_list_walk(client, sessions, options) -> int:
+    """分页遍历全部会话、联系人和群聊"""
+    items = 0
+    for iterator in (client.iter_sessions(page_size=100),
+                     client.iter_contacts(page_size=100),
+                     client.iter_chatrooms(page_size=100)):
+        for _ in iterator:
+            items += 1
+    return items
+
+
+def scenario_messages_offset(client, sessions, options) -> int:
+    """按 limit/offset 遍历最大几个会话的全部消息"""
+    items = 0
+    for talker in sessions[:options['walk_sessions']]:
+        for _ in client.iter_messages(talker, page_size=options['page_size']):
+            items += 1
+    return items
+
+
+def scenario_messages_keyset(client, sessions, options) -> int:
+    """按 Seq 游标遍历最大几个会话的全部消息"""
+    items = 0
+    for talker in sessions[:options['walk_sessions']]:
+        for _ in client.iter_messages_keyset(talker, page_size=options['page_size']):
+            items += 1
+    return items
+
+
+def scenario_analysis_fanout(client, sessions, options) -> int:
+    """线程池并发获取多个会话的全部分析"""
+    results, errors = client.analyze_many(sessions[:options['fanout_sessions']],
+                                          list(ANALYSIS_KINDS), max_workers=options['workers'])
+    if errors:
+        raise RuntimeError(f"{len(errors)} 个分析请求失败")
+    return len(results)
+
+
+def scenario_analysis_fanout_async(client, sessions, options) -> int:
+    """asyncio 客户端并发获取多个会话的全部分析"""
+    from wetrace_async import AsyncWetraceClient
+
+    async def run():
+        async with AsyncWetraceClient(client.base_url, metrics=client.metrics,
+                                      compress=client.compress) as async_client:
+            return await async_client.analyze_many(sessions[:options['fanout_sessions']],
+                                                   list(ANALYSIS_KINDS),
+                                                   max_workers=options['workers'])
+
+    results, errors = asyncio.run(run())
+    if errors:
+        raise RuntimeError(f"{len(errors)} 个分析请求失败")
+    return len(results)
+
+
+def scenario_export(client, sessions, options) -> int:
+    """并发导出多个会话的文本记录到临时目录"""
+    with tempfile.TemporaryDirectory(prefix='wetrace-bench-') as output_dir:
+        manifest = client.export_many(sessions[:options['export_sessions']], 'chat', output_dir,
+                                      format='txt', max_workers=options['workers'],
+                                      skip_unchanged=False)
+    failed = [talker for talker, entry in manifest['sessions'].items() if entry['status'] == 'failed']
+    if failed:
+        raise RuntimeError(f"{len(failed)} 个会话导出失败")
+    return len(manifest['sessions'])
+
+
+def scenario_search(client, sessions, options) -> int:
+    """依次搜索一组关键词，每个关键词取第一页"""
+    items = 0
+    for keyword in SEARCH_KEYWORDS[:options['search_keywords']]:
+        items += len(client.search(keyword, limit=50)['Items'])
+    return items
+
+
+def async_surface_calls(talker: str, seq: int, chatroom: str, output_dir: str) -> Dict[str, tuple]:
+    """async_surface 场景中每个公开方法的调用参数 {方法名: (args, kwargs)}"""
+    return {
+        'get_sessions': ((), {'limit': 5}),
+        'iter_sessions': ((), {'page_size': 5}),
+        'delete_session': (('wxid_bench_missing',), {}),
+        'get_messages': ((), {'talker_id': talker, 'limit': 5}),
+        'iter_messages': ((talker,), {'page_size': 5}),
+        'iter_messages_keyset': ((talker,), {'page_size': 5}),
+        'iter_messages_sharded': ((talker,), {'shards': 2, 'page_size': 50}),
+        'get_contacts': ((), {'limit': 5}),
+        'iter_contacts': ((), {'page_size': 5}),
+        'get_contact': ((talker,), {}),
+        'get_need_contact': ((), {}),
+        'export_contacts': ((), {'dest': os.path.join(output_dir, 'contacts.csv')}),
+        'get_chatrooms': ((), {'limit': 5}),
+        'iter_chatrooms': ((), {'page_size': 5}),
+        'get_chatroom': ((chatroom,), {}),
+        'search': ((SEARCH_KEYWORDS[0],), {'limit': 5}),
+        'iter_search': ((SEARCH_KEYWORDS[0],), {'page_size': 5}),
+        'get_search_context': ((talker, seq), {'before': 2, 'after': 2}),
+        'get_contexts_bulk': (([(talker, seq)],), {'before': 2, 'after': 2}),
+        'get_dashboard': ((), {}),
+        'get_hourly_analysis': ((talker,), {}),
+        'get_daily_analysis': ((talker,), {}),
+        'get_weekday_analysis': ((talker,), {}),
+        'get_monthly_analysis': ((talker,), {}),
+        'get_type_distribution': ((talker,), {}),
+        'get_member_activity': ((talker,), {}),
+        'get_repeat_analysis': ((talker,), {}),
+        'get_top_contacts': ((), {}),
+        'get_annual_report': ((), {}),
+        'get_global_wordcloud': ((), {}),
+        'get_wordcloud': ((talker,), {}),
+        'analyze_many': (([talker],), {'kinds': ['hourly']}),
+        'export_chat': ((talker,), {'format': 'txt', 'dest': os.path.join(output_dir, 'chat.txt')}),
+        'export_forensic': ((talker,), {'dest': os.path.join(output_dir, 'forensic.zip')}),
+        'export_voices': ((talker,), {'dest': os.path.join(output_dir, 'voices.zip')}),
+        'export_many': (([talker],), {'output_dir': os.path.join(output_dir, 'many'), 'format': 'txt'}),
+    }
+
+
+def scenario_async_surface(client, sessions, options) -> int:
+    """
+    冒烟检查：asyncio 客户端的每个公开方法都能 await（或 async for）并得到结果
+
+    AsyncWetraceClient 继承自 WetraceClient，同步客户端新增的方法如果没有异步版本，
+    在这里会因为没有覆盖、返回了同步结果或调用失败而报错。服务端返回的错误状态码
+    （如不存在的会话）说明请求已经正常发出，不算失败。
+    """
+    from wetrace_async import AsyncWetraceClient
+
+    public = {name for name, _ in inspect.getmembers(WetraceClient, inspect.isfunction)
+              if not name.startswith('_')} - {'close', 'json_loads'}
+
+    async def check(async_client, name, args, kwargs) -> Optional[str]:
+        try:
+            result = getattr(async_client, name)(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            elif hasattr(result, '__anext__'):
+                count = 0
+                async for _ in result:
+                    count += 1
+                    if count >= 20:
+                        break
+                await result.aclose()
+            else:
+                return f"{name} 返回了同步结果 {type(result).__name__}"
+        except HTTPError:
+            return None
+        except Exception as e:
+            return f"{name}: {type(e).__name__}: {e}"
+        if name == 'export_many' and result['summary']['failed']:
+            return f"export_many: {result['summary']['failed']} 个会话导出失败"
+        return None
+
+    async def run():
+        async with AsyncWetraceClient(client.base_url, metrics=client.metrics,
+                                      compress=client.compress) as async_client:
+            talker = sessions[0]
+            seq = (await async_client.get_messages(talker_id=talker, limit=1))[0]['Seq']
+            chatrooms = await async_client.get_chatrooms(limit=1)
+            chatroom = chatrooms[0]['ChatRoomName'] if chatrooms else talker
+            with tempfile.TemporaryDirectory(prefix='wetrace-bench-') as output_dir:
+                calls = async_surface_calls(talker, seq, chatroom, output_dir)
+                errors = [f"{name} 没有冒烟检查" for name in sorted(public - set(calls))]
+                for name, (args, kwargs) in calls.items():
+                    error = await check(async_client, name, args, kwargs)
+                    if error:
+                        errors.append(error)
+            return len(calls), errors
+
+    checked, errors = asyncio.run(run())
+    if errors:
+        raise RuntimeError('异步客户端冒烟检查失败:\n' + '\n'.join(errors))
+    return checked
+
+
+SCENARIOS = {
+    'list_walk': scenario_list_walk,
+    'messages_offset': scenario_messages_offset,
+    'messages_keyset': scenario_messages_keyset,
+    'analysis_fanout': scenario_analysis_fanout,
+    'analysis_fanout_async': scenario_analysis_fanout_async,
+    'export': scenario_export,
+    'search': scenario_search,
+    'async_surface': scenario_async_surface,
+}
+
+
+# ==================== 运行 ====================
+
+def peak_rss_mb() -> Optional[float]:
+    """当前进程的峰值常驻内存（MB）"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(len(values) * q + 0.999999) - 1))]
+
+
+def run_scenario(name: str, base_url: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """在当前进程中运行一个场景并返回结果"""
+    setup_client = WetraceClient(base_url)
+    sessions = top_sessions(setup_client, max(options['walk_sessions'], options['fanout_sessions'],
+                                              options['export_sessions']))
+    setup_client.close()
+
+    collector = MetricsCollector()
+    client = WetraceClient(base_url, metrics=collector, compress=options.get('compress'))
+    started = time.perf_counter()
+    items = SCENARIOS[name](client, sessions, options)
+    seconds = time.perf_counter() - started
+    client.close()
+
+    latencies = []
+    requests = 0
+    size = 0
+    decoded = 0
+    for stats in collector.endpoints().values():
+        latencies.extend(stats.total.samples)
+        requests += stats.count
+        size += stats.bytes
+        decoded += stats.decoded_bytes
+    return {
+        'name': name,
+        'seconds': round(seconds, 4),
+        'requests': requests,
+        'items': items,
+        'bytes': size,
+        'decoded_bytes': decoded,
+        'requests_per_s': round(requests / seconds, 1) if seconds else None,
+        'items_per_s': round(items / seconds, 1) if seconds else None,
+        'mb_per_s': round(size / seconds / 1e6, 2) if seconds else None,
+        'p50_ms': _ms(percentile(latencies, 0.5)),
+        'p95_ms': _ms(percentile(latencies, 0.95)),
+        'p99_ms': _ms(percentile(latencies, 0.99)),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_in_child(name: str, base_url: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """在子进程中运行场景，使峰值内存只反映该场景"""
+    command = [sys.executable, os.path.abspath(__file__), '--child', name,
+               '--base-url', base_url, '--options', json.dumps(options)]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"场景 {name} 失败: {completed.stderr.strip()}")
+    return json.loads(completed.stdout)
+
+
+def start_mock_server(args) -> tuple:
+    """启动模拟服务子进程，返回 (进程, base_url)"""
+    command = [sys.executable, os.path.join(SCRIPT_DIR, 'wetrace_mock_server.py'),
+               '--port', '0', '--warm',
+               '--sessions', str(args.sessions), '--messages', str(args.messages),
+               '--seed', str(args.seed), '--latency', str(args.latency)]
+    if args.end_date:
+        command += ['--end-date', args.end_date]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    base_url = process.stdout.readline().strip()
+    if not base_url:
+        process.kill()
+        raise RuntimeError('模拟服务启动失败')
+    return process, base_url
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    """
+    与基准结果比较
+
+    吞吐量下降或 p95 延迟上升超过 threshold（比例）的场景视为退化。
+
+    Returns:
+        退化说明列表
+    """
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        if old.get('items_per_s') and result.get('items_per_s') is not None:
+            change = result['items_per_s'] / old['items_per_s'] - 1
+            result['throughput_change'] = round(change, 3)
+            if change < -threshold:
+                regressions.append(f"{name}: 吞吐量 {old['items_per_s']} -> {result['items_per_s']} 条/秒 ({change:+.1%})")
+        if old.get('p95_ms') and result.get('p95_ms') is not None:
+            change = result['p95_ms'] / old['p95_ms'] - 1
+            result['p95_change'] = round(change, 3)
+            if change > threshold:
+                regressions.append(f"{name}: p95 {old['p95_ms']} -> {result['p95_ms']} ms ({change:+.1%})")
+    return regressions
+
+
+def format_table(results: Dict[str, Dict]) -> str:
+    header = (f"{'scenario':<22} {'seconds':>8} {'reqs':>6} {'items':>8} {'items/s':>10} "
+              f"{'MB/s':>7} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'rssMB':>7} {'vs base':>8}")
+    lines = [header]
+    for name, r in results.items():
+        change = r.get('throughput_change')
+        lines.append(
+            f"{name:<22} {r['seconds']:>8.3f} {r['requests']:>6} {r['items']:>8} "
+            f"{_fmt(r['items_per_s']):>10} {_fmt(r['mb_per_s']):>7} {_fmt(r['p50_ms']):>8} "
+            f"{_fmt(r['p95_ms']):>8} {_fmt(r['p99_ms']):>8} {_fmt(r['peak_rss_mb']):>7} "
+            f"{'-' if change is None else f'{change:+.1%}':>8}")
+    return '\n'.join(lines)
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def _fmt(value) -> str:
+    return '-' if value is None else str(value)
+
+
+def main():
+    """命令行入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Wetrace 客户端性能基准')
+    parser.add_argument('--base-url', help='被测服务地址（默认启动本地模拟服务）')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                       help=f"要运行的场景，逗号分隔（默认全部：{','.join(SCENARIOS)}）")
+    parser.add_argument('--repeat', type=int, default=1, help='每个场景运行次数，取吞吐量的中位数')
+    parser.add_argument('--sessions', type=int, default=200, help='模拟服务的会话数')
+    parser.add_argument('--messages', type=int, default=200000, help='模拟服务的消息总数')
+    parser.add_argument('--seed', type=int, default=42, help='模拟服务的随机种子')
+    parser.add_argument('--end-date', help='模拟数据的最后一天（YYYY-MM-DD，默认今天）')
+    parser.add_argument('--latency', type=float, default=0.0, help='模拟服务每个请求额外的延迟（毫秒）')
+    parser.add_argument('--workers', type=int, default=8, help='并发场景的线程数/并发数')
+    parser.add_argument('--page-size', type=int, default=1000, help='分页遍历的每页数量')
+    parser.add_argument('--compress', choices=('auto', 'on', 'off'), default='auto',
+                        help='客户端是否使用压缩传输（默认 auto：服务端不在本机时压缩）')
+    parser.add_argument('--walk-sessions', type=int, default=3, help='消息遍历场景的会话数')
+    parser.add_argument('--fanout-sessions', type=int, default=20, help='并发分析场景的会话数')
+    parser.add_argument('--export-sessions', type=int, default=10, help='导出场景的会话数')
+    parser.add_argument('--search-keywords', type=int, default=len(SEARCH_KEYWORDS), help='搜索场景的关键词数')
+    parser.add_argument('--save-baseline', metavar='PATH', help='把结果保存为基准 JSON 文件')
+    parser.add_argument('--baseline', metavar='PATH', help='与基准文件比较，有退化时退出码为 1')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                       help='判定退化的变化比例（默认 0.15）')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出结果')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--options', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_scenario(args.child, args.base_url, json.loads(args.options))))
+        return 0
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+    options = {
+        'workers': args.workers,
+        'page_size': args.page_size,
+        'walk_sessions': args.walk_sessions,
+        'fanout_sessions': args.fanout_sessions,
+        'export_sessions': args.export_sessions,
+        'search_keywords': args.search_keywords,
+        'compress': {'auto': None, 'on': True, 'off': False}[args.compress],
+    }
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server, base_url = start_mock_server(args)
+    try:
+        results = {}
+        for name in names:
+            runs = [run_in_child(name, base_url, options) for _ in range(max(1, args.repeat))]
+            runs.sort(key=lambda run: run['items_per_s'] or 0)
+            results[name] = runs[len(runs) // 2]
+            if not args.json:
+                print(f"{name}: {results[name]['seconds']:.3f}s", file=sys.stderr)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f)['results'], args.threshold)
+
+    report = {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'platform': sys.platform,
+            'base_url': args.base_url or 'mock',
+            'sessions': args.sessions,
+            'messages': args.messages,
+            'seed': args.seed,
+            'options': options,
+        },
+        'results': results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.json:
+        report['regressions'] = regressions
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(format_table(results))
+        for line in regressions:
+            print(f"退化: {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Wetrace 守护进程与交互模式
+serve 在 Unix socket（不支持时为本机 TCP 端口）上接收 wetrace.py 转发的命令，
+repl 从标准输入逐行读取命令。所有命令共用常驻的客户端（连接池、响应缓存、熔断器和限流器），
+省去每次启动解释器和建立连接的开销。仅使用标准库
+"""
+
+import argparse
+import io
+import json
+import os
+import secrets
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from typing import Optional, List, Dict, Any
+
+from wetrace import (
+    CHANNEL_EXIT,
+    CHANNEL_STDERR,
+    CHANNEL_STDOUT,
+    CONTROL_STATUS,
+    CONTROL_STOP,
+    LOCAL_COMMANDS,
+    connect,
+    daemon_path,
+    pack_frame,
+    read_request,
+    send_request,
+)
+from wetrace_api import (
+    CLIENT_OPTIONS,
+    WetraceClient,
+    WetraceError,
+    make_client,
+    parse_args,
+    run_command,
+)
+
+# 等待新连接时检查空闲超时和停止请求的间隔（秒）
+ACCEPT_INTERVAL = 1.0
+
+# 常驻的联系人解析器重新加载联系人和群聊的间隔（秒）
+RESOLVER_TTL = 600.0
+
+
+class ClientCache:
+    """按客户端配置（服务地址、缓存、重试、压缩、限流）缓存常驻的客户端"""
+
+    def __init__(self, memo_ttl: float = 0.0):
+        """
+        初始化
+
+        Args:
+            memo_ttl: 客户端的 memo_ttl（相同 GET 请求在多少秒内直接复用结果）
+        """
+        self.memo_ttl = memo_ttl
+        self._lock = threading.Lock()
+        self._clients: Dict[tuple, WetraceClient] = {}
+        self._resolvers: Dict[tuple, tuple] = {}
+
+    def get(self, args) -> WetraceClient:
+        """
+        获取与命令行全局参数对应的客户端
+
+        命令带 --profile 或 --metrics-file 时返回一个记录指标的新客户端，
+        它与常驻客户端共用连接池、缓存、熔断器、限流器以及合并中的请求和 memo。
+        """
+        options = self._options(args)
+        key = self._key(options)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = make_client(argparse.Namespace(**options))
+                client.memo_ttl = self.memo_ttl
+                self._clients[key] = client
+        metrics = getattr(args, 'metrics', None)
+        if not metrics:
+            return client
+        profiled = WetraceClient(client.base_url, pool=client.pool, cache=client.cache,
+                                 coalesce=client.coalesce, memo_ttl=client.memo_ttl,
+                                 retry=client.retry, breaker=client.breaker,
+                                 limiter=client.limiter, metrics=metrics,
+                                 compress=client.compress)
+        # 共用合并中的请求和 memo：通过它发出的修改类请求也要清空常驻客户端的 memo
+        profiled._flight_lock = client._flight_lock
+        profiled._inflight = client._inflight
+        profiled._memo = client._memo
+        return profiled
+
+    @staticmethod
+    def _options(args) -> Dict[str, Any]:
+        return {name: getattr(args, name) for name in CLIENT_OPTIONS}
+
+    @staticmethod
+    def _key(options: Dict[str, Any]) -> tuple:
+        return tuple(options.values()) + (os.environ.get('WETRACE_CACHE'),)
+
+    def get_resolver(self, args):
+        """
+        获取与命令行全局参数对应的常驻联系人解析器
+
+        预加载的联系人和群聊在命令之间复用，超过 RESOLVER_TTL 秒后换一个新的解析器重新加载。
+        """
+        from wetrace_resolver import ContactResolver
+
+        key = self._key(self._options(args))
+        client = self.get(argparse.Namespace(**self._options(args)))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._resolvers.get(key)
+            if entry is None or now - entry[1] > RESOLVER_TTL:
+                entry = (ContactResolver(client), now)
+                self._resolvers[key] = entry
+        return entry[0]
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def close(self):
+        """关闭全部客户端"""
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+            self._resolvers = {}
+        for client in clients:
+            client.close()
+
+
+class CommandRunner:
+    """
+    在当前进程中执行命令，共用 ClientCache 中的客户端
+
+    命令依次执行（同一时刻只执行一个），执行期间把标准输入输出、工作目录和
+    WETRACE_* 环境变量切换为请求方的。
+    """
+
+    def __init__(self, defaults: Dict[str, Any], memo_ttl: float = 0.0):
+        """
+        初始化
+
+        Args:
+            defaults: 客户端相关全局参数的默认值（见 CLIENT_OPTIONS），命令中显式指定时以命令为准
+            memo_ttl: 相同 GET 请求在多少秒内直接复用结果
+        """
+        self.defaults = dict(defaults)
+        self.clients = ClientCache(memo_ttl)
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.commands = 0
+        self.last_active = time.monotonic()
+
+    def execute(self, argv: List[str], stdout=None, stderr=None,
+                stdin: Optional[bytes] = None, cwd: Optional[str] = None,
+                env: Optional[Dict[str, str]] = None) -> int:
+        """
+        执行一条命令
+
+        Args:
+            argv: 命令行参数（与 wetrace_api.py 相同）
+            stdout: 标准输出（文本流，None 表示不切换）
+            stderr: 标准错误（文本流，None 表示不切换）
+            stdin: 标准输入的内容（None 表示不切换）
+            cwd: 工作目录（None 表示不切换）
+            env: 要设置的 WETRACE_* 环境变量（其余 WETRACE_* 变量在执行期间移除）
+
+        Returns:
+            退出码
+        """
+        with self.lock:
+            saved = (sys.stdout, sys.stderr, sys.stdin)
+            saved_cwd = os.getcwd() if cwd else None
+            saved_env = None
+            if stdout is not None:
+                sys.stdout = stdout
+            if stderr is not None:
+                sys.stderr = stderr
+            if stdin is not None:
+                sys.stdin = io.TextIOWrapper(io.BytesIO(stdin), encoding='utf-8')
+            if env is not None:
+                saved_env = {key: value for key, value in os.environ.items()
+                             if key.startswith('WETRACE_')}
+                for key in saved_env:
+                    del os.environ[key]
+                os.environ.update(env)
+            try:
+                if cwd:
+                    os.chdir(cwd)
+                return self._run(argv)
+            finally:
+                for stream in (sys.stdout, sys.stderr):
+                    try:
+                        stream.flush()
+                    except (OSError, ValueError):
+                        pass
+                sys.stdout, sys.stderr, sys.stdin = saved
+                if saved_cwd:
+                    os.chdir(saved_cwd)
+                if saved_env is not None:
+                    for key in [key for key in os.environ if key.startswith('WETRACE_')]:
+                        del os.environ[key]
+                    os.environ.update(saved_env)
+                self.commands += 1
+                self.last_active = time.monotonic()
+
+    def _run(self, argv: List[str]) -> int:
+        namespace = argparse.Namespace(clients=self.clients, **self.defaults)
+        try:
+            args = parse_args(argv, namespace)
+            if args.command in LOCAL_COMMANDS:
+                print(f"错误: 不能在守护进程中执行 {args.command} 命令", file=sys.stderr)
+                return 2
+            return run_command(args)
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code, file=sys.stderr)
+            return 1
+        except (BrokenPipeError, ConnectionError):
+            # 请求方已断开
+            return 1
+        except Exception:
+            traceback.print_exc()
+            return 1
+
+    def status(self) -> Dict[str, Any]:
+        """运行状态"""
+        return {
+            'pid': os.getpid(),
+            'started_at': int(self.started),
+            'uptime': round(time.time() - self.started, 1),
+            'commands': self.commands,
+            'clients': len(self.clients),
+        }
+
+    def close(self):
+        """等待正在执行的命令结束并关闭客户端"""
+        with self.lock:
+            self.clients.close()
+
+
+class _FrameWriter(io.RawIOBase):
+    """把写入的数据作为响应帧发送到 socket"""
+
+    def __init__(self, sock: socket.socket, channel: int):
+        self._sock = sock
+        self._channel = channel
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        if data:
+            self._sock.sendall(pack_frame(self._channel, data))
+        return len(data)
+
+
+def _text_stream(sock: socket.socket, channel: int) -> io.TextIOWrapper:
+    return io.TextIOWrapper(io.BufferedWriter(_FrameWriter(sock, channel), 64 * 1024),
+                            encoding='utf-8', errors='replace')
+
+
+class DaemonServer:
+    """守护进程：监听 socket，为每个连接执行一条命令"""
+
+    def __init__(self, runner: CommandRunner, path: str, idle_timeout: float = 1800):
+        """
+        初始化
+
+        Args:
+            runner: 命令执行器
+            path: Unix socket 路径；不支持 Unix socket 时为写入 TCP 地址的文件路径
+            idle_timeout: 空闲多少秒后自动退出（0 表示不退出）
+        """
+        self.runner = runner
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.address = None
+        self._token = ''
+        self._sock = None
+        self._identity = None
+        self._stop = threading.Event()
+
+    def open(self) -> str:
+        """
+        开始监听
+
+        Returns:
+            监听地址的描述
+        """
+        if connect(self.path) is not None:
+            raise WetraceError(f"守护进程已在运行: {self.path}")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        if hasattr(socket, 'AF_UNIX'):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            old_umask = os.umask(0o177)
+            try:
+                sock.bind(self.path)
+            finally:
+                os.umask(old_umask)
+            self.address = f"unix:{self.path}"
+        else:
+            # 没有 Unix socket（如 Windows）：监听本机随机端口，用令牌校验请求方
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind(('127.0.0.1', 0))
+            host, port = sock.getsockname()[:2]
+            self._token = secrets.token_hex(16)
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(f"tcp {host} {port} {self._token}\n")
+            self.address = f"tcp:{host}:{port}"
+        sock.listen(16)
+        sock.settimeout(ACCEPT_INTERVAL)
+        self._sock = sock
+        self._identity = os.stat(self.path).st_ino
+        return self.address
+
+    def serve_forever(self):
+        """处理请求，直到收到停止请求或空闲超时"""
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except socket.timeout:
+                idle = time.monotonic() - self.runner.last_active
+                if self.idle_timeout and idle > self.idle_timeout and not self.runner.lock.locked():
+                    break
+                continue
+            conn.settimeout(None)
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def stop(self):
+        """请求停止"""
+        self._stop.set()
+
+    def close(self):
+        """停止监听并删除地址文件（仍属于本进程时）"""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        try:
+            if os.stat(self.path).st_ino == self._identity:
+                os.unlink(self.path)
+        except OSError:
+            pass
+        self.runner.close()
+
+    def _handle(self, conn: socket.socket):
+        with conn:
+            try:
+                request = read_request(conn)
+            except (OSError, ValueError):
+                return
+            if not secrets.compare_digest(request['token'], self._token):
+                return
+            try:
+                code = self._dispatch(conn, request)
+                conn.sendall(pack_frame(CHANNEL_EXIT, str(code).encode('ascii')))
+            except OSError:
+                pass
+
+    def _dispatch(self, conn: socket.socket, request: Dict[str, Any]) -> int:
+        argv = request['argv']
+        if argv == [CONTROL_STOP]:
+            self.stop()
+            conn.sendall(pack_frame(CHANNEL_STDOUT, '守护进程已停止\n'.encode('utf-8')))
+            return 0
+        if argv == [CONTROL_STATUS]:
+            status = dict(self.runner.status(), address=self.address, path=self.path)
+            text = json.dumps(status, ensure_ascii=False, indent=2) + '\n'
+            conn.sendall(pack_frame(CHANNEL_STDOUT, text.encode('utf-8')))
+            return 0
+        stdout = _text_stream(conn, CHANNEL_STDOUT)
+        stderr = _text_stream(conn, CHANNEL_STDERR)
+        return self.runner.execute(argv, stdout=stdout, stderr=stderr,
+                                   stdin=request['stdin'] if request['stdin'] is not None else b'',
+                                   cwd=request['cwd'] or None, env=request['env'])
+
+
+def client_defaults(args) -> Dict[str, Any]:
+    """从命令行参数中取出客户端相关全局参数"""
+    return {name: getattr(args, name) for name in CLIENT_OPTIONS}
+
+
+def _detach(args, path: str) -> int:
+    """在后台启动守护进程，等它开始监听后返回"""
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wetrace_api.py'),
+               '--base-url', args.base_url, '--retries', str(args.retries),
+               '--compress', args.compress]
+    if args.throttle:
+        command.append('--throttle')
+    if args.no_cache:
+        command.append('--no-cache')
+    elif args.cache:
+        command += ['--cache', args.cache]
+    command += ['serve', '--socket', path, '--idle-timeout', str(args.idle_timeout),
+                '--memo-ttl', str(args.memo_ttl)]
+    options = {}
+    if sys.platform == 'win32':
+        options['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        options['start_new_session'] = True
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, text=True, **options)
+    address = process.stdout.readline().strip()
+    process.stdout.close()
+    if not address:
+        process.wait()
+        raise WetraceError('守护进程启动失败')
+    print(address)
+    return 0
+
+
+def serve(args) -> int:
+    """serve 命令：启动、停止守护进程或查看其状态"""
+    path = args.socket or daemon_path()
+    if args.stop or args.status:
+        code = send_request(path, [CONTROL_STOP if args.stop else CONTROL_STATUS],
+                            stdout=sys.stdout.buffer, stderr=sys.stderr.buffer)
+        if code is None:
+            raise WetraceError(f"守护进程未运行: {path}")
+        return code
+    if args.detach:
+        return _detach(args, path)
+
+    server = DaemonServer(CommandRunner(client_defaults(args), args.memo_ttl), path,
+                          idle_timeout=args.idle_timeout)
+    address = server.open()
+    # 第一行输出监听地址，便于脚本等待守护进程就绪
+    print(address, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+def repl(args) -> int:
+    """repl 命令：逐行读取并执行命令，直到输入结束或 exit/quit"""
+    runner = CommandRunner(client_defaults(args), args.memo_ttl)
+    interactive = sys.stdin.isatty()
+    if interactive:
+        try:
+            import readline  # noqa: F401  提供行编辑和历史记录
+        except ImportError:
+            pass
+    try:
+        while True:
+            if interactive:
+                try:
+                    line = input('wetrace> ')
+                except EOFError:
+                    print()
+                    break
+            else:
+                line = sys.stdin.readline()
+                if not line:
+                    break
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line in ('exit', 'quit'):
+                break
+            try:
+                argv = shlex.split(line)
+            except ValueError as e:
+                print(f"错误: {e}", file=sys.stderr)
+                continue
+            # 标准输入用于读取命令，命令中的 "-" 读到的内容为空
+            runner.execute(argv, stdin=b'')
+    finally:
+        runner.close()
+    return 0
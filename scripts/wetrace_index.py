@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Wetrace 本地全文索引
+基于 SQLite 的倒排索引，中文按单字 + 二元组切分，英文和数字按三元组切分，
+支持与 /search 接口相同的子串匹配，查询结果结构一致（Items、Total、HasMore、Highlight）
+"""
+
+import html
+import os
+import re
+import sqlite3
+import threading
+from typing import Optional, List, Dict, Any, Iterable, Set
+
+from wetrace_api import (
+    DEFAULT_INDEX_PATH,
+    WetraceClient,
+    message_sender,
+    parse_time_range,
+    project_fields,
+)
+
+# 中日韩文字（统一表意文字、扩展 A、兼容表意文字、假名和谚文）
+_CJK = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_TOKEN_RE = re.compile(rf'[{_CJK}]+|[0-9a-z_]+')
+_CJK_RE = re.compile(rf'[{_CJK}]')
+
+# 每次写入数据库的消息条数
+INDEX_BATCH_SIZE = 1000
+
+# 切分方式的版本，切分规则变化时递增，已有索引打开时按新规则重建倒排表
+TOKENIZER_VERSION = '2'
+
+# 英文和数字的 n 元组长度（更短的查询片段不走倒排索引，直接扫描原文）
+LATIN_GRAM = 3
+
+# 建索引需要的消息字段（通过 API 拉取时只保留这些字段）
+INDEX_FIELDS = ('Seq', 'Talker', 'TalkerName', 'Sender', 'IsSender', 'Type', 'CreateTime', 'Content')
+
+
+def tokenize(text: str, for_query: bool = False) -> Set[str]:
+    """
+    切分文本为索引词
+
+    中文等连续的 CJK 字符输出单字和相邻二元组；英文和数字（转为小写）输出所有三元组，
+    这样关键词是某个单词的一部分时也能命中。查询时 CJK 片段只使用二元组（单字片段使用单字），
+    以减少求交次数；不足三个字符的英文片段不输出索引词，由调用方扫描原文匹配。
+
+    Args:
+        text: 文本
+        for_query: 是否为查询切分
+
+    Returns:
+        索引词集合
+    """
+    terms = set()
+    for run in _TOKEN_RE.findall((text or '').lower()):
+        if not _CJK_RE.match(run):
+            terms.update(run[i:i + LATIN_GRAM] for i in range(len(run) - LATIN_GRAM + 1))
+            continue
+        if len(run) == 1 or not for_query:
+            terms.update(run)
+        terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+class SearchIndex:
+    """
+    本地倒排索引
+
+    消息按 (Talker, Seq) 去重，可以重复添加同一批消息；
+    每个会话记录已索引的最大 Seq，用于增量更新。线程安全。
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        """
+        初始化索引
+
+        Args:
+            path: SQLite 文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                doc_id INTEGER PRIMARY KEY,
+                talker TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                talker_name TEXT,
+                sender TEXT,
+                type INTEGER,
+                create_time INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                UNIQUE (talker, seq)
+            );
+            CREATE INDEX IF NOT EXISTS idx_docs_time ON docs (create_time);
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                doc_id INTEGER NOT NULL,
+                PRIMARY KEY (term, doc_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS index_marks (
+                talker TEXT PRIMARY KEY,
+                last_seq INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS index_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        row = self._db.execute("SELECT value FROM index_meta WHERE key = 'tokenizer'").fetchone()
+        if row is None or row[0] != TOKENIZER_VERSION:
+            self._rebuild_postings()
+        self._db.commit()
+
+    def _rebuild_postings(self):
+        """按当前的切分规则从已保存的原文重建倒排表，不需要重新拉取消息"""
+        self._db.execute("DELETE FROM postings")
+        cursor = self._db.execute("SELECT doc_id, content FROM docs")
+        while True:
+            rows = cursor.fetchmany(INDEX_BATCH_SIZE)
+            if not rows:
+                break
+            self._db.executemany(
+                "INSERT OR IGNORE INTO postings (term, doc_id) VALUES (?, ?)",
+                [(term, doc_id) for doc_id, content in rows for term in tokenize(content)])
+        self._db.execute(
+            "INSERT OR REPLACE INTO index_meta (key, value) VALUES ('tokenizer', ?)",
+            (TOKENIZER_VERSION,))
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ==================== 建立索引 ====================
+
+    def add_messages(self, messages: Iterable[Dict]) -> int:
+        """
+        将消息加入索引（已索引的消息会被忽略）
+
+        Args:
+            messages: 消息流
+
+        Returns:
+            新索引的消息条数
+        """
+        added = 0
+        batch = []
+        for msg in messages:
+            batch.append(msg)
+            if len(batch) >= INDEX_BATCH_SIZE:
+                added += self._add_batch(batch)
+                batch = []
+        return added + self._add_batch(batch)
+
+    def _add_batch(self, messages: List[Dict]) -> int:
+        if not messages:
+            return 0
+        added = 0
+        marks = {}
+        with self._lock:
+            for msg in messages:
+                content = msg.get('Content') or ''
+                talker = msg.get('Talker')
+                seq = msg['Seq']
+                if seq > marks.get(talker, -1):
+                    marks[talker] = seq
+                if not content:
+                    continue
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO docs "
+                    "(talker, seq, talker_name, sender, type, create_time, content) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (talker, seq, msg.get('TalkerName'), message_sender(msg),
+                     msg.get('Type'), msg.get('CreateTime') or 0, content))
+                if not cursor.rowcount:
+                    continue
+                doc_id = cursor.lastrowid
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO postings (term, doc_id) VALUES (?, ?)",
+                    [(term, doc_id) for term in tokenize(content)])
+                added += 1
+            self._db.executemany(
+                "INSERT INTO index_marks (talker, last_seq) VALUES (?, ?) "
+                "ON CONFLICT(talker) DO UPDATE SET last_seq = MAX(last_seq, excluded.last_seq)",
+                list(marks.items()))
+            self._db.commit()
+        return added
+
+    def last_seq(self, talker: str) -> Optional[int]:
+        """获取会话已索引的最大 Seq"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT last_seq FROM index_marks WHERE talker = ?", (talker,)).fetchone()
+        return row[0] if row else None
+
+    def update_from_client(self, client: WetraceClient,
+                           talkers: Optional[List[str]] = None) -> int:
+        """
+        通过 API 增量索引会话的新消息
+
+        Args:
+            client: API 客户端
+            talkers: 会话列表（默认全部会话）
+
+        Returns:
+            新索引的消息条数
+        """
+        if talkers is None:
+            talkers = [session['UserName'] for session in client.iter_sessions()]
+        added = 0
+        for talker in talkers:
+            added += self.add_messages(
+                client.iter_messages_keyset(talker, after_seq=self.last_seq(talker),
+                                            fields=INDEX_FIELDS))
+        return added
+
+    def update_from_mirror(self, store, talkers: Optional[List[str]] = None) -> int:
+        """
+        从本地镜像增量索引新消息
+
+        Args:
+            store: MirrorStore
+            talkers: 会话列表（默认镜像中的全部会话）
+
+        Returns:
+            新索引的消息条数
+        """
+        if talkers is None:
+            talkers = [session['UserName'] for session in store.get_sessions()]
+        added = 0
+        for talker in talkers:
+            added += self.add_messages(
+                store.iter_messages(talker, after_seq=self.last_seq(talker)))
+        return added
+
+    def remove_talker(self, talker: str):
+        """从索引中移除会话（例如会话已被删除）"""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM postings WHERE doc_id IN (SELECT doc_id FROM docs WHERE talker = ?)",
+                (talker,))
+            self._db.execute("DELETE FROM docs WHERE talker = ?", (talker,))
+            self._db.execute("DELETE FROM index_marks WHERE talker = ?", (talker,))
+            self._db.commit()
+
+    # ==================== 查询 ====================
+
+    def search(self, keyword: str,
+               talker: Optional[str] = None,
+               sender: Optional[str] = None,
+               msg_type: Optional[int] = None,
+               time_range: Optional[str] = None,
+               limit: int = 50, offset: int = 0,
+               fields: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        全文搜索，参数和返回结构与 WetraceClient.search 一致
+
+        先用倒排索引求交得到候选消息，再按原文子串精确过滤；
+        关键词切不出索引词时（如不足三个字符的英文）直接扫描原文。
+
+        Args:
+            keyword: 搜索关键词
+            talker: 会话用户名
+            sender: 发送者用户名
+            msg_type: 消息类型
+            time_range: 时间范围
+            limit: 返回结果数量
+            offset: 分页偏移量
+            fields: Items 中每条结果只保留这些字段
+
+        Returns:
+            {'Items': [...], 'Total': int, 'HasMore': bool}
+        """
+        keyword = (keyword or '').strip()
+        if not keyword:
+            return {'Items': [], 'Total': 0, 'HasMore': False}
+        terms = sorted(tokenize(keyword, for_query=True))
+
+        conditions = []
+        params: List[Any] = list(terms)
+        if terms:
+            conditions.append("doc_id IN ({})".format(
+                ' INTERSECT '.join('SELECT doc_id FROM postings WHERE term = ?' for _ in terms)))
+        conditions.append("instr(lower(content), ?) > 0")
+        params.append(keyword.lower())
+        if talker:
+            conditions.append("talker = ?")
+            params.append(talker)
+        if sender:
+            conditions.append("sender = ?")
+            params.append(sender)
+        if msg_type is not None:
+            conditions.append("type = ?")
+            params.append(msg_type)
+        start, end = parse_time_range(time_range)
+        if start is not None:
+            conditions.append("create_time >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("create_time <= ?")
+            params.append(end)
+        where = ' AND '.join(conditions)
+
+        with self._lock:
+            total = self._db.execute(f"SELECT COUNT(*) FROM docs WHERE {where}", params).fetchone()[0]
+            rows = self._db.execute(
+                f"SELECT seq, talker, talker_name, content, create_time, type FROM docs "
+                f"WHERE {where} ORDER BY create_time DESC, seq DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]).fetchall()
+
+        pattern = re.compile(re.escape(html.escape(keyword)), re.IGNORECASE)
+        items = [{
+            'Seq': seq,
+            'Talker': row_talker,
+            'TalkerName': talker_name or row_talker,
+            'Content': content,
+            'Highlight': highlight(content, pattern),
+            'CreateTime': create_time,
+            'Type': row_type,
+        } for seq, row_talker, talker_name, content, create_time, row_type in rows]
+        if fields is not None:
+            items = project_fields(items, fields)
+        return {'Items': items, 'Total': total, 'HasMore': offset + len(items) < total}
+
+    def iter_search(self, keyword: str,
+                    talker: Optional[str] = None,
+                    sender: Optional[str] = None,
+                    msg_type: Optional[int] = None,
+                    time_range: Optional[str] = None,
+                    page_size: int = 1000,
+                    fields: Optional[Iterable[str]] = None):
+        """
+        逐条遍历全部搜索结果，与 WetraceClient.iter_search 一致
+
+        Yields:
+            搜索结果条目
+        """
+        offset = 0
+        while True:
+            page = self.search(keyword, talker=talker, sender=sender, msg_type=msg_type,
+                               time_range=time_range, limit=page_size, offset=offset,
+                               fields=fields)
+            yield from page['Items']
+            if not page['HasMore'] or not page['Items']:
+                return
+            offset += len(page['Items'])
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取索引统计
+
+        Returns:
+            消息数、索引词数、会话数和文件路径
+        """
+        with self._lock:
+            docs = self._db.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+            postings = self._db.execute("SELECT COUNT(*) FROM postings").fetchone()[0]
+            talkers = self._db.execute("SELECT COUNT(*) FROM index_marks").fetchone()[0]
+        return {'path': self.path, 'messages': docs, 'postings': postings, 'talkers': talkers}
+
+
+def highlight(content: str, pattern: re.Pattern) -> str:
+    """
+    转义 HTML 后用 <em> 标出命中的关键词
+
+    pattern 需要匹配转义后的关键词（即由 html.escape(keyword) 构造）。
+    """
+    return pattern.sub(lambda match: f"<em>{match.group(0)}</em>", html.escape(content))
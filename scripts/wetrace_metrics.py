@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Wetrace 请求指标
+按端点记录请求数、字节数（含压缩比）、连接/首字节/总耗时直方图、状态码和缓存命中情况，
+支持内存汇总、JSONL 文件和 Prometheus 文本格式输出
+"""
+
+import json
+import math
+import os
+import random
+import re
+import threading
+from typing import Optional, List, Dict, Any
+
+# 直方图分桶上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 每个直方图最多保留的样本数（用于计算分位数，超出后随机替换）
+MAX_SAMPLES = 10000
+
+# 带 ID 的端点归并为模板，避免每个会话/联系人单独成为一个端点
+_ENDPOINT_PATTERNS = [
+    (re.compile(r'^/analysis/(wordcloud/global|personal/[^/]+)$'), None),
+    (re.compile(r'^/analysis/([^/]+)/[^/]+$'), r'/analysis/\1/{id}'),
+    (re.compile(r'^/contacts/(need-contact|export)$'), None),
+    (re.compile(r'^/(sessions|contacts|chatrooms)/[^/]+$'), r'/\1/{id}'),
+]
+
+
+def endpoint_label(endpoint: str) -> str:
+    """
+    获取端点的统计标签
+
+    例如 /analysis/hourly/wxid_abc123 归并为 /analysis/hourly/{id}。
+    """
+    for pattern, template in _ENDPOINT_PATTERNS:
+        match = pattern.match(endpoint)
+        if match:
+            return match.expand(template) if template else endpoint
+    return endpoint
+
+
+class Histogram:
+    """耗时直方图，同时保留有限的样本用于计算分位数"""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'samples')
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.samples: List[float] = []
+
+    def observe(self, value: float):
+        """记录一个值"""
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(value)
+        else:
+            i = random.randrange(self.count)
+            if i < MAX_SAMPLES:
+                self.samples[i] = value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """获取分位数（最近秩法），没有样本时返回 None"""
+        if not self.samples:
+            return None
+        values = sorted(self.samples)
+        return values[min(len(values) - 1, max(0, math.ceil(len(values) * q) - 1))]
+
+
+class EndpointStats:
+    """单个端点的汇总指标"""
+
+    __slots__ = ('count', 'errors', 'bytes', 'decoded_bytes', 'sent_bytes', 'sent_decoded_bytes',
+                 'statuses', 'cache', 'connect', 'ttfb', 'total')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        # 收到的响应体字节数（网络上）与解压后的字节数，发送的请求体字节数与压缩前的字节数
+        self.bytes = 0
+        self.decoded_bytes = 0
+        self.sent_bytes = 0
+        self.sent_decoded_bytes = 0
+        self.statuses: Dict[str, int] = {}
+        self.cache: Dict[str, int] = {}
+        self.connect = Histogram()
+        self.ttfb = Histogram()
+        self.total = Histogram()
+
+    @property
+    def cache_hit_rate(self) -> Optional[float]:
+        """缓存命中率（命中和 304 重新验证都算命中），没有缓存查询时返回 None"""
+        lookups = sum(self.cache.values())
+        if not lookups:
+            return None
+        return (self.cache.get('hit', 0) + self.cache.get('revalidated', 0)) / lookups
+
+    @property
+    def compression_ratio(self) -> Optional[float]:
+        """响应体压缩比（解压后字节数 / 网络上的字节数），没有收到数据时返回 None"""
+        if not self.bytes:
+            return None
+        return self.decoded_bytes / self.bytes
+
+    @property
+    def upload_compression_ratio(self) -> Optional[float]:
+        """请求体压缩比（压缩前字节数 / 发送的字节数），没有发送数据时返回 None"""
+        if not self.sent_bytes:
+            return None
+        return self.sent_decoded_bytes / self.sent_bytes
+
+
+class MetricsCollector:
+    """
+    内存指标汇总
+
+    作为 WetraceClient 的 metrics 参数使用，每个请求记录一次。线程安全。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, EndpointStats] = {}
+
+    def record(self, sample: Dict[str, Any]):
+        """
+        记录一个请求
+
+        Args:
+            sample: 请求记录，包含 method、endpoint、status（连接失败或命中缓存时为 None）、
+                    error、bytes、decoded_bytes、sent_bytes、sent_decoded_bytes、
+                    connect、ttfb、total（秒）和 cache（hit/miss/revalidated/None）
+        """
+        key = f"{sample['method']} {endpoint_label(sample['endpoint'])}"
+        with self._lock:
+            stats = self._endpoints.get(key)
+            if stats is None:
+                stats = self._endpoints[key] = EndpointStats()
+            stats.count += 1
+            stats.errors += bool(sample.get('error'))
+            status = sample.get('status')
+            cache = sample.get('cache')
+            if status is not None:
+                status_key = str(status)
+            else:
+                status_key = 'cached' if cache == 'hit' else 'error'
+            stats.statuses[status_key] = stats.statuses.get(status_key, 0) + 1
+            size = sample.get('bytes') or 0
+            stats.bytes += size
+            decoded = sample.get('decoded_bytes')
+            stats.decoded_bytes += size if decoded is None else decoded
+            sent = sample.get('sent_bytes') or 0
+            stats.sent_bytes += sent
+            sent_decoded = sample.get('sent_decoded_bytes')
+            stats.sent_decoded_bytes += sent if sent_decoded is None else sent_decoded
+            if cache:
+                stats.cache[cache] = stats.cache.get(cache, 0) + 1
+            for name in ('connect', 'ttfb', 'total'):
+                value = sample.get(name)
+                if value is not None:
+                    getattr(stats, name).observe(value)
+
+    def endpoints(self) -> Dict[str, EndpointStats]:
+        """获取各端点的汇总指标（键为 "方法 端点"）"""
+        with self._lock:
+            return dict(self._endpoints)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """
+        获取可序列化的汇总结果
+
+        Returns:
+            {"方法 端点": {'count', 'errors', 'bytes', 'decoded_bytes', 'compression_ratio',
+                          'sent_bytes', 'sent_decoded_bytes', 'upload_compression_ratio',
+                          'statuses', 'cache_hit_rate',
+                          'connect'/'ttfb'/'total': {'p50', 'p95', 'p99', 'mean'}}}
+        """
+        result = {}
+        for key, stats in sorted(self.endpoints().items()):
+            entry = {
+                'count': stats.count,
+                'errors': stats.errors,
+                'bytes': stats.bytes,
+                'decoded_bytes': stats.decoded_bytes,
+                'compression_ratio': stats.compression_ratio,
+                'sent_bytes': stats.sent_bytes,
+                'sent_decoded_bytes': stats.sent_decoded_bytes,
+                'upload_compression_ratio': stats.upload_compression_ratio,
+                'statuses': dict(stats.statuses),
+                'cache_hit_rate': stats.cache_hit_rate,
+            }
+            for name in ('connect', 'ttfb', 'total'):
+                hist = getattr(stats, name)
+                entry[name] = {
+                    'p50': hist.quantile(0.5),
+                    'p95': hist.quantile(0.95),
+                    'p99': hist.quantile(0.99),
+                    'mean': hist.sum / hist.count if hist.count else None,
+                }
+            result[key] = entry
+        return result
+
+    def to_prometheus(self) -> str:
+        """输出 Prometheus 文本格式"""
+        lines = [
+            '# HELP wetrace_requests_total Wetrace API requests by status.',
+            '# TYPE wetrace_requests_total counter',
+        ]
+        endpoints = sorted(self.endpoints().items())
+        for key, stats in endpoints:
+            labels = _labels(key)
+            for status, count in sorted(stats.statuses.items()):
+                lines.append(f'wetrace_requests_total{{{labels},status="{status}"}} {count}')
+        lines += [
+            '# HELP wetrace_response_bytes_total Response body bytes received.',
+            '# TYPE wetrace_response_bytes_total counter',
+        ]
+        for key, stats in endpoints:
+            lines.append(f'wetrace_response_bytes_total{{{_labels(key)}}} {stats.bytes}')
+        lines += [
+            '# HELP wetrace_response_decoded_bytes_total Response body bytes after decompression.',
+            '# TYPE wetrace_response_decoded_bytes_total counter',
+        ]
+        for key, stats in endpoints:
+            lines.append(f'wetrace_response_decoded_bytes_total{{{_labels(key)}}} {stats.decoded_bytes}')
+        lines += [
+            '# HELP wetrace_request_bytes_total Request body bytes sent.',
+            '# TYPE wetrace_request_bytes_total counter',
+        ]
+        for key, stats in endpoints:
+            lines.append(f'wetrace_request_bytes_total{{{_labels(key)}}} {stats.sent_bytes}')
+        lines += [
+            '# HELP wetrace_request_decoded_bytes_total Request body bytes before compression.',
+            '# TYPE wetrace_request_decoded_bytes_total counter',
+        ]
+        for key, stats in endpoints:
+            lines.append(f'wetrace_request_decoded_bytes_total{{{_labels(key)}}} {stats.sent_decoded_bytes}')
+        lines += [
+            '# HELP wetrace_cache_lookups_total Response cache lookups by result.',
+            '# TYPE wetrace_cache_lookups_total counter',
+        ]
+        for key, stats in endpoints:
+            for result, count in sorted(stats.cache.items()):
+                lines.append(f'wetrace_cache_lookups_total{{{_labels(key)},result="{result}"}} {count}')
+        for name, help_text in (('connect', 'TCP connect time'),
+                                ('ttfb', 'Time to response headers'),
+                                ('total', 'Total request time')):
+            metric = f'wetrace_{name}_seconds'
+            lines += [f'# HELP {metric} {help_text} in seconds.', f'# TYPE {metric} histogram']
+            for key, stats in endpoints:
+                hist = getattr(stats, name)
+                labels = _labels(key)
+                cumulative = 0
+                for bound, count in zip(hist.buckets, hist.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f'{metric}_sum{{{labels}}} {hist.sum:.6f}')
+                lines.append(f'{metric}_count{{{labels}}} {hist.count}')
+        return '\n'.join(lines) + '\n'
+
+    def format_report(self) -> str:
+        """
+        输出按端点汇总的耗时报告（耗时单位为毫秒，表头用英文以便对齐）
+
+        bytes 为网络上收到的字节数，ratio 为响应体压缩比。
+        """
+        header = (f"{'endpoint':<40} {'count':>6} {'err':>4} {'cache':>5} {'bytes':>10} {'ratio':>6} "
+                  f"{'p50':>8} {'p95':>8} {'p99':>8} {'ttfb95':>9} {'conn95':>8}")
+        lines = [header]
+        for key, stats in sorted(self.endpoints().items(),
+                                 key=lambda item: -item[1].total.sum):
+            hit_rate = stats.cache_hit_rate
+            ratio = stats.compression_ratio
+            lines.append(
+                f"{key:<40} {stats.count:>6} {stats.errors:>4} "
+                f"{'-' if hit_rate is None else f'{hit_rate:.0%}':>5} {stats.bytes:>10} "
+                f"{'-' if ratio is None else f'{ratio:.1f}x':>6} "
+                f"{_ms(stats.total.quantile(0.5)):>8} {_ms(stats.total.quantile(0.95)):>8} "
+                f"{_ms(stats.total.quantile(0.99)):>8} {_ms(stats.ttfb.quantile(0.95)):>9} "
+                f"{_ms(stats.connect.quantile(0.95)):>8}")
+        return '\n'.join(lines)
+
+    def close(self):
+        """结束记录"""
+
+
+class JsonlMetricsSink:
+    """把每个请求记录追加写入 JSONL 文件。线程安全。"""
+
+    def __init__(self, path: str):
+        """
+        初始化
+
+        Args:
+            path: JSONL 文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def record(self, sample: Dict[str, Any]):
+        """写入一个请求记录"""
+        line = json.dumps(sample, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        """关闭文件"""
+        with self._lock:
+            self._file.close()
+
+
+class PrometheusMetricsSink(MetricsCollector):
+    """在内存中汇总，关闭时把 Prometheus 文本格式写入文件（可供 node_exporter textfile 采集）"""
+
+    def __init__(self, path: str):
+        """
+        初始化
+
+        Args:
+            path: 输出文件路径
+        """
+        super().__init__()
+        self.path = path
+
+    def close(self):
+        """写入文件（先写临时文件再替换，避免被读到一半）"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, self.path)
+
+
+def _labels(key: str) -> str:
+    method, _, endpoint = key.partition(' ')
+    return f'method="{method}",endpoint="{endpoint}"'
+
+
+def _ms(seconds: Optional[float]) -> str:
+    return '-' if seconds is None else f"{seconds * 1000:.1f}"
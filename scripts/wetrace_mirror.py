@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Wetrace 本地消息镜像
+将消息、会话、联系人和群聊增量同步到本地 SQLite，之后的读取和分析直接读本地文件
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, List, Dict, Any, Iterator
+
+from wetrace_api import DEFAULT_MIRROR_PATH, WetraceClient, message_sender, parse_time_range
+
+# 每次写入数据库的消息条数
+WRITE_BATCH_SIZE = 1000
+
+
+class MirrorStore:
+    """
+    本地 SQLite 消息镜像
+
+    每个会话记录一个高水位（最后同步到的 Seq 和 CreateTime），
+    每次同步只通过 Seq 游标拉取水位之后的新消息。
+    服务端已删除的会话会在全量同步时被标记并清除本地消息。
+    线程安全。
+    """
+
+    def __init__(self, path: str = DEFAULT_MIRROR_PATH):
+        """
+        初始化镜像
+
+        Args:
+            path: SQLite 文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                talker TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                create_time INTEGER NOT NULL,
+                type INTEGER,
+                is_sender INTEGER,
+                sender TEXT,
+                data TEXT NOT NULL,
+                PRIMARY KEY (talker, seq)
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_time ON messages (create_time);
+            CREATE TABLE IF NOT EXISTS sessions (
+                user_name TEXT PRIMARY KEY,
+                last_message_time INTEGER,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS contacts (
+                user_name TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chatrooms (
+                chatroom_name TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS watermarks (
+                talker TEXT PRIMARY KEY,
+                last_seq INTEGER,
+                last_create_time INTEGER,
+                session_time INTEGER,
+                synced_at INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS deleted_sessions (
+                talker TEXT PRIMARY KEY,
+                deleted_at INTEGER NOT NULL
+            );
+        """)
+        self._db.commit()
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ==================== 写入 ====================
+
+    def add_messages(self, messages: List[Dict]) -> int:
+        """
+        写入一批消息（已存在的按 Seq 覆盖），并推进对应会话的高水位
+
+        Args:
+            messages: 消息列表
+
+        Returns:
+            写入条数
+        """
+        if not messages:
+            return 0
+        rows = [(msg['Talker'], msg['Seq'], msg.get('CreateTime', 0), msg.get('Type'),
+                 msg.get('IsSender'), message_sender(msg), json.dumps(msg, ensure_ascii=False))
+                for msg in messages]
+        marks = {}
+        for msg in messages:
+            mark = marks.get(msg['Talker'])
+            if mark is None or msg['Seq'] > mark[0]:
+                marks[msg['Talker']] = (msg['Seq'], msg.get('CreateTime', 0))
+        now = int(time.time())
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO messages "
+                "(talker, seq, create_time, type, is_sender, sender, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._db.executemany(
+                "INSERT INTO watermarks (talker, last_seq, last_create_time, synced_at) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT(talker) DO UPDATE SET "
+                "last_create_time = CASE WHEN excluded.last_seq > COALESCE(last_seq, -1) "
+                "THEN excluded.last_create_time ELSE last_create_time END, "
+                "last_seq = MAX(COALESCE(last_seq, -1), excluded.last_seq), "
+                "synced_at = excluded.synced_at",
+                [(talker, seq, create_time, now) for talker, (seq, create_time) in marks.items()])
+            self._db.commit()
+        return len(rows)
+
+    def _replace_table(self, table: str, key_column: str, key_field: str,
+                       records: List[Dict], extra: Optional[Dict[str, str]] = None):
+        extra = extra or {}
+        columns = [key_column] + list(extra) + ['data']
+        rows = [tuple([record[key_field]] + [record.get(field) for field in extra.values()]
+                      + [json.dumps(record, ensure_ascii=False)])
+                for record in records]
+        with self._lock:
+            self._db.execute(f"DELETE FROM {table}")
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})", rows)
+            self._db.commit()
+
+    def replace_sessions(self, sessions: List[Dict]):
+        """用完整的会话列表替换本地会话表"""
+        self._replace_table('sessions', 'user_name', 'UserName', sessions,
+                            {'last_message_time': 'LastMessageTime'})
+
+    def replace_contacts(self, contacts: List[Dict]):
+        """用完整的联系人列表替换本地联系人表"""
+        self._replace_table('contacts', 'user_name', 'UserName', contacts)
+
+    def replace_chatrooms(self, chatrooms: List[Dict]):
+        """用完整的群聊列表替换本地群聊表"""
+        self._replace_table('chatrooms', 'chatroom_name', 'ChatRoomName', chatrooms)
+
+    def mark_deleted(self, talker: str):
+        """记录会话已被删除，并清除其本地消息、会话和高水位"""
+        with self._lock:
+            self._db.execute("DELETE FROM messages WHERE talker = ?", (talker,))
+            self._db.execute("DELETE FROM sessions WHERE user_name = ?", (talker,))
+            self._db.execute("DELETE FROM watermarks WHERE talker = ?", (talker,))
+            self._db.execute(
+                "INSERT OR REPLACE INTO deleted_sessions (talker, deleted_at) VALUES (?, ?)",
+                (talker, int(time.time())))
+            self._db.commit()
+
+    # ==================== 读取 ====================
+
+    def watermark(self, talker: str) -> Optional[Dict]:
+        """
+        获取会话的高水位
+
+        Returns:
+            {'last_seq', 'last_create_time', 'session_time', 'synced_at'}，
+            未同步过时返回 None；session_time 为上次同步完成时会话的 LastMessageTime
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT last_seq, last_create_time, session_time, synced_at "
+                "FROM watermarks WHERE talker = ?", (talker,)).fetchone()
+        if row is None:
+            return None
+        return {'last_seq': row[0], 'last_create_time': row[1],
+                'session_time': row[2], 'synced_at': row[3]}
+
+    def iter_messages(self, talker_id: Optional[str] = None,
+                      time_range: Optional[str] = None,
+                      sender_id: Optional[str] = None,
+                      reverse: bool = False,
+                      after_seq: Optional[int] = None,
+                      batch_size: int = WRITE_BATCH_SIZE) -> Iterator[Dict]:
+        """
+        逐条读取本地消息，按 (CreateTime, Seq) 排序
+
+        Args:
+            talker_id: 会话用户名
+            time_range: 时间范围
+            sender_id: 发送者用户名
+            reverse: 是否倒序
+            after_seq: 只读取 Seq 大于该值的消息
+            batch_size: 每次从数据库读取的条数
+
+        Yields:
+            消息（与 /messages 返回的结构相同）
+        """
+        start, end = parse_time_range(time_range)
+        conditions = []
+        params = []
+        if talker_id:
+            conditions.append("talker = ?")
+            params.append(talker_id)
+        if sender_id:
+            conditions.append("sender = ?")
+            params.append(sender_id)
+        if after_seq is not None:
+            conditions.append("seq > ?")
+            params.append(after_seq)
+        if start is not None:
+            conditions.append("create_time >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("create_time <= ?")
+            params.append(end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = "DESC" if reverse else "ASC"
+        sql = f"SELECT data FROM messages {where} ORDER BY create_time {order}, seq {order}"
+
+        # 使用独立游标分批读取，避免长时间持有锁
+        with self._lock:
+            cursor = self._db.execute(sql, params)
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for (data,) in rows:
+                yield json.loads(data)
+
+    def _load_table(self, table: str) -> List[Dict]:
+        with self._lock:
+            rows = self._db.execute(f"SELECT data FROM {table}").fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def get_sessions(self) -> List[Dict]:
+        """获取本地会话列表（按最后消息时间倒序）"""
+        sessions = self._load_table('sessions')
+        sessions.sort(key=lambda session: session.get('LastMessageTime') or 0, reverse=True)
+        return sessions
+
+    def get_contacts(self) -> List[Dict]:
+        """获取本地联系人列表"""
+        return self._load_table('contacts')
+
+    def get_chatrooms(self) -> List[Dict]:
+        """获取本地群聊列表"""
+        return self._load_table('chatrooms')
+
+    def deleted_sessions(self) -> List[str]:
+        """获取已被删除的会话"""
+        with self._lock:
+            rows = self._db.execute("SELECT talker FROM deleted_sessions ORDER BY deleted_at").fetchall()
+        return [talker for (talker,) in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取镜像统计
+
+        Returns:
+            各表的记录数和文件路径
+        """
+        result = {'path': self.path}
+        with self._lock:
+            for table in ('messages', 'sessions', 'contacts', 'chatrooms',
+                          'watermarks', 'deleted_sessions'):
+                result[table] = self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        return result
+
+    # ==================== 同步 ====================
+
+    def sync_talker(self, client: WetraceClient, talker: str,
+                    page_size: int = 1000,
+                    session_time: Optional[int] = None) -> int:
+        """
+        增量同步单个会话：从高水位之后按 Seq 游标拉取新消息
+
+        Args:
+            client: API 客户端
+            talker: 会话用户名
+            page_size: 每页数量
+            session_time: 同步开始前会话的 LastMessageTime，完成后记录到高水位
+
+        Returns:
+            新写入的消息条数
+        """
+        mark = self.watermark(talker)
+        after_seq = mark['last_seq'] if mark else None
+        count = 0
+        batch = []
+        for msg in client.iter_messages_keyset(talker, page_size=page_size, after_seq=after_seq):
+            batch.append(msg)
+            if len(batch) >= WRITE_BATCH_SIZE:
+                count += self.add_messages(batch)
+                batch = []
+        count += self.add_messages(batch)
+
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO watermarks (talker, session_time, synced_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(talker) DO UPDATE SET "
+                "session_time = excluded.session_time, synced_at = excluded.synced_at",
+                (talker, session_time, int(time.time())))
+            self._db.commit()
+        return count
+
+    def delete_session(self, client: WetraceClient, talker: str) -> Dict:
+        """
+        通过 API 删除会话，并同步记录到本地镜像
+
+        Args:
+            client: API 客户端
+            talker: 会话用户名
+
+        Returns:
+            删除结果
+        """
+        result = client.delete_session(talker)
+        self.mark_deleted(talker)
+        return result
+
+    def sync(self, client: WetraceClient,
+             talkers: Optional[List[str]] = None,
+             keyword: Optional[str] = None,
+             include_directory: bool = True,
+             max_workers: int = 4,
+             on_done=None) -> Dict[str, Any]:
+        """
+        增量同步
+
+        会话的 LastMessageTime 与上次同步完成时相同时直接跳过；
+        不指定 talkers 和 keyword 时为全量同步，服务端已不存在的会话会被标记为已删除。
+
+        Args:
+            client: API 客户端
+            talkers: 只同步这些会话（默认全部会话）
+            keyword: 按会话名称筛选
+            include_directory: 是否同时同步联系人和群聊列表
+            max_workers: 并发同步的会话数
+            on_done: 每个会话完成后的回调 on_done(talker, 新消息数或异常)
+
+        Returns:
+            同步结果统计
+        """
+        started = time.monotonic()
+        sessions = list(client.iter_sessions(keyword=keyword))
+        full = talkers is None and keyword is None
+        if full:
+            self.replace_sessions(sessions)
+        else:
+            with self._lock:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO sessions (user_name, last_message_time, data) "
+                    "VALUES (?, ?, ?)",
+                    [(session['UserName'], session.get('LastMessageTime'),
+                      json.dumps(session, ensure_ascii=False)) for session in sessions])
+                self._db.commit()
+
+        if include_directory:
+            self.replace_contacts(list(client.iter_contacts()))
+            self.replace_chatrooms(list(client.iter_chatrooms()))
+
+        last_times = {session['UserName']: session.get('LastMessageTime') for session in sessions}
+        if talkers is None:
+            talkers = list(last_times)
+
+        result = {'sessions': len(talkers), 'synced': 0, 'skipped': 0, 'failed': 0,
+                  'messages': 0, 'deleted': 0, 'errors': {}}
+
+        pending = []
+        for talker in talkers:
+            mark = self.watermark(talker)
+            last_time = last_times.get(talker)
+            if mark and last_time is not None and mark['session_time'] is not None \
+                    and last_time <= mark['session_time']:
+                result['skipped'] += 1
+                continue
+            pending.append(talker)
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {executor.submit(self.sync_talker, client, talker,
+                                       session_time=last_times.get(talker)): talker
+                       for talker in pending}
+            for future in as_completed(futures):
+                talker = futures[future]
+                try:
+                    count = future.result()
+                except Exception as e:
+                    result['failed'] += 1
+                    result['errors'][talker] = str(e)
+                    if on_done:
+                        on_done(talker, e)
+                    continue
+                result['synced'] += 1
+                result['messages'] += count
+                if on_done:
+                    on_done(talker, count)
+
+        if full:
+            with self._lock:
+                known = [talker for (talker,) in
+                         self._db.execute("SELECT talker FROM watermarks").fetchall()]
+            for talker in known:
+                if talker not in last_times:
+                    self.mark_deleted(talker)
+                    result['deleted'] += 1
+
+        result['seconds'] = round(time.monotonic() - started, 3)
+        return result
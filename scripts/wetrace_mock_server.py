@@ -0,0 +1,957 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Wetrace 模拟服务
+基于 http.server 实现 references/api.md 中的全部端点，数据由可复现的合成语料生成，
+用于在没有 Wetrace 的环境中测试和压测客户端，仅使用标准库
+"""
+
+import bisect
+import csv
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import zipfile
+from array import array
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, List, Dict, Any, Tuple
+
+from wetrace_analytics import MESSAGE_TYPE_NAMES, compute_all
+from wetrace_api import COMPRESS_MIN_SIZE, parse_time_range
+
+# 本人的用户名（IsSender=1 的消息的发送者）
+SELF_USER_NAME = 'wxid_self'
+
+# 消息类型及其占比
+MESSAGE_TYPE_WEIGHTS = ((1, 75), (3, 8), (34, 5), (43, 2), (47, 6), (49, 3), (10000, 1))
+
+# 非文本消息的内容
+PLACEHOLDER_CONTENT = {
+    3: '[图片]',
+    34: '[语音]',
+    43: '[视频]',
+    47: '[动画表情]',
+    49: '[链接] 项目周报.pdf',
+    10000: '你已添加了对方，现在可以开始聊天了。',
+}
+
+# 生成消息内容用的词表
+WORDS = (
+    '项目 会议 进度 客户 需求 方案 周报 上线 测试 接口 文档 合同 报价 预算 发票 '
+    '设计 评审 排期 延期 加班 下班 吃饭 周末 出差 机票 酒店 快递 红包 生日 聚会 '
+    '电影 健身 跑步 咖啡 奶茶 火锅 天气 下雨 降温 感冒 医院 孩子 学校 作业 考试 '
+    '老师 家长 房子 装修 搬家 租金 工资 奖金 年终 面试 简历 offer 离职 入职 '
+    '明天 今天 昨天 下午 晚上 早上 马上 稍等 收到 好的 谢谢 辛苦 没问题 可以 '
+    '确认 安排 讨论 同步 跟进 反馈 检查 修改 发布 回滚 部署 服务器 数据库 bug '
+    'review PR 版本 需求池 里程碑 OKR KPI 复盘 总结 计划 目标 风险 问题'
+).split()
+
+# 句子模板数量（每条文本消息使用其中一个）
+PHRASE_COUNT = 4096
+
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何林罗高'
+GIVEN_NAMES = '伟芳娜敏静丽强磊洋艳勇军杰娟涛明超秀霞平刚桂华建国'
+GROUP_TOPICS = ('项目', '家人', '同学', '篮球', '读书', '羽毛球', '摄影', '旅行', '产品', '技术')
+
+
+class SyntheticSession:
+    """
+    一个会话的合成消息（列存储）
+
+    字段与 wetrace_analytics.MessageColumns 相同，可以直接交给 compute_all；
+    另外记录每条消息的内容编号。Seq 为 seq_base + 下标。
+    """
+
+    __slots__ = ('create_time', 'type', 'is_sender', 'sender', 'senders', 'content', 'seq_base')
+
+    def __init__(self, seq_base: int):
+        self.create_time = array('q')
+        self.type = array('l')
+        self.is_sender = array('b')
+        self.sender = array('l')
+        self.senders: List[str] = []
+        self.content = array('l')
+        self.seq_base = seq_base
+
+    def __len__(self) -> int:
+        return len(self.create_time)
+
+
+class SyntheticCorpus:
+    """
+    可复现的合成聊天语料
+
+    相同的 seed 和参数总是生成相同的数据。会话的消息数服从 Zipf 分布
+    （少数会话占大部分消息），消息在第一次访问该会话时才生成。线程安全。
+    """
+
+    def __init__(self, sessions: int = 200, messages: int = 200000,
+                 contacts: Optional[int] = None,
+                 chatroom_ratio: float = 0.2,
+                 days: int = 730,
+                 end_date: Optional[str] = None,
+                 seed: int = 42):
+        """
+        初始化语料
+
+        Args:
+            sessions: 会话数
+            messages: 消息总数
+            contacts: 联系人数（默认为会话数的 2 倍，至少 100；不少于会话数）
+            chatroom_ratio: 群聊会话的占比
+            days: 消息覆盖的天数
+            end_date: 最后一天（YYYY-MM-DD，默认今天）
+            seed: 随机种子
+        """
+        self.seed = seed
+        rng = random.Random(seed)
+        if end_date:
+            end_day = datetime.date.fromisoformat(end_date)
+        else:
+            end_day = datetime.date.today()
+        end = datetime.datetime.combine(end_day, datetime.time.max).replace(microsecond=0)
+        self.end_time = int(end.timestamp())
+        self.start_time = self.end_time - days * 86400 + 1
+
+        self.phrases = self._make_phrases(rng)
+        self.phrase_words = [phrase.split(' ') for phrase in self.phrases]
+
+        # 每个私聊会话对应一个不同的联系人，联系人数不少于会话数
+        contact_count = max(sessions, contacts if contacts is not None else max(100, sessions * 2))
+        self.contacts: List[Dict[str, Any]] = []
+        for i in range(contact_count):
+            nick = rng.choice(SURNAMES) + ''.join(rng.choice(GIVEN_NAMES) for _ in range(rng.randint(1, 2)))
+            self.contacts.append({
+                'UserName': f"wxid_{i:06d}",
+                'Alias': f"user{i}",
+                'NickName': nick,
+                'Remark': rng.choice(('', '', '同事', '客户', '同学', '家人')),
+                'IsFriend': rng.random() < 0.9,
+                'Type': 3,
+            })
+        self.contact_map = {contact['UserName']: contact for contact in self.contacts}
+
+        # 会话：前 chatroom_ratio 比例为群聊，其余为私聊
+        weights = [1.0 / (i + 1) for i in range(sessions)]
+        scale = messages / sum(weights) if sessions else 0
+        counts = [int(w * scale) for w in weights]
+        for i in range(messages - sum(counts)):
+            counts[i % sessions] += 1
+        order = list(range(sessions))
+        rng.shuffle(order)
+
+        self.chatrooms: List[Dict[str, Any]] = []
+        self.sessions: List[Dict[str, Any]] = []
+        self._meta: Dict[str, Tuple[int, int, int, int, Tuple[str, ...]]] = {}
+        chatroom_count = int(sessions * chatroom_ratio)
+        for rank, index in enumerate(order):
+            count = counts[index]
+            if rank < chatroom_count:
+                user_name = f"{10000000 + rank}@chatroom"
+                size = min(contact_count, rng.randint(3, 60))
+                members = tuple(c['UserName'] for c in rng.sample(self.contacts, size))
+                display = f"{rng.choice(GROUP_TOPICS)}{rng.choice(('群', '讨论组', '交流群'))}{rank}"
+                self.chatrooms.append({
+                    'ChatRoomName': user_name,
+                    'DisplayName': display,
+                    'MemberCount': len(members) + 1,
+                    'Members': ';'.join(members + (SELF_USER_NAME,)),
+                })
+                nick, remark = display, ''
+            else:
+                contact = self.contacts[rank % contact_count]
+                user_name = contact['UserName']
+                members = (user_name,)
+                nick, remark = contact['NickName'], contact['Remark']
+            last = rng.randint(self.start_time, self.end_time) if count else 0
+            first = rng.randint(self.start_time, last) if count else 0
+            self._meta[user_name] = (rank, count, first, last, members)
+            self.sessions.append({
+                'UserName': user_name,
+                'NickName': nick,
+                'Remark': remark,
+                'LastMessageTime': last,
+                'MessageCount': count,
+                'UnreadCount': rng.randint(0, 5) if rng.random() < 0.2 else 0,
+            })
+        self.sessions.sort(key=lambda session: -session['LastMessageTime'])
+        self.chatroom_map = {room['ChatRoomName']: room for room in self.chatrooms}
+
+        self.deleted = set()
+        self._data: Dict[str, SyntheticSession] = {}
+        self._lock = threading.Lock()
+        self._memo: Dict[Tuple, Any] = {}
+
+    @staticmethod
+    def _make_phrases(rng: random.Random) -> List[str]:
+        phrases = []
+        for _ in range(PHRASE_COUNT):
+            phrases.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 8))))
+        return phrases
+
+    # ==================== 数据访问 ====================
+
+    def has_session(self, user_name: str) -> bool:
+        return user_name in self._meta and user_name not in self.deleted
+
+    def session_data(self, user_name: str) -> SyntheticSession:
+        """获取会话的消息（第一次访问时生成）"""
+        data = self._data.get(user_name)
+        if data is None:
+            with self._lock:
+                data = self._data.get(user_name)
+                if data is None:
+                    data = self._data[user_name] = self._generate(user_name)
+        return data
+
+    def _generate(self, user_name: str) -> SyntheticSession:
+        rank, count, first, last, members = self._meta[user_name]
+        rng = random.Random(self.seed * 1000003 + rank)
+        data = SyntheticSession((rank + 1) * 100000000)
+        if not count:
+            return data
+        times = sorted(rng.randint(first, last) for _ in range(count - 1))
+        times.append(last)
+        data.create_time = array('q', times)
+        types = [t for t, _ in MESSAGE_TYPE_WEIGHTS]
+        data.type = array('l', rng.choices(types, [w for _, w in MESSAGE_TYPE_WEIGHTS], k=count))
+        data.is_sender = array('b', rng.choices((0, 1), (55, 45), k=count))
+        data.senders = list(members) + [SELF_USER_NAME]
+        self_id = len(members)
+        member_ids = range(len(members))
+        others = rng.choices(member_ids, k=count)
+        data.sender = array('l', (self_id if mine else other
+                                  for mine, other in zip(data.is_sender, others)))
+        data.content = array('l', rng.choices(range(PHRASE_COUNT), k=count))
+        return data
+
+    def warm(self):
+        """生成全部会话的消息"""
+        for session in self.sessions:
+            self.session_data(session['UserName'])
+
+    def active_sessions(self) -> List[Dict[str, Any]]:
+        return [s for s in self.sessions if s['UserName'] not in self.deleted]
+
+    def delete_session(self, user_name: str):
+        with self._lock:
+            self.deleted.add(user_name)
+            self._memo.clear()
+
+    def content_of(self, data: SyntheticSession, i: int) -> str:
+        msg_type = data.type[i]
+        if msg_type == 1:
+            return self.phrases[data.content[i]].replace(' ', '')
+        return PLACEHOLDER_CONTENT.get(msg_type, '')
+
+    def message(self, talker: str, data: SyntheticSession, i: int) -> Dict[str, Any]:
+        """
+        构造一条消息（结构与 /messages 一致）
+
+        和微信一样，群聊中他人发送的消息 Content 以 "wxid:\n" 开头。
+        """
+        seq = data.seq_base + i
+        content = self.content_of(data, i)
+        if talker.endswith('@chatroom') and not data.is_sender[i]:
+            content = f"{data.senders[data.sender[i]]}:\n{content}"
+        return {
+            'Seq': seq,
+            'MsgSvrID': seq * 7 + 13,
+            'Type': data.type[i],
+            'SubType': 0,
+            'IsSender': data.is_sender[i],
+            'CreateTime': data.create_time[i],
+            'Talker': talker,
+            'Content': content,
+            'CompressContent': '',
+            'BytesExtra': '',
+        }
+
+    def display_name(self, user_name: str) -> str:
+        if user_name == SELF_USER_NAME:
+            return '我'
+        if user_name in self.chatroom_map:
+            return self.chatroom_map[user_name]['DisplayName']
+        contact = self.contact_map.get(user_name)
+        if contact is None:
+            return user_name
+        return contact['Remark'] or contact['NickName']
+
+    def memo(self, key: Tuple, compute):
+        """缓存开销较大的计算结果（删除会话后失效）"""
+        value = self._memo.get(key)
+        if value is None:
+            value = compute()
+            with self._lock:
+                self._memo[key] = value
+        return value
+
+    # ==================== 查询 ====================
+
+    def select(self, talker: str, start: Optional[int], end: Optional[int],
+               sender: Optional[str] = None, keyword: Optional[str] = None,
+               msg_type: Optional[int] = None, reverse: bool = False):
+        """按条件逐条产出会话中的消息下标"""
+        data = self.session_data(talker)
+        lo = 0 if start is None else bisect.bisect_left(data.create_time, start)
+        hi = len(data) if end is None else bisect.bisect_right(data.create_time, end)
+        sender_id = None
+        if sender:
+            if sender not in data.senders:
+                return
+            sender_id = data.senders.index(sender)
+        phrase_ids = self.matching_phrases(keyword) if keyword else None
+        indexes = range(hi - 1, lo - 1, -1) if reverse else range(lo, hi)
+        for i in indexes:
+            if sender_id is not None and data.sender[i] != sender_id:
+                continue
+            if msg_type is not None and data.type[i] != msg_type:
+                continue
+            if phrase_ids is not None and not (
+                    (data.type[i] == 1 and data.content[i] in phrase_ids)
+                    or (data.type[i] != 1 and keyword in PLACEHOLDER_CONTENT.get(data.type[i], ''))):
+                continue
+            yield i
+
+    def matching_phrases(self, keyword: str) -> set:
+        keyword = keyword.lower()
+        return self.memo(('phrases', keyword), lambda: {
+            i for i, phrase in enumerate(self.phrases)
+            if keyword in phrase.replace(' ', '').lower()})
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """请求处理，路由见 ROUTES"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'WetraceMock/1.0'
+    # 响应头和响应体分两次写出，不关闭 Nagle 算法时 keep-alive 连接会出现 40ms 延迟
+    disable_nagle_algorithm = True
+
+    # 由 make_server 设置
+    corpus: SyntheticCorpus = None
+    base_path = '/api/v1'
+    latency = 0.0
+    quiet = True
+    compress = True
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    # ==================== 通用 ====================
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _dispatch(self, method: str):
+        parsed = urllib.parse.urlsplit(self.path)
+        path = parsed.path
+        if not path.startswith(self.base_path):
+            return self._send_error(404, '未找到')
+        path = path[len(self.base_path):] or '/'
+        self.query = {k: v[-1] for k, v in urllib.parse.parse_qs(parsed.query).items()}
+        if self.latency:
+            time.sleep(self.latency)
+
+        parts = [urllib.parse.unquote(part) for part in path.strip('/').split('/')]
+        for route_method, pattern, handler in ROUTES:
+            if route_method != method or len(pattern) != len(parts):
+                continue
+            args = []
+            for expected, actual in zip(pattern, parts):
+                if expected == '*':
+                    args.append(actual)
+                elif expected != actual:
+                    break
+            else:
+                try:
+                    return handler(self, *args)
+                except ValueError as e:
+                    return self._send_error(400, str(e))
+        self._send_error(404, '未找到')
+
+    def _send_body(self, status: int, body: bytes, content_type: str,
+                   headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _accepts_gzip(self) -> bool:
+        for item in self.headers.get('Accept-Encoding', '').split(','):
+            coding, _, params = item.partition(';')
+            if coding.strip().lower() == 'gzip':
+                return params.replace(' ', '') not in ('q=0', 'q=0.0')
+        return False
+
+    def _send_json(self, data: Any, etag: bool = False):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        headers = {}
+        if etag:
+            tag = '"{}"'.format(hashlib.md5(body).hexdigest())
+            if self.headers.get('If-None-Match') == tag:
+                self.send_response(304)
+                self.send_header('ETag', tag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            headers['ETag'] = tag
+        if self.compress:
+            headers['Vary'] = 'Accept-Encoding'
+            if len(body) >= COMPRESS_MIN_SIZE and self._accepts_gzip():
+                body = gzip.compress(body, compresslevel=6, mtime=0)
+                headers['Content-Encoding'] = 'gzip'
+        self._send_body(200, body, 'application/json; charset=utf-8', headers)
+
+    def _send_error(self, status: int, message: str):
+        body = json.dumps({'error': message}, ensure_ascii=False).encode('utf-8')
+        self._send_body(status, body, 'application/json; charset=utf-8')
+
+    def _send_file(self, body: bytes, content_type: str, filename: str):
+        """发送文件，支持 Range 断点续传"""
+        headers = {
+            'Content-Disposition': f"attachment; filename*=UTF-8''{urllib.parse.quote(filename)}",
+            'Accept-Ranges': 'bytes',
+        }
+        range_header = self.headers.get('Range', '')
+        if range_header.startswith('bytes=') and range_header.endswith('-'):
+            start = range_header[6:-1]
+            if start.isdigit():
+                start = int(start)
+                if start >= len(body):
+                    headers['Content-Range'] = f"bytes */{len(body)}"
+                    return self._send_body(416, b'', content_type, headers)
+                headers['Content-Range'] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+                return self._send_body(206, body[start:], content_type, headers)
+        self._send_body(200, body, content_type, headers)
+
+    def _int(self, name: str, default: int) -> int:
+        value = self.query.get(name)
+        if value in (None, ''):
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(f"参数 {name} 必须是整数")
+
+    def _page(self) -> Tuple[int, int]:
+        limit = self._int('limit', 50)
+        offset = self._int('offset', 0)
+        if limit < 0 or offset < 0:
+            raise ValueError('limit 和 offset 不能为负数')
+        return min(limit, 1000), offset
+
+    def _time_range(self) -> Tuple[Optional[int], Optional[int]]:
+        return parse_time_range(self.query.get('time_range'))
+
+    def _require_session(self, talker: Optional[str]) -> str:
+        if not talker:
+            raise ValueError('缺少会话参数')
+        if not self.corpus.has_session(talker):
+            raise LookupError(talker)
+        return talker
+
+    # ==================== 会话 ====================
+
+    def sessions(self):
+        limit, offset = self._page()
+        keyword = self.query.get('keyword')
+        items = self.corpus.active_sessions()
+        if keyword:
+            items = [s for s in items if keyword in s['NickName'] or keyword in s['Remark']
+                     or keyword in s['UserName']]
+        self._send_json(items[offset:offset + limit])
+
+    def delete_session(self, talker: str):
+        if not self.corpus.has_session(talker):
+            return self._send_error(404, '会话不存在')
+        self.corpus.delete_session(talker)
+        self._send_json({'success': True})
+
+    # ==================== 消息 ====================
+
+    def messages(self):
+        limit, offset = self._page()
+        start, end = self._time_range()
+        talker = self.query.get('talker_id')
+        keyword = self.query.get('keyword') or None
+        sender = self.query.get('sender_id') or None
+        reverse = self.query.get('reverse', '').lower() in ('1', 'true')
+        corpus = self.corpus
+        if talker:
+            if not corpus.has_session(talker):
+                return self._send_json([])
+            talkers = [talker]
+        elif keyword:
+            talkers = [s['UserName'] for s in corpus.active_sessions()]
+        else:
+            raise ValueError('缺少 talker_id 或 keyword')
+
+        items = []
+        skipped = 0
+        for name in talkers:
+            data = corpus.session_data(name)
+            for i in corpus.select(name, start, end, sender, keyword, reverse=reverse):
+                if skipped < offset:
+                    skipped += 1
+                    continue
+                items.append(corpus.message(name, data, i))
+                if len(items) >= limit:
+                    return self._send_json(items)
+        self._send_json(items)
+
+    # ==================== 联系人 ====================
+
+    def contacts(self):
+        limit, offset = self._page()
+        keyword = self.query.get('keyword')
+        items = self.corpus.contacts
+        if keyword:
+            items = [c for c in items if keyword in c['NickName'] or keyword in c['Remark']
+                     or keyword in c['UserName'] or keyword in c['Alias']]
+        self._send_json(items[offset:offset + limit])
+
+    def contact(self, user_name: str):
+        contact = self.corpus.contact_map.get(user_name)
+        if contact is None:
+            return self._send_error(404, '联系人不存在')
+        self._send_json(contact)
+
+    def need_contact(self):
+        days = self._int('days', 7)
+        now = time.time()
+        items = []
+        for session in self.corpus.active_sessions():
+            contact = self.corpus.contact_map.get(session['UserName'])
+            if contact is None or not session['MessageCount']:
+                continue
+            since = int((now - session['LastMessageTime']) // 86400)
+            if since >= days:
+                items.append({
+                    'UserName': contact['UserName'],
+                    'NickName': contact['NickName'],
+                    'Remark': contact['Remark'],
+                    'LastContactTime': session['LastMessageTime'],
+                    'DaysSinceContact': since,
+                    'MessageCount': session['MessageCount'],
+                })
+        items.sort(key=lambda item: item['DaysSinceContact'])
+        self._send_json(items)
+
+    def export_contacts(self):
+        fmt = self.query.get('format', 'csv')
+        if fmt not in ('csv', 'xlsx'):
+            raise ValueError(f"不支持的格式: {fmt}")
+        keyword = self.query.get('keyword')
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['UserName', 'Alias', 'NickName', 'Remark', 'IsFriend'])
+        for c in self.corpus.contacts:
+            if keyword and keyword not in c['NickName'] and keyword not in c['Remark']:
+                continue
+            writer.writerow([c['UserName'], c['Alias'], c['NickName'], c['Remark'], c['IsFriend']])
+        body = buffer.getvalue().encode('utf-8-sig')
+        if fmt == 'xlsx':
+            # 模拟服务不生成真正的 xlsx，用 CSV 内容代替
+            return self._send_file(body, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                                   'contacts.xlsx')
+        self._send_file(body, 'text/csv; charset=utf-8', 'contacts.csv')
+
+    # ==================== 群聊 ====================
+
+    def chatrooms(self):
+        limit, offset = self._page()
+        keyword = self.query.get('keyword')
+        items = [room for room in self.corpus.chatrooms
+                 if room['ChatRoomName'] not in self.corpus.deleted]
+        if keyword:
+            items = [room for room in items if keyword in room['DisplayName']]
+        self._send_json(items[offset:offset + limit])
+
+    def chatroom(self, chatroom_id: str):
+        room = self.corpus.chatroom_map.get(chatroom_id)
+        if room is None:
+            return self._send_error(404, '群聊不存在')
+        self._send_json(room)
+
+    # ==================== 搜索 ====================
+
+    def search(self):
+        keyword = self.query.get('keyword')
+        if not keyword:
+            raise ValueError('缺少 keyword')
+        limit, offset = self._page()
+        start, end = self._time_range()
+        talker = self.query.get('talker') or None
+        sender = self.query.get('sender') or None
+        msg_type = self._int('type', 0) or None
+        corpus = self.corpus
+
+        hits = []
+        talkers = [talker] if talker else [s['UserName'] for s in corpus.active_sessions()]
+        for name in talkers:
+            if not corpus.has_session(name):
+                continue
+            for i in corpus.select(name, start, end, sender, keyword, msg_type):
+                hits.append((corpus.session_data(name).create_time[i], name, i))
+        hits.sort(reverse=True)
+
+        items = []
+        for _, name, i in hits[offset:offset + limit]:
+            data = corpus.session_data(name)
+            content = corpus.content_of(data, i)
+            items.append({
+                'Seq': data.seq_base + i,
+                'Talker': name,
+                'TalkerName': corpus.display_name(name),
+                'Content': content,
+                'Highlight': content.replace(keyword, f"<em>{keyword}</em>"),
+                'CreateTime': data.create_time[i],
+                'Type': data.type[i],
+            })
+        self._send_json({'Items': items, 'Total': len(hits), 'HasMore': offset + len(items) < len(hits)})
+
+    def search_context(self):
+        talker = self.query.get('talker')
+        if not talker:
+            raise ValueError('缺少 talker')
+        seq = self._int('seq', -1)
+        before = max(0, self._int('before', 10))
+        after = max(0, self._int('after', 10))
+        if not self.corpus.has_session(talker):
+            return self._send_error(404, '会话不存在')
+        data = self.corpus.session_data(talker)
+        anchor = seq - data.seq_base
+        if not 0 <= anchor < len(data):
+            return self._send_error(404, '消息不存在')
+        lo = max(0, anchor - before)
+        hi = min(len(data), anchor + after + 1)
+        messages = [self.corpus.message(talker, data, i) for i in range(lo, hi)]
+        self._send_json({'messages': messages, 'anchor_index': anchor - lo})
+
+    # ==================== 分析 ====================
+
+    def dashboard(self):
+        corpus = self.corpus
+        sessions = corpus.active_sessions()
+        self._send_json({
+            'TotalMessages': sum(s['MessageCount'] for s in sessions),
+            'TotalContacts': len(corpus.contacts),
+            'TotalSessions': len(sessions),
+            'TotalChatrooms': sum(1 for s in sessions if s['UserName'].endswith('@chatroom')),
+            'RecentActivity': [
+                {'UserName': s['UserName'], 'NickName': s['NickName'],
+                 'LastMessageTime': s['LastMessageTime']}
+                for s in sessions[:10]
+            ],
+        }, etag=True)
+
+    def _stats(self, talker: str) -> Dict[str, Any]:
+        data = self.corpus.session_data(talker)
+        return self.corpus.memo(('stats', talker), lambda: compute_all(data))
+
+    def analysis(self, kind: str, talker: str):
+        try:
+            self._require_session(talker)
+        except LookupError:
+            return self._send_error(404, '会话不存在')
+        corpus = self.corpus
+        if kind in ('hourly', 'daily', 'weekday', 'monthly'):
+            result = self._stats(talker)[kind]
+        elif kind == 'type_distribution':
+            result = self._stats(talker)['type_distribution']
+        elif kind == 'member_activity':
+            senders = self._stats(talker)['senders']
+            total = sum(item['Count'] for item in senders) or 1
+            result = [{
+                'UserName': item['Sender'],
+                'NickName': corpus.display_name(item['Sender']),
+                'MessageCount': item['Count'],
+                'Percentage': round(item['Count'] * 100 / total, 1),
+            } for item in senders]
+        elif kind == 'repeat':
+            result = corpus.memo(('repeat', talker), lambda: self._repeat(talker))
+        elif kind == 'wordcloud':
+            result = corpus.memo(('wordcloud', talker), lambda: self._wordcloud([talker]))
+        else:
+            return self._send_error(404, '未找到')
+        self._send_json(result, etag=True)
+
+    def _repeat(self, talker: str) -> List[Dict[str, Any]]:
+        data = self.corpus.session_data(talker)
+        counts: Counter = Counter()
+        users: Dict[int, set] = {}
+        for i in range(len(data)):
+            if data.type[i] != 1:
+                continue
+            phrase = data.content[i]
+            counts[phrase] += 1
+            users.setdefault(phrase, set()).add(data.sender[i])
+        return [{
+            'Content': self.corpus.phrases[phrase].replace(' ', ''),
+            'Count': count,
+            'Users': sorted(self.corpus.display_name(data.senders[s]) for s in users[phrase])[:5],
+        } for phrase, count in counts.most_common(50) if count > 1]
+
+    def _wordcloud(self, talkers: List[str]) -> List[Dict[str, Any]]:
+        phrase_counts: Counter = Counter()
+        for talker in talkers:
+            data = self.corpus.session_data(talker)
+            phrase_counts.update(p for t, p in zip(data.type, data.content) if t == 1)
+        words: Counter = Counter()
+        for phrase, count in phrase_counts.items():
+            for word in self.corpus.phrase_words[phrase]:
+                words[word] += count
+        return [{'Word': word, 'Count': count} for word, count in words.most_common(100)]
+
+    def wordcloud_global(self):
+        talkers = [s['UserName'] for s in self.corpus.active_sessions()]
+        self._send_json(self.corpus.memo(('wordcloud', None), lambda: self._wordcloud(talkers)),
+                        etag=True)
+
+    def top_contacts(self):
+        sessions = [s for s in self.corpus.active_sessions()
+                    if not s['UserName'].endswith('@chatroom')]
+        sessions.sort(key=lambda s: -s['MessageCount'])
+        self._send_json([{
+            'UserName': s['UserName'],
+            'NickName': s['NickName'],
+            'Remark': s['Remark'],
+            'MessageCount': s['MessageCount'],
+            'Rank': rank,
+        } for rank, s in enumerate(sessions[:20], 1)], etag=True)
+
+    def annual_report(self):
+        year = self._int('year', datetime.date.today().year)
+        self._send_json(self.corpus.memo(('annual', year), lambda: self._annual(year)), etag=True)
+
+    def _annual(self, year: int) -> Dict[str, Any]:
+        start = int(datetime.datetime(year, 1, 1).timestamp())
+        end = int(datetime.datetime(year + 1, 1, 1).timestamp()) - 1
+        hourly = [0] * 24
+        monthly: Counter = Counter()
+        types: Counter = Counter()
+        days = set()
+        per_talker = []
+        total = 0
+        for session in self.corpus.active_sessions():
+            talker = session['UserName']
+            stats = compute_all(self.corpus.session_data(talker), start, end)
+            count = stats['summary']['TotalMessages']
+            if not count:
+                continue
+            total += count
+            per_talker.append((count, talker))
+            for item in stats['hourly']:
+                hourly[item['Hour']] += item['Count']
+            for item in stats['monthly']:
+                monthly[item['Month']] += item['Count']
+            for item in stats['type_distribution']:
+                types[item['Type']] += item['Count']
+            days.update(item['Date'] for item in stats['daily'])
+        per_talker.sort(reverse=True)
+        return {
+            'Year': year,
+            'TotalMessages': total,
+            'TotalDays': len(days),
+            'TopContacts': [{'UserName': talker, 'NickName': self.corpus.display_name(talker),
+                             'MessageCount': count} for count, talker in per_talker[:10]],
+            'MostActiveMonth': monthly.most_common(1)[0][0] if monthly else None,
+            'MostActiveHour': max(range(24), key=hourly.__getitem__) if total else None,
+            'MessageTypeStats': [{
+                'Type': t, 'TypeName': MESSAGE_TYPE_NAMES.get(t, '其他'), 'Count': c,
+                'Percentage': round(c * 100 / total, 1)} for t, c in types.most_common()],
+            'MonthlyTrend': [{'Month': m, 'Count': monthly[m]} for m in sorted(monthly)],
+        }
+
+    # ==================== 导出 ====================
+
+    def _export_lines(self, talker: str) -> List[str]:
+        start, end = self._time_range()
+        corpus = self.corpus
+        data = corpus.session_data(talker)
+        lines = []
+        for i in corpus.select(talker, start, end):
+            when = datetime.datetime.fromtimestamp(data.create_time[i]).strftime('%Y-%m-%d %H:%M:%S')
+            sender = corpus.display_name(data.senders[data.sender[i]])
+            lines.append(f"{when} {sender}: {corpus.content_of(data, i)}")
+        return lines
+
+    def _export_talker(self) -> str:
+        talker = self.query.get('talker')
+        self._require_session(talker)
+        return talker
+
+    def export_chat(self):
+        try:
+            talker = self._export_talker()
+        except LookupError:
+            return self._send_error(404, '会话不存在')
+        fmt = self.query.get('format', 'html')
+        name = self.query.get('name') or self.corpus.display_name(talker)
+        lines = self._export_lines(talker)
+        if fmt == 'txt':
+            return self._send_file('\n'.join(lines).encode('utf-8'), 'text/plain; charset=utf-8', f"{name}.txt")
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for line in lines:
+                writer.writerow(line.split(' ', 2))
+            return self._send_file(buffer.getvalue().encode('utf-8-sig'), 'text/csv; charset=utf-8', f"{name}.csv")
+        if fmt == 'html':
+            html = '<html><body>' + ''.join(f"<p>{line}</p>" for line in lines) + '</body></html>'
+            return self._send_file(self._zip({'index.html': html}), 'application/zip', f"{name}.zip")
+        if fmt in ('xlsx', 'docx', 'pdf'):
+            # 模拟服务不生成真正的 Office/PDF 文件，用纯文本内容代替
+            content_types = {
+                'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+                'pdf': 'application/pdf',
+            }
+            return self._send_file('\n'.join(lines).encode('utf-8'), content_types[fmt], f"{name}.{fmt}")
+        raise ValueError(f"不支持的格式: {fmt}")
+
+    def export_forensic(self):
+        try:
+            talker = self._export_talker()
+        except LookupError:
+            return self._send_error(404, '会话不存在')
+        name = self.query.get('name') or self.corpus.display_name(talker)
+        report = '\n'.join(self._export_lines(talker))
+        digest = hashlib.sha256(report.encode('utf-8')).hexdigest()
+        body = self._zip({'report.html': f"<html><body><pre>{report}</pre></body></html>",
+                          'verification.json': json.dumps({'sha256': digest, 'talker': talker})})
+        self._send_file(body, 'application/zip', f"{name}_forensic.zip")
+
+    def export_voices(self):
+        try:
+            talker = self._export_talker()
+        except LookupError:
+            return self._send_error(404, '会话不存在')
+        start, end = self._time_range()
+        data = self.corpus.session_data(talker)
+        files = {}
+        for i in self.corpus.select(talker, start, end, msg_type=34):
+            rng = random.Random(data.seq_base + i)
+            files[f"{data.seq_base + i}.silk"] = bytes(rng.getrandbits(8) for _ in range(256))
+        self._send_file(self._zip(files), 'application/zip', f"{talker}_voices.zip")
+
+    @staticmethod
+    def _zip(files: Dict[str, Any]) -> bytes:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, content in files.items():
+                archive.writestr(name, content)
+        return buffer.getvalue()
+
+
+# (方法, 路径段, 处理函数)，"*" 匹配任意一段并作为参数传入
+ROUTES = [
+    ('GET', ('sessions',), MockHandler.sessions),
+    ('DELETE', ('sessions', '*'), MockHandler.delete_session),
+    ('GET', ('messages',), MockHandler.messages),
+    ('GET', ('contacts',), MockHandler.contacts),
+    ('GET', ('contacts', 'need-contact'), MockHandler.need_contact),
+    ('GET', ('contacts', 'export'), MockHandler.export_contacts),
+    ('GET', ('contacts', '*'), MockHandler.contact),
+    ('GET', ('chatrooms',), MockHandler.chatrooms),
+    ('GET', ('chatrooms', '*'), MockHandler.chatroom),
+    ('GET', ('search',), MockHandler.search),
+    ('GET', ('search', 'context'), MockHandler.search_context),
+    ('GET', ('dashboard',), MockHandler.dashboard),
+    ('GET', ('analysis', 'wordcloud', 'global'), MockHandler.wordcloud_global),
+    ('GET', ('analysis', 'personal', 'top_contacts'), MockHandler.top_contacts),
+    ('GET', ('analysis', '*', '*'), MockHandler.analysis),
+    ('GET', ('report', 'annual'), MockHandler.annual_report),
+    ('GET', ('export', 'chat'), MockHandler.export_chat),
+    ('GET', ('export', 'forensic'), MockHandler.export_forensic),
+    ('GET', ('export', 'voices'), MockHandler.export_voices),
+]
+
+
+def make_server(corpus: SyntheticCorpus, host: str = '127.0.0.1', port: int = 5200,
+                base_path: str = '/api/v1', latency: float = 0.0,
+                quiet: bool = True, compress: bool = True) -> ThreadingHTTPServer:
+    """
+    创建模拟服务（调用 serve_forever 开始处理请求）
+
+    Args:
+        corpus: 合成语料
+        host: 监听地址
+        port: 监听端口（0 表示随机端口，实际端口见 server.server_address）
+        base_path: API 路径前缀
+        latency: 每个请求额外的延迟（秒）
+        quiet: 是否关闭访问日志
+        compress: 客户端声明支持 gzip 时是否压缩 JSON 响应
+
+    Returns:
+        服务对象
+    """
+    handler = type('BoundMockHandler', (MockHandler,), {
+        'corpus': corpus,
+        'base_path': base_path.rstrip('/'),
+        'latency': latency,
+        'quiet': quiet,
+        'compress': compress,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    """命令行入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Wetrace 模拟服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=5200, help='监听端口（0 表示随机端口）')
+    parser.add_argument('--sessions', type=int, default=200, help='会话数')
+    parser.add_argument('--messages', type=int, default=200000, help='消息总数')
+    parser.add_argument('--contacts', type=int, help='联系人数（默认为会话数的 2 倍）')
+    parser.add_argument('--days', type=int, default=730, help='消息覆盖的天数')
+    parser.add_argument('--end-date', help='最后一天（YYYY-MM-DD，默认今天）')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子')
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求额外的延迟（毫秒）')
+    parser.add_argument('--warm', action='store_true', help='启动前生成全部消息')
+    parser.add_argument('--no-compress', action='store_true', help='不压缩 JSON 响应')
+    parser.add_argument('--verbose', action='store_true', help='输出访问日志')
+    args = parser.parse_args()
+
+    corpus = SyntheticCorpus(sessions=args.sessions, messages=args.messages,
+                             contacts=args.contacts, days=args.days,
+                             end_date=args.end_date, seed=args.seed)
+    if args.warm:
+        corpus.warm()
+    server = make_server(corpus, args.host, args.port, latency=args.latency / 1000,
+                         quiet=not args.verbose, compress=not args.no_compress)
+    host, port = server.server_address[:2]
+    # 第一行输出实际地址，便于脚本等待服务就绪
+    print(f"http://{host}:{port}/api/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Wetrace 联系人与群聊解析
+一次性分页预加载全部联系人和群聊，之后把 wxid 解析为昵称/备注等查询都在内存中完成
+"""
+
+import threading
+from typing import Optional, List, Dict, Iterable, Tuple
+
+from wetrace_api import MAX_PAGE_SIZE, NotFoundError, WetraceClient, WetraceError
+
+
+class ContactRecord:
+    """联系人记录"""
+
+    __slots__ = ('user_name', 'alias', 'nick_name', 'remark', 'is_friend', 'type')
+
+    def __init__(self, data: Dict):
+        self.user_name = data.get('UserName')
+        self.alias = data.get('Alias') or ''
+        self.nick_name = data.get('NickName') or ''
+        self.remark = data.get('Remark') or ''
+        self.is_friend = bool(data.get('IsFriend'))
+        self.type = data.get('Type')
+
+    @property
+    def display_name(self) -> str:
+        """显示名称：备注优先，其次昵称，最后用户名"""
+        return self.remark or self.nick_name or self.user_name
+
+    def to_dict(self) -> Dict:
+        return {
+            'UserName': self.user_name,
+            'Alias': self.alias,
+            'NickName': self.nick_name,
+            'Remark': self.remark,
+            'IsFriend': self.is_friend,
+            'Type': self.type,
+        }
+
+
+class ChatroomRecord:
+    """群聊记录，Members 字段在加载时拆分为元组"""
+
+    __slots__ = ('chatroom_name', 'display_name', 'member_count', 'members')
+
+    def __init__(self, data: Dict):
+        self.chatroom_name = data.get('ChatRoomName')
+        self.display_name = data.get('DisplayName') or self.chatroom_name
+        self.members: Tuple[str, ...] = tuple(
+            member for member in (data.get('Members') or '').split(';') if member)
+        self.member_count = data.get('MemberCount') or len(self.members)
+
+    def to_dict(self) -> Dict:
+        return {
+            'ChatRoomName': self.chatroom_name,
+            'DisplayName': self.display_name,
+            'MemberCount': self.member_count,
+            'Members': ';'.join(self.members),
+        }
+
+
+class ContactResolver:
+    """
+    联系人/群聊解析器（身份映射）
+
+    首次查询时用大分页一次性加载全部联系人和群聊，建立 wxid 到记录的映射
+    以及成员到所在群聊的反向索引。预加载中没有的 ID 可以按需单独请求一次，
+    结果（包括不存在）同样会被记住；出现在群成员列表中但不在联系人列表中的 ID
+    是非好友的群成员，单独请求也查不到，不再请求。线程安全。
+    """
+
+    def __init__(self, client: Optional[WetraceClient] = None,
+                 page_size: int = MAX_PAGE_SIZE,
+                 fetch_missing: bool = True):
+        """
+        初始化解析器
+
+        Args:
+            client: API 客户端（只从本地数据加载时可以为 None）
+            page_size: 预加载时的每页数量
+            fetch_missing: 预加载中找不到的 ID（已知的群成员除外）是否单独请求
+        """
+        self.client = client
+        self.page_size = page_size
+        self.fetch_missing = fetch_missing and client is not None
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._contacts: Dict[str, Optional[ContactRecord]] = {}
+        self._chatrooms: Dict[str, Optional[ChatroomRecord]] = {}
+        self._member_of: Dict[str, List[str]] = {}
+
+    def load(self, contacts: Optional[Iterable[Dict]] = None,
+             chatrooms: Optional[Iterable[Dict]] = None) -> 'ContactResolver':
+        """
+        加载全部联系人和群聊
+
+        Args:
+            contacts: 联系人数据（默认通过 client.iter_contacts 拉取，也可以传入本地镜像的数据）
+            chatrooms: 群聊数据（默认通过 client.iter_chatrooms 拉取）
+
+        Returns:
+            解析器本身
+        """
+        if contacts is None:
+            contacts = self.client.iter_contacts(page_size=self.page_size)
+        if chatrooms is None:
+            chatrooms = self.client.iter_chatrooms(page_size=self.page_size)
+
+        contact_map = {}
+        for data in contacts:
+            record = ContactRecord(data)
+            contact_map[record.user_name] = record
+        chatroom_map = {}
+        member_of: Dict[str, List[str]] = {}
+        for data in chatrooms:
+            record = ChatroomRecord(data)
+            chatroom_map[record.chatroom_name] = record
+            for member in record.members:
+                member_of.setdefault(member, []).append(record.chatroom_name)
+
+        with self._lock:
+            self._contacts = contact_map
+            self._chatrooms = chatroom_map
+            self._member_of = member_of
+            self._loaded = True
+        return self
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+
+    def contact(self, user_name: str) -> Optional[ContactRecord]:
+        """获取联系人记录，不存在时返回 None"""
+        self._ensure_loaded()
+        if user_name in self._contacts:
+            return self._contacts[user_name]
+        record = None
+        if self.fetch_missing and user_name not in self._member_of:
+            try:
+                data = self.client.get_contact(user_name)
+            except NotFoundError:
+                data = None
+            except WetraceError:
+                # 网络或服务端的临时错误不缓存，下次查询时重试
+                return None
+            if isinstance(data, dict) and data.get('UserName'):
+                record = ContactRecord(data)
+        with self._lock:
+            self._contacts.setdefault(user_name, record)
+        return self._contacts[user_name]
+
+    def chatroom(self, chatroom_id: str) -> Optional[ChatroomRecord]:
+        """获取群聊记录，不存在时返回 None"""
+        self._ensure_loaded()
+        if chatroom_id in self._chatrooms:
+            return self._chatrooms[chatroom_id]
+        record = None
+        if self.fetch_missing:
+            try:
+                data = self.client.get_chatroom(chatroom_id)
+            except NotFoundError:
+                data = None
+            except WetraceError:
+                # 网络或服务端的临时错误不缓存，下次查询时重试
+                return None
+            if isinstance(data, dict) and data.get('ChatRoomName'):
+                record = ChatroomRecord(data)
+        with self._lock:
+            if chatroom_id not in self._chatrooms:
+                self._chatrooms[chatroom_id] = record
+                if record is not None:
+                    for member in record.members:
+                        self._member_of.setdefault(member, []).append(chatroom_id)
+        return self._chatrooms[chatroom_id]
+
+    def display_name(self, user_name: str) -> str:
+        """
+        获取显示名称
+
+        联系人返回备注或昵称，群聊返回群名称，都找不到时返回原 ID。
+        """
+        if user_name and user_name.endswith('@chatroom'):
+            record = self.chatroom(user_name)
+        else:
+            record = self.contact(user_name)
+        return record.display_name if record is not None else user_name
+
+    def resolve(self, user_names: Iterable[str]) -> Dict[str, str]:
+        """批量获取显示名称"""
+        return {user_name: self.display_name(user_name) for user_name in user_names}
+
+    def members(self, chatroom_id: str) -> Tuple[str, ...]:
+        """获取群成员 ID"""
+        record = self.chatroom(chatroom_id)
+        return record.members if record is not None else ()
+
+    def member_names(self, chatroom_id: str) -> Dict[str, str]:
+        """获取群成员 ID 到显示名称的映射"""
+        return self.resolve(self.members(chatroom_id))
+
+    def chatrooms_of(self, user_name: str) -> List[str]:
+        """获取联系人所在的群聊"""
+        self._ensure_loaded()
+        return list(self._member_of.get(user_name, ()))
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return sum(1 for record in self._contacts.values() if record is not None)
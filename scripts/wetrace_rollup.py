@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Wetrace 本地汇总库
+按 (会话, 日期, 小时, 类型, 是否自己发送) 保存消息计数，随新同步的消息增量累加，
+在本地直接算出概览、年度报告、社交排行榜以及小时/星期/每日/月度/类型分布，
+支持任意时间范围，结构与服务端接口一致，并可与服务端接口逐项核对
+"""
+
+import datetime
+import os
+import sqlite3
+import threading
+from collections import Counter
+from typing import Optional, List, Dict, Any, Iterable, Tuple
+
+from wetrace_analytics import EPOCH_WEEKDAY, MESSAGE_TYPE_NAMES, _UtcOffsets
+from wetrace_api import DEFAULT_ROLLUP_PATH, WetraceClient, parse_time_range
+
+# 每次写入数据库的消息条数
+WRITE_BATCH_SIZE = 1000
+
+# 汇总需要的消息字段（通过 API 拉取时只保留这些字段）
+ROLLUP_FIELDS = ('Seq', 'Talker', 'Type', 'IsSender', 'CreateTime')
+
+# 本地可以回答的分布类型（与 analysis 命令的类型对应）
+DISTRIBUTION_KINDS = ('hourly', 'daily', 'weekday', 'monthly', 'type')
+
+_EPOCH = datetime.date(1970, 1, 1)
+
+
+def is_chatroom(talker: str) -> bool:
+    """会话是否为群聊"""
+    return talker.endswith('@chatroom')
+
+
+class RollupStore:
+    """
+    本地汇总库
+
+    cube 表保存 (会话, 日期, 小时, 类型, 是否自己发送) 的消息计数，
+    daily 表保存 (会话, 日期) 的合计，供起止时间都在整天边界上的按天聚合查询使用，
+    其他时间范围在 cube 上按小时筛选；日期和小时按本地时区划分。
+    每个会话记录已汇总的最大 Seq，用于增量更新，Seq 不大于该值的消息会被忽略。
+    会话名称和联系人数来自最近一次同步的会话和联系人列表。线程安全。
+    """
+
+    def __init__(self, path: str = DEFAULT_ROLLUP_PATH, utc_offset: Optional[int] = None):
+        """
+        初始化汇总库
+
+        Args:
+            path: SQLite 文件路径
+            utc_offset: 固定的时区偏移（秒），默认使用本地时区
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._offsets = _UtcOffsets(utc_offset)
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS cube (
+                talker TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                hour INTEGER NOT NULL,
+                type INTEGER NOT NULL,
+                is_sender INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (talker, day, hour, type, is_sender)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_cube_day ON cube (day);
+            CREATE TABLE IF NOT EXISTS daily (
+                talker TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                sent INTEGER NOT NULL,
+                PRIMARY KEY (talker, day)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_daily_day ON daily (day, talker, count);
+            CREATE TABLE IF NOT EXISTS rollup_marks (
+                talker TEXT PRIMARY KEY,
+                last_seq INTEGER NOT NULL,
+                last_create_time INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS rollup_sessions (
+                user_name TEXT PRIMARY KEY,
+                nick_name TEXT,
+                remark TEXT,
+                last_message_time INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS rollup_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER
+            );
+        """)
+        self._db.commit()
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _local(self, timestamp: int) -> Tuple[int, int]:
+        local = timestamp + self._offsets(timestamp)
+        return local // 86400, (local % 86400) // 3600
+
+    def _hour_range(self, time_range: Optional[str]) -> Tuple[Optional[int], Optional[int], bool]:
+        """时间范围对应的本地小时编号区间（day * 24 + hour，闭区间），以及两端是否都在整天边界上"""
+        start, end = parse_time_range(time_range)
+        whole_days = True
+        bounds = []
+        for timestamp, shift in ((start, 0), (end, 1)):
+            if timestamp is None:
+                bounds.append(None)
+                continue
+            whole_days = whole_days and (timestamp + shift + self._offsets(timestamp)) % 86400 == 0
+            day, hour = self._local(timestamp)
+            bounds.append(day * 24 + hour)
+        return bounds[0], bounds[1], whole_days
+
+    # ==================== 更新 ====================
+
+    def add_messages(self, messages: Iterable[Dict]) -> int:
+        """
+        汇总消息（已汇总过的消息会被忽略）
+
+        Args:
+            messages: 消息流，同一会话的消息按 Seq 升序
+
+        Returns:
+            新汇总的消息条数
+        """
+        added = 0
+        batch = []
+        for msg in messages:
+            batch.append(msg)
+            if len(batch) >= WRITE_BATCH_SIZE:
+                added += self._add_batch(batch)
+                batch = []
+        return added + self._add_batch(batch)
+
+    def _add_batch(self, messages: List[Dict]) -> int:
+        if not messages:
+            return 0
+        cells: Counter = Counter()
+        days: Dict[Tuple[str, int], List[int]] = {}
+        with self._lock:
+            marks: Dict[str, Optional[Tuple[int, int]]] = {}
+            for msg in messages:
+                talker = msg.get('Talker')
+                seq = msg['Seq']
+                if talker not in marks:
+                    row = self._db.execute(
+                        "SELECT last_seq, last_create_time FROM rollup_marks WHERE talker = ?",
+                        (talker,)).fetchone()
+                    marks[talker] = row
+                if marks[talker] is not None and seq <= marks[talker][0]:
+                    continue
+                create_time = msg.get('CreateTime') or 0
+                marks[talker] = (seq, create_time)
+                day, hour = self._local(create_time)
+                is_sender = 1 if msg.get('IsSender') else 0
+                cells[(talker, day, hour, msg.get('Type') or 0, is_sender)] += 1
+                totals = days.get((talker, day))
+                if totals is None:
+                    totals = days[(talker, day)] = [0, 0]
+                totals[0] += 1
+                totals[1] += is_sender
+
+            self._db.executemany(
+                "INSERT INTO cube (talker, day, hour, type, is_sender, count) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(talker, day, hour, type, is_sender) "
+                "DO UPDATE SET count = count + excluded.count",
+                [key + (count,) for key, count in cells.items()])
+            self._db.executemany(
+                "INSERT INTO daily (talker, day, count, sent) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(talker, day) DO UPDATE SET "
+                "count = count + excluded.count, sent = sent + excluded.sent",
+                [(talker, day, count, sent) for (talker, day), (count, sent) in days.items()])
+            self._db.executemany(
+                "INSERT INTO rollup_marks (talker, last_seq, last_create_time) VALUES (?, ?, ?) "
+                "ON CONFLICT(talker) DO UPDATE SET "
+                "last_create_time = CASE WHEN excluded.last_seq > last_seq "
+                "THEN excluded.last_create_time ELSE last_create_time END, "
+                "last_seq = MAX(last_seq, excluded.last_seq)",
+                [(talker,) + mark for talker, mark in marks.items() if mark is not None])
+            self._db.commit()
+        return sum(cells.values())
+
+    def last_seq(self, talker: str) -> Optional[int]:
+        """获取会话已汇总的最大 Seq"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT last_seq FROM rollup_marks WHERE talker = ?", (talker,)).fetchone()
+        return row[0] if row else None
+
+    def replace_directory(self, sessions: List[Dict], contacts: Optional[int] = None):
+        """
+        用完整的会话列表替换会话名称表
+
+        Args:
+            sessions: 会话列表
+            contacts: 联系人数（None 表示不更新）
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM rollup_sessions")
+            self._db.executemany(
+                "INSERT OR REPLACE INTO rollup_sessions "
+                "(user_name, nick_name, remark, last_message_time) VALUES (?, ?, ?, ?)",
+                [(session['UserName'], session.get('NickName'), session.get('Remark'),
+                  session.get('LastMessageTime')) for session in sessions])
+            if contacts is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO rollup_meta (key, value) VALUES ('contacts', ?)",
+                    (contacts,))
+            self._db.commit()
+
+    def update_from_client(self, client: WetraceClient,
+                           talkers: Optional[List[str]] = None,
+                           include_directory: bool = True) -> int:
+        """
+        通过 API 增量汇总会话的新消息
+
+        不指定 talkers 时汇总全部会话，服务端已不存在的会话会被移除。
+
+        Args:
+            client: API 客户端
+            talkers: 会话列表（默认全部会话）
+            include_directory: 是否同时更新会话名称和联系人数
+
+        Returns:
+            新汇总的消息条数
+        """
+        sessions = None
+        if talkers is None or include_directory:
+            sessions = list(client.iter_sessions())
+        if include_directory:
+            self.replace_directory(sessions, sum(1 for _ in client.iter_contacts()))
+        if talkers is None:
+            talkers = [session['UserName'] for session in sessions]
+            self._remove_missing(set(talkers))
+        added = 0
+        for talker in talkers:
+            added += self.add_messages(
+                client.iter_messages_keyset(talker, after_seq=self.last_seq(talker),
+                                            fields=ROLLUP_FIELDS))
+        return added
+
+    def update_from_mirror(self, store, talkers: Optional[List[str]] = None) -> int:
+        """
+        从本地镜像增量汇总新消息
+
+        Args:
+            store: MirrorStore
+            talkers: 会话列表（默认镜像中的全部会话，镜像中已删除的会话会被移除）
+
+        Returns:
+            新汇总的消息条数
+        """
+        sessions = store.get_sessions()
+        self.replace_directory(sessions, len(store.get_contacts()))
+        if talkers is None:
+            talkers = [session['UserName'] for session in sessions]
+            for talker in store.deleted_sessions():
+                self.remove_talker(talker)
+        added = 0
+        for talker in talkers:
+            added += self.add_messages(
+                store.iter_messages(talker, after_seq=self.last_seq(talker)))
+        return added
+
+    def _remove_missing(self, talkers: set):
+        with self._lock:
+            known = [talker for (talker,) in self._db.execute("SELECT talker FROM rollup_marks")]
+        for talker in known:
+            if talker not in talkers:
+                self.remove_talker(talker)
+
+    def remove_talker(self, talker: str):
+        """从汇总库中移除会话（例如会话已被删除）"""
+        with self._lock:
+            for table in ('cube', 'daily'):
+                self._db.execute(f"DELETE FROM {table} WHERE talker = ?", (talker,))
+            self._db.execute("DELETE FROM rollup_marks WHERE talker = ?", (talker,))
+            self._db.commit()
+
+    # ==================== 查询 ====================
+
+    def _query(self, table: str, columns: str, group_by: str,
+               talkers: Optional[Iterable[str]], time_range: Optional[str]) -> List[tuple]:
+        conditions = []
+        params: List[Any] = []
+        start, end, whole_days = self._hour_range(time_range)
+        if start is not None:
+            conditions.append("day >= ?")
+            params.append(start // 24)
+        if end is not None:
+            conditions.append("day <= ?")
+            params.append(end // 24)
+        if not whole_days:
+            # 起止时间不在整天边界上（如 last_7_days）：在 cube 上按小时筛选
+            if start is not None:
+                conditions.append("day * 24 + hour >= ?")
+                params.append(start)
+            if end is not None:
+                conditions.append("day * 24 + hour <= ?")
+                params.append(end)
+        if talkers is not None:
+            talkers = list(talkers)
+            conditions.append("talker IN ({})".format(', '.join('?' * len(talkers))))
+            params.extend(talkers)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        if table == 'daily' and not whole_days:
+            table = ("(SELECT talker, day, SUM(count) AS count, SUM(count * is_sender) AS sent "
+                     f"FROM cube {where} GROUP BY talker, day)")
+            where = ''
+        with self._lock:
+            return self._db.execute(
+                f"SELECT {group_by}, {columns} FROM {table} {where} GROUP BY {group_by}",
+                params).fetchall()
+
+    def _directory(self) -> Dict[str, tuple]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT user_name, nick_name, remark, last_message_time FROM rollup_sessions").fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def talker_counts(self, talkers: Optional[Iterable[str]] = None,
+                      time_range: Optional[str] = None) -> Dict[str, int]:
+        """
+        各会话的消息数
+
+        Args:
+            talkers: 会话列表（默认全部会话）
+            time_range: 时间范围，精确到本地小时（起止时间所在的整小时都计入）
+
+        Returns:
+            {会话: 消息数}
+        """
+        return dict(self._query('daily', 'SUM(count)', 'talker', talkers, time_range))
+
+    def totals(self, talkers: Optional[Iterable[str]] = None,
+               time_range: Optional[str] = None) -> Dict[str, Any]:
+        """
+        消息总数、发送和接收数、活跃天数和有消息的会话数
+
+        Args:
+            talkers: 会话列表（默认全部会话）
+            time_range: 时间范围，精确到本地小时
+        """
+        rows = self._query('daily', 'SUM(count), SUM(sent), COUNT(DISTINCT talker)', 'day',
+                           talkers, time_range)
+        total = sum(row[1] for row in rows)
+        sent = sum(row[2] for row in rows)
+        return {
+            'TotalMessages': total,
+            'SentMessages': sent,
+            'ReceivedMessages': total - sent,
+            'ActiveDays': len(rows),
+            'ActiveSessions': len(self.talker_counts(talkers, time_range)),
+        }
+
+    def distribution(self, kind: str, talkers: Optional[Iterable[str]] = None,
+                     time_range: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        消息分布，结构与服务端对应的分析接口一致
+
+        Args:
+            kind: hourly、daily、weekday、monthly 或 type
+            talkers: 会话列表（默认全部会话）
+            time_range: 时间范围，精确到本地小时
+
+        Returns:
+            分布列表
+        """
+        if kind == 'hourly':
+            counts = dict(self._query('cube', 'SUM(count)', 'hour', talkers, time_range))
+            return [{'Hour': hour, 'Count': counts.get(hour, 0)} for hour in range(24)]
+        if kind == 'type':
+            rows = self._query('cube', 'SUM(count)', 'type', talkers, time_range)
+            total = sum(count for _, count in rows)
+            return [{
+                'Type': msg_type,
+                'TypeName': MESSAGE_TYPE_NAMES.get(msg_type, '其他'),
+                'Count': count,
+                'Percentage': round(count * 100 / total, 1) if total else 0.0,
+            } for msg_type, count in sorted(rows, key=lambda row: -row[1])]
+
+        days = self._query('daily', 'SUM(count)', 'day', talkers, time_range)
+        if kind == 'daily':
+            return [{'Date': (_EPOCH + datetime.timedelta(days=day)).isoformat(), 'Count': count}
+                    for day, count in sorted(days)]
+        if kind == 'weekday':
+            weekday = [0] * 7
+            for day, count in days:
+                weekday[(day + EPOCH_WEEKDAY) % 7] += count
+            return [{'Weekday': wday, 'Count': weekday[wday]} for wday in range(7)]
+        if kind == 'monthly':
+            monthly: Dict[str, int] = {}
+            for day, count in sorted(days):
+                month = (_EPOCH + datetime.timedelta(days=day)).strftime('%Y-%m')
+                monthly[month] = monthly.get(month, 0) + count
+            return [{'Month': month, 'Count': count} for month, count in monthly.items()]
+        raise ValueError(f"未知的分布类型: {kind}")
+
+    def top_contacts(self, limit: int = 20, time_range: Optional[str] = None,
+                     include_chatrooms: bool = False) -> List[Dict[str, Any]]:
+        """
+        社交排行榜（按消息数），结构与 get_top_contacts 一致
+
+        Args:
+            limit: 返回数量
+            time_range: 时间范围，精确到本地小时
+            include_chatrooms: 是否包含群聊
+        """
+        directory = self._directory()
+        counts = [(count, talker) for talker, count in self.talker_counts(time_range=time_range).items()
+                  if count and (include_chatrooms or not is_chatroom(talker))]
+        counts.sort(key=lambda item: (-item[0], item[1]))
+        result = []
+        for rank, (count, talker) in enumerate(counts[:limit], 1):
+            nick_name, remark, _ = directory.get(talker, (None, None, None))
+            result.append({'UserName': talker, 'NickName': nick_name or talker,
+                           'Remark': remark or '', 'MessageCount': count, 'Rank': rank})
+        return result
+
+    def dashboard(self, time_range: Optional[str] = None) -> Dict[str, Any]:
+        """
+        概览数据，结构与 get_dashboard 一致
+
+        不指定时间范围时会话数和群聊数来自会话列表；指定时间范围时只计入范围内有消息的会话，
+        RecentActivity 按范围内最后一条消息排序（范围不含最新消息时精确到小时）。
+
+        Args:
+            time_range: 时间范围，精确到本地小时
+        """
+        directory = self._directory()
+        counts = self.talker_counts(time_range=time_range)
+        with self._lock:
+            row = self._db.execute("SELECT value FROM rollup_meta WHERE key = 'contacts'").fetchone()
+            marks = dict(self._db.execute("SELECT talker, last_create_time FROM rollup_marks"))
+        if time_range is None:
+            talkers = list(directory) or list(counts)
+            recent = sorted(talkers, key=lambda talker: directory.get(talker, (0, 0, 0))[2] or 0,
+                            reverse=True)[:10]
+            last_times = {talker: directory.get(talker, (0, 0, None))[2] for talker in recent}
+        else:
+            talkers = [talker for talker, count in counts.items() if count]
+            last_times = self._last_active(talkers, time_range, marks)
+            recent = sorted(last_times, key=last_times.get, reverse=True)[:10]
+        return {
+            'TotalMessages': sum(counts.values()),
+            'TotalContacts': row[0] if row else None,
+            'TotalSessions': len(talkers),
+            'TotalChatrooms': sum(1 for talker in talkers if is_chatroom(talker)),
+            'RecentActivity': [{'UserName': talker,
+                                'NickName': directory.get(talker, (None,))[0] or talker,
+                                'LastMessageTime': last_times[talker]} for talker in recent],
+        }
+
+    def _last_active(self, talkers: List[str], time_range: str,
+                     marks: Dict[str, int]) -> Dict[str, int]:
+        start, end = parse_time_range(time_range)
+        result = {}
+        pending = []
+        for talker in talkers:
+            last = marks.get(talker)
+            if last is not None and (start is None or last >= start) and (end is None or last <= end):
+                result[talker] = last
+            else:
+                pending.append(talker)
+        if pending:
+            for talker, slot in self._query('cube', 'MAX(day * 24 + hour)', 'talker',
+                                            pending, time_range):
+                local = slot * 3600
+                result[talker] = local - self._offsets(local)
+        return result
+
+    def annual_report(self, year: Optional[int] = None) -> Dict[str, Any]:
+        """
+        年度报告，结构与 get_annual_report 一致
+
+        Args:
+            year: 年份（默认当前年份）
+        """
+        year = year or datetime.date.today().year
+        time_range = f"{year}-01-01~{year}-12-31"
+        counts = self.talker_counts(time_range=time_range)
+        total = sum(counts.values())
+        directory = self._directory()
+        top = sorted(((count, talker) for talker, count in counts.items() if count),
+                     key=lambda item: (-item[0], item[1]))[:10]
+        monthly = self.distribution('monthly', time_range=time_range)
+        hourly = self.distribution('hourly', time_range=time_range)
+        return {
+            'Year': year,
+            'TotalMessages': total,
+            'TotalDays': self.totals(time_range=time_range)['ActiveDays'],
+            'TopContacts': [{'UserName': talker,
+                             'NickName': directory.get(talker, (None,))[0] or talker,
+                             'MessageCount': count} for count, talker in top],
+            'MostActiveMonth': max(monthly, key=lambda item: item['Count'])['Month'] if monthly else None,
+            'MostActiveHour': max(hourly, key=lambda item: item['Count'])['Hour'] if total else None,
+            'MessageTypeStats': self.distribution('type', time_range=time_range),
+            'MonthlyTrend': monthly,
+        }
+
+    # ==================== 核对 ====================
+
+    def verify(self, client: WetraceClient, year: Optional[int] = None) -> Dict[str, Any]:
+        """
+        与服务端的概览、社交排行榜和年度报告逐项核对
+
+        服务端有尚未汇总的新消息时会出现差异，核对前先更新汇总库。
+
+        Args:
+            client: API 客户端
+            year: 核对哪一年的年度报告（默认当前年份）
+
+        Returns:
+            {'ok': bool, 'checks': [{'check', 'local', 'server', 'ok'}]}
+        """
+        checks = []
+
+        def check(name: str, local, server):
+            checks.append({'check': name, 'local': local, 'server': server, 'ok': local == server})
+
+        local = self.dashboard()
+        server = client.get_dashboard()
+        for key in ('TotalMessages', 'TotalContacts', 'TotalSessions', 'TotalChatrooms'):
+            if key in server:
+                check(f"dashboard.{key}", local[key], server[key])
+
+        counts = self.talker_counts()
+        for item in client.get_top_contacts():
+            check(f"top_contacts.{item['UserName']}", counts.get(item['UserName'], 0),
+                  item['MessageCount'])
+
+        local = self.annual_report(year)
+        server = client.get_annual_report(year=local['Year'])
+        annual_counts = self.talker_counts(time_range=f"{local['Year']}-01-01~{local['Year']}-12-31")
+        for key in ('TotalMessages', 'TotalDays', 'MostActiveMonth', 'MostActiveHour'):
+            if key in server:
+                check(f"annual.{key}", local[key], server[key])
+        if 'MonthlyTrend' in server:
+            check('annual.MonthlyTrend',
+                  {item['Month']: item['Count'] for item in local['MonthlyTrend']},
+                  {item['Month']: item['Count'] for item in server['MonthlyTrend']})
+        if 'MessageTypeStats' in server:
+            check('annual.MessageTypeStats',
+                  {item['Type']: item['Count'] for item in local['MessageTypeStats']},
+                  {item['Type']: item['Count'] for item in server['MessageTypeStats']})
+        if 'TopContacts' in server:
+            # 计数相同的会话排序可能不同，只比较服务端列出的会话的计数
+            check('annual.TopContacts',
+                  {item['UserName']: annual_counts.get(item['UserName'], 0)
+                   for item in server['TopContacts']},
+                  {item['UserName']: item['MessageCount'] for item in server['TopContacts']})
+        return {'ok': all(item['ok'] for item in checks), 'checks': checks}
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取汇总库统计
+
+        Returns:
+            消息数、cube 行数、会话数和文件路径
+        """
+        with self._lock:
+            messages, cells = self._db.execute(
+                "SELECT COALESCE(SUM(count), 0), COUNT(*) FROM cube").fetchone()
+            talkers = self._db.execute("SELECT COUNT(*) FROM rollup_marks").fetchone()[0]
+        return {'path': self.path, 'messages': messages, 'cells': cells, 'talkers': talkers}
@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Wetrace 本地词频库
+按 (会话, 日期) 分桶保存可合并的词频：不同的词较少时保存精确计数，
+超过 EXACT_LIMIT 个后折叠进 Count-Min 草图，并用堆保留 top-k 候选词。
+新消息增量累加到所在的桶，任意时间范围、任意会话集合的词云
+都由对应的桶合并得到，不必重新拉取和切分消息文本。
+安装了 jieba 时按词切分，否则中文按二元组切分
+"""
+
+import hashlib
+import heapq
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import zlib
+from array import array
+from collections import Counter
+from typing import Optional, List, Dict, Any, Iterable, Tuple
+
+try:
+    import jieba
+except ImportError:
+    jieba = None
+
+from wetrace_analytics import _UtcOffsets
+from wetrace_api import DEFAULT_TERMS_PATH, WetraceClient, WetraceError, parse_time_range
+
+# Count-Min 草图的列数和行数（同一个词频库内必须一致才能合并）
+SKETCH_WIDTH = 2048
+SKETCH_DEPTH = 4
+
+# 每个桶最多保存的精确计数词数，超过后折叠进草图
+EXACT_LIMIT = 512
+
+# 草图桶保留的候选词数
+TOP_K = 200
+
+# 每次写入数据库的消息条数
+WRITE_BATCH_SIZE = 1000
+
+# 只统计文本消息
+TEXT_MESSAGE_TYPE = 1
+
+# 统计词频需要的消息字段（通过 API 拉取时只保留这些字段）
+TERM_FIELDS = ('Seq', 'Talker', 'Type', 'CreateTime', 'Content')
+
+# 中日韩文字（与 wetrace_index 的范围相同）
+_CJK = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_WORD_RE = re.compile(rf'[{_CJK}]+|[0-9a-z_]+')
+_CJK_RE = re.compile(rf'[{_CJK}]')
+# 链接和 [微笑] 这类表情代码不计入词频
+_NOISE_RE = re.compile(r'https?://\S+|\[[^\[\]\s]{1,8}\]')
+
+# 停用词
+STOP_WORDS = frozenset("""
+    一个 一下 一些 一样 不是 不要 不过 也是 了吗 什么 他们 以后 会儿 你们 你的 其实
+    出来 可以 可能 因为 因此 她们 如果 就是 已经 应该 怎么 我们 我的 所以 然后 现在
+    知道 而且 自己 觉得 还是 还有 这个 这么 这些 这样 那个 那么 那些 那样 都是 没有
+    是不 是的 有点 有没 的话 真的 时候 哈哈 嗯嗯 好的 好吧
+    the and for you are but not that this with have was
+""".split())
+
+
+def bigram_terms(text: str) -> List[str]:
+    """中文等连续的 CJK 字符按相邻二元组切分，英文按整词切分（转为小写，忽略单个字母和纯数字）"""
+    terms = []
+    for run in _WORD_RE.findall(text.lower()):
+        if _CJK_RE.match(run):
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        elif len(run) > 1 and not run.isdigit():
+            terms.append(run)
+    return [term for term in terms if term not in STOP_WORDS]
+
+
+def jieba_terms(text: str) -> List[str]:
+    """用 jieba 分词，只保留两个字以上、含文字的词"""
+    terms = []
+    for word in jieba.lcut(text):
+        word = word.strip().lower()
+        if len(word) > 1 and not word.isdigit() and _WORD_RE.search(word) and word not in STOP_WORDS:
+            terms.append(word)
+    return terms
+
+
+# 分词方式（名称保存在词频库中，同一个库始终使用同一种）
+TOKENIZERS = {'bigram': bigram_terms}
+if jieba is not None:
+    TOKENIZERS['jieba'] = jieba_terms
+DEFAULT_TOKENIZER = 'jieba' if jieba is not None else 'bigram'
+
+
+def extract_terms(text: str, tokenizer: str = DEFAULT_TOKENIZER) -> List[str]:
+    """
+    从消息文本中取出计入词频的词（同一个词出现多次时重复输出）
+
+    Args:
+        text: 消息文本
+        tokenizer: 分词方式（见 TOKENIZERS）
+
+    Returns:
+        词列表
+    """
+    return TOKENIZERS[tokenizer](_NOISE_RE.sub(' ', text or ''))
+
+
+class CountMinSketch:
+    """
+    Count-Min 草图
+
+    估计值不小于真实计数；形状相同的草图逐格相加即可合并。
+    """
+
+    __slots__ = ('width', 'depth', 'table')
+
+    def __init__(self, width: int = SKETCH_WIDTH, depth: int = SKETCH_DEPTH,
+                 table: Optional[array] = None):
+        self.width = width
+        self.depth = depth
+        self.table = table if table is not None else array('I', bytes(4 * width * depth))
+
+    def _cells(self, term: str) -> List[int]:
+        digest = hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest()
+        h1 = int.from_bytes(digest[:4], 'little')
+        h2 = int.from_bytes(digest[4:], 'little') | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def add(self, term: str, count: int = 1):
+        """累加一个词的计数"""
+        table = self.table
+        for cell in self._cells(term):
+            table[cell] += count
+
+    def estimate(self, term: str) -> int:
+        """估计一个词的计数"""
+        table = self.table
+        return min(table[cell] for cell in self._cells(term))
+
+    def merge(self, other: 'CountMinSketch'):
+        """把另一个草图累加到本草图"""
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('草图形状不一致，无法合并')
+        table = self.table
+        for cell, count in enumerate(other.table):
+            if count:
+                table[cell] += count
+
+    def copy(self) -> 'CountMinSketch':
+        return CountMinSketch(self.width, self.depth, array('I', self.table))
+
+    def to_bytes(self) -> bytes:
+        """序列化（小端、zlib 压缩）"""
+        table = self.table
+        if sys.byteorder == 'big':
+            table = array('I', table)
+            table.byteswap()
+        return zlib.compress(table.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data: bytes, width: int = SKETCH_WIDTH,
+                   depth: int = SKETCH_DEPTH) -> 'CountMinSketch':
+        """从 to_bytes 的结果恢复"""
+        table = array('I')
+        table.frombytes(zlib.decompress(data))
+        if sys.byteorder == 'big':
+            table.byteswap()
+        if len(table) != width * depth:
+            raise ValueError('草图形状不一致')
+        return cls(width, depth, table)
+
+
+class TermCounts:
+    """
+    可合并的词频
+
+    counts 保存精确计数，不同的词超过 exact_limit 个时全部折叠进 Count-Min 草图，
+    同时用堆从原有候选词和新折叠的词中选出估计值最大的 top_k 个作为候选。
+    某个词的计数为精确计数与草图估计值之和。
+    """
+
+    __slots__ = ('messages', 'tokens', 'counts', 'sketch', 'top',
+                 'exact_limit', 'top_k', 'width', 'depth')
+
+    def __init__(self, exact_limit: Optional[int] = EXACT_LIMIT,
+                 top_k: Optional[int] = TOP_K,
+                 width: int = SKETCH_WIDTH, depth: int = SKETCH_DEPTH):
+        """
+        初始化
+
+        Args:
+            exact_limit: 最多保存的精确计数词数（None 表示不限，不使用草图）
+            top_k: 保留的候选词数（None 表示不限）
+            width: 草图列数
+            depth: 草图行数
+        """
+        self.messages = 0
+        self.tokens = 0
+        self.counts: Counter = Counter()
+        self.sketch: Optional[CountMinSketch] = None
+        self.top: List[str] = []
+        self.exact_limit = exact_limit
+        self.top_k = top_k
+        self.width = width
+        self.depth = depth
+
+    def add(self, terms: List[str]):
+        """累加一条消息的词"""
+        self.messages += 1
+        self.tokens += len(terms)
+        self.counts.update(terms)
+        self._compact()
+
+    def merge(self, other: 'TermCounts'):
+        """把另一份词频累加到本词频"""
+        self.messages += other.messages
+        self.tokens += other.tokens
+        self.counts.update(other.counts)
+        if other.sketch is not None:
+            if self.sketch is None:
+                self.sketch = other.sketch.copy()
+            else:
+                self.sketch.merge(other.sketch)
+            self._select(set(self.top).union(other.top))
+        self._compact()
+
+    def estimate(self, term: str) -> int:
+        """估计一个词的计数（有草图时不小于真实计数）"""
+        count = self.counts.get(term, 0)
+        if self.sketch is not None:
+            count += self.sketch.estimate(term)
+        return count
+
+    def most_common(self, limit: Optional[int] = None) -> List[Tuple[str, int]]:
+        """
+        计数最大的词
+
+        Args:
+            limit: 返回数量（None 表示全部候选词）
+
+        Returns:
+            [(词, 计数)]，按计数从大到小
+        """
+        candidates = set(self.counts).union(self.top)
+        scored = ((self.estimate(term), term) for term in candidates)
+        if limit is None:
+            ranked = sorted(scored, reverse=True)
+        else:
+            ranked = heapq.nlargest(limit, scored)
+        return [(term, count) for count, term in ranked]
+
+    def _select(self, candidates):
+        if self.top_k is None:
+            self.top = list(candidates)
+        else:
+            self.top = heapq.nlargest(self.top_k, candidates, key=self.estimate)
+
+    def _compact(self):
+        if self.exact_limit is None or len(self.counts) <= self.exact_limit:
+            return
+        if self.sketch is None:
+            self.sketch = CountMinSketch(self.width, self.depth)
+        folded, self.counts = self.counts, Counter()
+        for term, count in folded.items():
+            self.sketch.add(term, count)
+        self._select(set(self.top).union(folded))
+
+    def to_row(self) -> tuple:
+        """序列化为 (messages, tokens, counts, top, sketch)"""
+        return (self.messages, self.tokens,
+                json.dumps(self.counts, ensure_ascii=False, separators=(',', ':')),
+                json.dumps(self.top, ensure_ascii=False, separators=(',', ':')) if self.top else None,
+                self.sketch.to_bytes() if self.sketch is not None else None)
+
+    @classmethod
+    def from_row(cls, messages: int, tokens: int, counts: str,
+                 top: Optional[str], sketch: Optional[bytes], **kwargs) -> 'TermCounts':
+        """从 to_row 的结果恢复，kwargs 同 __init__"""
+        result = cls(**kwargs)
+        result.messages = messages
+        result.tokens = tokens
+        result.counts = Counter(json.loads(counts))
+        if top:
+            result.top = json.loads(top)
+        if sketch is not None:
+            result.sketch = CountMinSketch.from_bytes(sketch, result.width, result.depth)
+        return result
+
+
+class TermStore:
+    """
+    本地词频库
+
+    每个 (会话, 日期) 一个桶，日期按本地时区划分。每个会话记录已统计的最大 Seq，
+    用于增量更新，Seq 不大于该值的消息会被忽略。线程安全。
+    """
+
+    def __init__(self, path: str = DEFAULT_TERMS_PATH, tokenizer: Optional[str] = None,
+                 utc_offset: Optional[int] = None):
+        """
+        初始化词频库
+
+        Args:
+            path: SQLite 文件路径
+            tokenizer: 新建词频库时使用的分词方式（默认有 jieba 时用 jieba），已有的库沿用建库时的方式
+            utc_offset: 固定的时区偏移（秒），默认使用本地时区
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._offsets = _UtcOffsets(utc_offset)
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS term_buckets (
+                talker TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                messages INTEGER NOT NULL,
+                tokens INTEGER NOT NULL,
+                counts TEXT NOT NULL,
+                top TEXT,
+                sketch BLOB,
+                PRIMARY KEY (talker, day)
+            );
+            CREATE INDEX IF NOT EXISTS idx_term_buckets_day ON term_buckets (day);
+            CREATE TABLE IF NOT EXISTS term_marks (
+                talker TEXT PRIMARY KEY,
+                last_seq INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS term_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        meta = dict(self._db.execute("SELECT key, value FROM term_meta"))
+        if not meta:
+            meta = {'tokenizer': tokenizer or DEFAULT_TOKENIZER,
+                    'width': str(SKETCH_WIDTH), 'depth': str(SKETCH_DEPTH)}
+            self._db.executemany("INSERT INTO term_meta (key, value) VALUES (?, ?)", meta.items())
+        self._db.commit()
+        if meta['tokenizer'] not in TOKENIZERS:
+            self._db.close()
+            raise WetraceError(f"词频库使用 {meta['tokenizer']} 分词建立，请先安装 jieba（pip install jieba）")
+        self.tokenizer = meta['tokenizer']
+        self.width = int(meta['width'])
+        self.depth = int(meta['depth'])
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def day_of(self, timestamp: int) -> int:
+        """时间戳所在的本地日期（1970-01-01 起的天数）"""
+        return (timestamp + self._offsets(timestamp)) // 86400
+
+    def _new_counts(self, **kwargs) -> TermCounts:
+        return TermCounts(width=self.width, depth=self.depth, **kwargs)
+
+    # ==================== 更新 ====================
+
+    def add_messages(self, messages: Iterable[Dict]) -> int:
+        """
+        累加消息的词频（已统计过的消息会被忽略）
+
+        Args:
+            messages: 消息流，同一会话的消息按 Seq 升序
+
+        Returns:
+            新统计的文本消息条数
+        """
+        added = 0
+        batch = []
+        for msg in messages:
+            batch.append(msg)
+            if len(batch) >= WRITE_BATCH_SIZE:
+                added += self._add_batch(batch)
+                batch = []
+        return added + self._add_batch(batch)
+
+    def _add_batch(self, messages: List[Dict]) -> int:
+        if not messages:
+            return 0
+        added = 0
+        with self._lock:
+            marks: Dict[str, Optional[int]] = {}
+            pending: Dict[Tuple[str, int], TermCounts] = {}
+            for msg in messages:
+                talker = msg.get('Talker')
+                seq = msg['Seq']
+                if talker not in marks:
+                    row = self._db.execute(
+                        "SELECT last_seq FROM term_marks WHERE talker = ?", (talker,)).fetchone()
+                    marks[talker] = row[0] if row else None
+                if marks[talker] is not None and seq <= marks[talker]:
+                    continue
+                marks[talker] = seq
+                content = msg.get('Content')
+                if msg.get('Type') != TEXT_MESSAGE_TYPE or not content:
+                    continue
+                key = (talker, self.day_of(msg.get('CreateTime') or 0))
+                bucket = pending.get(key)
+                if bucket is None:
+                    bucket = pending[key] = self._new_counts(exact_limit=None, top_k=None)
+                bucket.add(extract_terms(content, self.tokenizer))
+                added += 1
+
+            rows = []
+            for (talker, day), bucket in pending.items():
+                row = self._db.execute(
+                    "SELECT messages, tokens, counts, top, sketch FROM term_buckets "
+                    "WHERE talker = ? AND day = ?", (talker, day)).fetchone()
+                stored = self._new_counts() if row is None else TermCounts.from_row(
+                    *row, width=self.width, depth=self.depth)
+                stored.merge(bucket)
+                rows.append((talker, day) + stored.to_row())
+            self._db.executemany(
+                "INSERT OR REPLACE INTO term_buckets "
+                "(talker, day, messages, tokens, counts, top, sketch) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._db.executemany(
+                "INSERT INTO term_marks (talker, last_seq) VALUES (?, ?) "
+                "ON CONFLICT(talker) DO UPDATE SET last_seq = MAX(last_seq, excluded.last_seq)",
+                [(talker, seq) for talker, seq in marks.items() if seq is not None])
+            self._db.commit()
+        return added
+
+    def last_seq(self, talker: str) -> Optional[int]:
+        """获取会话已统计的最大 Seq"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT last_seq FROM term_marks WHERE talker = ?", (talker,)).fetchone()
+        return row[0] if row else None
+
+    def update_from_client(self, client: WetraceClient,
+                           talkers: Optional[List[str]] = None) -> int:
+        """
+        通过 API 增量统计会话的新消息
+
+        Args:
+            client: API 客户端
+            talkers: 会话列表（默认全部会话）
+
+        Returns:
+            新统计的文本消息条数
+        """
+        if talkers is None:
+            talkers = [session['UserName'] for session in client.iter_sessions()]
+        added = 0
+        for talker in talkers:
+            added += self.add_messages(
+                client.iter_messages_keyset(talker, after_seq=self.last_seq(talker),
+                                            fields=TERM_FIELDS))
+        return added
+
+    def update_from_mirror(self, store, talkers: Optional[List[str]] = None) -> int:
+        """
+        从本地镜像增量统计新消息
+
+        Args:
+            store: MirrorStore
+            talkers: 会话列表（默认镜像中的全部会话）
+
+        Returns:
+            新统计的文本消息条数
+        """
+        if talkers is None:
+            talkers = [session['UserName'] for session in store.get_sessions()]
+        added = 0
+        for talker in talkers:
+            added += self.add_messages(
+                store.iter_messages(talker, after_seq=self.last_seq(talker)))
+        return added
+
+    def remove_talker(self, talker: str):
+        """从词频库中移除会话"""
+        with self._lock:
+            self._db.execute("DELETE FROM term_buckets WHERE talker = ?", (talker,))
+            self._db.execute("DELETE FROM term_marks WHERE talker = ?", (talker,))
+            self._db.commit()
+
+    # ==================== 查询 ====================
+
+    def term_counts(self, talkers: Optional[Iterable[str]] = None,
+                    time_range: Optional[str] = None) -> TermCounts:
+        """
+        合并时间范围内指定会话的全部桶
+
+        Args:
+            talkers: 会话列表（默认全部会话）
+            time_range: 时间范围，按本地日期取整（起止时间所在的整天都计入）
+
+        Returns:
+            合并后的词频
+        """
+        conditions = []
+        params: List[Any] = []
+        start, end = parse_time_range(time_range)
+        if start is not None:
+            conditions.append("day >= ?")
+            params.append(self.day_of(start))
+        if end is not None:
+            conditions.append("day <= ?")
+            params.append(self.day_of(end))
+        wanted = set(talkers) if talkers is not None else None
+        if wanted is not None and len(wanted) <= 500:
+            conditions.append("talker IN ({})".format(', '.join('?' * len(wanted))))
+            params.extend(wanted)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        total = self._new_counts(exact_limit=None, top_k=None)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT talker, messages, tokens, counts, top, sketch FROM term_buckets {where}",
+                params)
+            for talker, *row in rows:
+                if wanted is None or talker in wanted:
+                    total.merge(TermCounts.from_row(*row, width=self.width, depth=self.depth))
+        return total
+
+    def wordcloud(self, talkers: Optional[Iterable[str]] = None,
+                  time_range: Optional[str] = None,
+                  limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        词云数据，结构与 get_wordcloud / get_global_wordcloud 一致
+
+        计数来自 Count-Min 草图的部分是估计值（不小于真实计数）。
+
+        Args:
+            talkers: 会话列表（默认全部会话）
+            time_range: 时间范围，按本地日期取整
+            limit: 返回的词数
+
+        Returns:
+            [{'Word': str, 'Count': int}]，按计数从大到小
+        """
+        counts = self.term_counts(talkers, time_range)
+        return [{'Word': term, 'Count': count} for term, count in counts.most_common(limit)]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取词频库统计
+
+        Returns:
+            桶数、使用草图的桶数、会话数、文本消息数、词数、分词方式和文件路径
+        """
+        with self._lock:
+            buckets, sketches, messages, tokens = self._db.execute(
+                "SELECT COUNT(*), COUNT(sketch), COALESCE(SUM(messages), 0), "
+                "COALESCE(SUM(tokens), 0) FROM term_buckets").fetchone()
+            talkers = self._db.execute("SELECT COUNT(*) FROM term_marks").fetchone()[0]
+        return {'path': self.path, 'tokenizer': self.tokenizer, 'buckets': buckets,
+                'sketch_buckets': sketches, 'talkers': talkers,
+                'messages': messages, 'tokens': tokens}